@@ -1,64 +1,82 @@
+from dataclasses import dataclass
+
 import mne
 import numpy as np
 import pandas as pd
+import scipy.fft
+from mne.io.constants import FIFF
+
 
+MINIBLOCK_CONDS = (
+    "ONEWORD/NONWORD/F1",
+    "ONEWORD/NONWORD/F2",
+    "ONEWORD/WORD/F1",
+    "ONEWORD/WORD/F2",
+    "TWOWORD/NONPHRASE/F1LEFT",
+    "TWOWORD/NONPHRASE/F1RIGHT",
+    "TWOWORD/NONWORD/F1LEFT",
+    "TWOWORD/NONWORD/F1RIGHT",
+    "TWOWORD/PHRASE/F1LEFT",
+    "TWOWORD/PHRASE/F1RIGHT",
+)
 
-def miniblock_events(raw: mne.io.Raw, offset=0):
+
+def miniblock_events(raw: mne.io.Raw, offset=0) -> tuple[np.ndarray, dict]:
+    """
+    Rewrite the annotations of `raw` in place to add a MINIBLOCK event at the start of every run
+    of identical word events, keeping any BAD annotations.
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Raw data with annotations for each word trigger, e.g. "ONEWORD_WORD_F1"
+    offset : int, optional
+        Number of samples by which to shift the word events. Each miniblock event is placed one
+        sample before the shifted first word, by default 0
+
+    Returns
+    -------
+    tuple[np.ndarray, dict]
+        The new events array and event id mapping, as `mne.events_from_annotations` would return
+        for the rewritten annotations (BAD annotations aside)
+    """
     oldannot = raw.annotations.copy()
-    events = list(mne.events_from_annotations(raw))
+    events, event_id = mne.events_from_annotations(raw)
     # Fix the event names to be MNE-compatible
-    events[1] = {k.replace("_", "/"): v for k, v in events[1].items()}
-    newev = []
-    conds = [
-        "ONEWORD/NONWORD/F1",
-        "ONEWORD/NONWORD/F2",
-        "ONEWORD/WORD/F1",
-        "ONEWORD/WORD/F2",
-        "TWOWORD/NONPHRASE/F1LEFT",
-        "TWOWORD/NONPHRASE/F1RIGHT",
-        "TWOWORD/NONWORD/F1LEFT",
-        "TWOWORD/NONWORD/F1RIGHT",
-        "TWOWORD/PHRASE/F1LEFT",
-        "TWOWORD/PHRASE/F1RIGHT",
-    ]
-    oldkeys = list(events[1].keys())
-    for k in oldkeys:
-        if k in conds:
-            newname = "MINIBLOCK/" + k
-            event_id = events[1][k]
-            events[1][newname] = event_id + 100
-    revlut = {v: k for k, v in events[1].items()}
-    for i in range(len(events[0])):
-        currev = events[0][i]
-        if revlut[currev[2]] not in conds:
-            newev.append(currev.reshape(-1, 1))
-            continue
-        if not events[0][i - 1, 2] == currev[2]:
-            miniblock = currev.copy()
-            miniblock[-1] += 100
-            miniblock[0] += offset - 1
-            newev.append(miniblock.reshape(-1, 1))
-        currev[0] += offset
-        newev.append(currev.reshape(-1, 1))
-    newev = np.concat(newev, axis=-1).T
+    event_id = {k.replace("_", "/"): v for k, v in event_id.items()}
+    for k in MINIBLOCK_CONDS:
+        if k in event_id:
+            event_id["MINIBLOCK/" + k] = event_id[k] + 100
+    revlut = {v: k for k, v in event_id.items()}
+
+    codes = events[:, 2]
+    is_cond = np.isin(codes, [event_id[k] for k in MINIBLOCK_CONDS if k in event_id])
+    # A miniblock starts wherever a condition differs from the event before it (cyclically, so
+    # the first event is compared against the last)
+    starts = np.flatnonzero(is_cond & (codes != np.roll(codes, 1)))
+    miniblocks = events[starts] + [offset - 1, 0, 100]
+    newev = events.copy()
+    newev[is_cond, 0] += offset
+    newev = np.insert(newev, starts, miniblocks, axis=0)
 
     annot = mne.annotations_from_events(
         events=newev, event_desc=revlut, sfreq=raw.info["sfreq"], first_samp=raw.first_samp
     )
+    bad = np.array(["BAD" in desc for desc in oldannot.description], dtype=bool)
+    if bad.any():
+        annot.append(
+            onset=oldannot.onset[bad] - raw.first_samp / raw.info["sfreq"],
+            duration=oldannot.duration[bad],
+            description=oldannot.description[bad],
+        )
 
-    for i in oldannot:
-        if i["description"].find("BAD") != -1:
-            annot.append(
-                onset=i["onset"] - raw.first_samp / raw.info["sfreq"],
-                duration=i["duration"],
-                description=i["description"],
-            )
-
-    raw = raw.set_annotations(annot)
+    raw.set_annotations(annot)
+    used = np.unique(newev[:, 2])
+    return newev, {k: v for k, v in event_id.items() if v in used}
 
 
 def snr_spectrum(psd, noise_n_neighbor_freqs=1, noise_skip_neighbor_freqs=1):
-    """Compute SNR spectrum from PSD spectrum using convolution.
+    """Compute SNR spectrum from PSD spectrum using prefix sums of the neighbouring bins.
 
     Parameters
     ----------
@@ -77,36 +95,129 @@ def snr_spectrum(psd, noise_n_neighbor_freqs=1, noise_skip_neighbor_freqs=1):
     snr : ndarray, shape ([n_trials, n_channels,] n_frequency_bins)
         Array containing SNR for all epochs, channels, frequency bins.
         NaN for frequencies on the edges, that do not have enough neighbors on
-        one side to calculate SNR.
+        one side to calculate SNR. Floating point inputs keep their dtype, so float32 PSDs
+        produce float32 SNRs.
 
     Notes
     -----
-    Taken from MNE documentation example for SSVEP at
-    https://mne.tools/stable/auto_tutorials/time-freq/50_ssvep.html
+    Adapted from the MNE documentation example for SSVEP at
+    https://mne.tools/stable/auto_tutorials/time-freq/50_ssvep.html, which convolved every
+    trial/channel row separately. Here the neighbour means for the whole array come from
+    differences of a cumulative sum along the frequency axis, so the cost is O(n) per row with
+    no Python-level loop over rows. Any NaN within the span of bins used for a given frequency
+    makes that SNR NaN, as it would with the convolution.
     """
-    # Construct a kernel that calculates the mean of the neighboring
-    # frequencies
-    averaging_kernel = np.concatenate((
-        np.ones(noise_n_neighbor_freqs),
-        np.zeros(2 * noise_skip_neighbor_freqs + 1),
-        np.ones(noise_n_neighbor_freqs),
-    ))
-    averaging_kernel /= averaging_kernel.sum()
+    psd = np.asarray(psd)
+    out_dtype = psd.dtype if np.issubdtype(psd.dtype, np.floating) else np.float64
+    mean_noise = _neighbor_mean(psd, noise_n_neighbor_freqs, noise_skip_neighbor_freqs, out_dtype)
+    return np.divide(psd, mean_noise, out=mean_noise)
 
-    # Calculate the mean of the neighboring frequencies by convolving with the
-    # averaging kernel.
-    mean_noise = np.apply_along_axis(
-        lambda psd_: np.convolve(psd_, averaging_kernel, mode="valid"), axis=-1, arr=psd
-    )
 
-    # The mean is not defined on the edges so we will pad it with nas. The
-    # padding needs to be done for the last dimension only so we set it to
-    # (0, 0) for the other ones.
+def _neighbor_mean(psd, n_neighbor, n_skip, out_dtype, chunk_elems=2**16):
+    """Mean of the `n_neighbor` bins on either side of each frequency, skipping `n_skip` bins.
+
+    Prefix sums are accumulated in float64 one block of rows at a time, so low-precision inputs
+    don't suffer from cancellation across the 1/f spectrum while the only full-size array
+    allocated is the output in `out_dtype`.
+    """
+    n_freqs = psd.shape[-1]
+    edge_width = n_neighbor + n_skip
+    n_valid = n_freqs - 2 * edge_width
+    mean_noise = np.full(psd.shape, np.nan, dtype=out_dtype)
+    if n_valid <= 0:
+        return mean_noise
+
+    rows = psd.reshape(-1, n_freqs)
+    out_rows = mean_noise.reshape(-1, n_freqs)
+    chunk = max(1, chunk_elems // n_freqs)
+    k, e = n_neighbor, edge_width
+    csum = np.zeros((min(chunk, rows.shape[0]), n_freqs + 1), dtype=np.float64)
+    for start in range(0, rows.shape[0], chunk):
+        block = rows[start : start + chunk]
+        bsum = csum[: block.shape[0]]
+        np.cumsum(block, axis=-1, dtype=np.float64, out=bsum[:, 1:])
+        # A NaN anywhere in a row carries through to the last prefix sum
+        nanrows = np.isnan(bsum[:, -1])
+        if nanrows.any():
+            nanmask = np.isnan(block)
+            np.cumsum(np.where(nanmask, 0, block), axis=-1, dtype=np.float64, out=bsum[:, 1:])
+        # Bin i uses [i - e, i - skip) on the left and (i + skip, i + e] on the right
+        noise = bsum[:, k : k + n_valid] - bsum[:, :n_valid]
+        noise += bsum[:, 2 * e + 1 :]
+        noise -= bsum[:, 2 * e + 1 - k : 2 * e + 1 - k + n_valid]
+        noise /= 2 * n_neighbor
+        if nanrows.any():
+            ncount = np.zeros((block.shape[0], n_freqs + 1), dtype=np.intp)
+            np.cumsum(nanmask, axis=-1, out=ncount[:, 1:])
+            noise[(ncount[:, 2 * e + 1 :] - ncount[:, :n_valid]) > 0] = np.nan
+        out_rows[start : start + chunk, e : n_freqs - e] = noise
+    return mean_noise
+
+
+def snr_at(psd, freqs, targets, noise_n_neighbor_freqs=1, noise_skip_neighbor_freqs=1):
+    """Compute SNR only at the frequency bins nearest to a set of target frequencies.
+
+    Parameters
+    ----------
+    psd : ndarray, shape ([n_trials, n_channels,] n_frequency_bins)
+        Data object containing PSD values, as for `snr_spectrum`.
+    freqs : ndarray, shape (n_frequency_bins,)
+        Frequencies of the bins along the last axis of `psd`. Must be sorted.
+    targets : iterable of float
+        Frequencies at which to compute SNR, e.g. from `imfreqs.im_frequencies`.
+    noise_n_neighbor_freqs : int
+        Number of neighboring frequencies used to compute noise level.
+        increment by one to add one frequency bin ON BOTH SIDES
+    noise_skip_neighbor_freqs : int
+        set this >=1 if you want to exclude the immediately neighboring
+        frequency bins in noise level calculation
+
+    Returns
+    -------
+    snr : ndarray, shape ([n_trials, n_channels,] n_targets)
+        SNR at the bin nearest to each target. Equal to `snr_spectrum` at those bins, including
+        NaN for targets too close to the edge of the spectrum to have all neighbours.
+    bins : ndarray of int, shape (n_targets,)
+        Index of the frequency bin used for each target.
+    """
+    psd = np.asarray(psd)
+    freqs = np.asarray(freqs)
+    bins = nearest_bins(freqs, np.fromiter(targets, dtype=float))
     edge_width = noise_n_neighbor_freqs + noise_skip_neighbor_freqs
-    pad_width = [(0, 0)] * (mean_noise.ndim - 1) + [(edge_width, edge_width)]
-    mean_noise = np.pad(mean_noise, pad_width=pad_width, constant_values=np.nan)
+    offsets = np.concatenate((
+        np.arange(-edge_width, -noise_skip_neighbor_freqs),
+        np.arange(noise_skip_neighbor_freqs + 1, edge_width + 1),
+    ))
+    window = bins[:, None] + offsets[None, :]
+    valid = (bins >= edge_width) & (bins < psd.shape[-1] - edge_width)
+    window = np.clip(window, 0, psd.shape[-1] - 1)
+    mean_noise = psd[..., window].mean(axis=-1)
+    mean_noise[..., ~valid] = np.nan
+    return psd[..., bins] / mean_noise, bins
+
 
-    return psd / mean_noise
+def nearest_bins(freqs, targets):
+    """Index of the bin in the sorted array `freqs` nearest to each of `targets`."""
+    targets = np.asarray(targets, dtype=float)
+    right = np.clip(np.searchsorted(freqs, targets), 1, len(freqs) - 1)
+    left = right - 1
+    return np.where(targets - freqs[left] <= freqs[right] - targets, left, right)
+
+
+def pick_ch_names(info: mne.Info, picks="data", exclude="bads", allow_empty=False) -> list[str]:
+    """
+    Names of the channels of `info` selected by `picks`, as by `Epochs.pick` with `exclude`. With
+    the default `exclude`, bad channels are dropped from string picks such as "data", as by
+    `Epochs.get_data`.
+    """
+    # A one-sample evoked response over the channels, to select them with the public `pick`
+    evoked = mne.EvokedArray(np.zeros((len(info["ch_names"]), 1)), info, verbose=False)
+    try:
+        return evoked.pick(picks, exclude=exclude).ch_names
+    except ValueError:
+        if allow_empty:
+            return []
+        raise
 
 
 def itc_epochs(
@@ -117,25 +228,392 @@ def itc_epochs(
     tmax: float = None,
     n_ministim: int = 10,
     n_jobs=-1,
-):
-    picks = mne.pick_types(epochs.info, meg=True, exclude=[])
-    psd = epochs.compute_psd(
-        picks=picks,
-        method="welch",
-        n_fft=int(epochs.info["sfreq"] * (tmax - tmin)),
-        n_overlap=0,
-        n_per_seg=int(epochs.info["sfreq"] * (tmax - tmin) / n_ministim),
-        tmin=tmin,
-        tmax=tmax,
-        fmin=fmin,
-        fmax=fmax,
-        window="boxcar",
-        output="complex",
-        n_jobs=n_jobs,
-    )
-    ch_names = epochs[0].copy().pick(picks, exclude="bads").ch_names
-    psds, freqs = psd.get_data(picks=picks, return_freqs=True)
-    angles = np.angle(psds)
-    coherences = np.abs(np.mean(np.exp(1j * angles), axis=0))
-    coherences = pd.DataFrame(coherences, index=np.array(ch_names)[picks], columns=freqs)
-    return coherences
+    picks="meg",
+    chunk_size: int = 8,
+) -> tuple[pd.DataFrame, int]:
+    """Inter-trial coherence of the word-locked spectrum of each epoch, streamed in chunks.
+
+    Each epoch is cut into `n_ministim` boxcar segments (one per word), each zero-padded to the
+    length of the whole window, and the complex coefficients of the segments are averaged, as
+    `compute_psd(method="welch", output="complex", n_overlap=0)` does. The FFT is linear, so this
+    is a single FFT of the average of the demeaned segments. The coefficients of `chunk_size`
+    epochs at a time are normalized to unit magnitude in place and summed into a `RunningITC`,
+    so memory does not grow with the number of epochs.
+
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epochs to use. Need not be preloaded, only `chunk_size` epochs are read at a time.
+    fmin, fmax : float
+        Frequency range to keep.
+    tmin, tmax : float
+        Time range of each epoch to use.
+    n_ministim : int
+        Number of segments to cut the time range into.
+    n_jobs : int
+        Number of workers for `scipy.fft.rfft`.
+    picks : str | list
+        Channels to use, as in `Epochs.get_data`. Bad channels are excluded for string picks.
+    chunk_size : int
+        Number of epochs to read and transform at once.
+
+    Returns
+    -------
+    pd.DataFrame
+        ITC of each channel (rows) and frequency (columns)
+    int
+        Number of epochs the ITC was computed over, e.g. to correct its bias
+    """
+    sfreq = epochs.info["sfreq"]
+    ch_names = pick_ch_names(epochs.info, picks)
+    n_fft = int(sfreq * (tmax - tmin))
+    n_per_seg = int(sfreq * (tmax - tmin) / n_ministim)
+    allfreqs = np.arange(n_fft // 2 + 1) * (sfreq / n_fft)
+    fsl = slice(*(np.flatnonzero((allfreqs >= fmin) & (allfreqs <= fmax))[[0, -1]] + [0, 1]))
+
+    running = RunningITC()
+    for start in range(0, len(epochs), chunk_size):
+        items = np.arange(start, min(start + chunk_size, len(epochs)))
+        data = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=items)
+        n_seg = (data.shape[-1] - n_per_seg) // n_per_seg + 1
+        segments = data[..., : n_seg * n_per_seg].reshape(*data.shape[:-1], n_seg, n_per_seg)
+        segments = segments.mean(axis=-2)
+        segments -= segments.mean(axis=-1, keepdims=True)
+        running.update(scipy.fft.rfft(segments, n=n_fft, axis=-1, workers=n_jobs)[..., fsl])
+    coherences = pd.DataFrame(running.itc, index=np.array(ch_names), columns=allfreqs[fsl])
+    return coherences, running.count
+
+
+@dataclass
+class EpochSpectra:
+    """Complex spectra of every epoch, computed once and shared by all condition subsets.
+
+    The coefficients are those of a single boxcar-windowed FFT per epoch (the Welch settings in
+    `analysis_spec.sensor_fft_pars` with one segment), scaled so that their squared magnitude is
+    the one-sided PSD `compute_psd` would return. Subsets are selected with the same "/"-separated
+    tags as `mne.Epochs`, e.g. `spectra["MINIBLOCK/ONEWORD/F1"]`.
+    """
+
+    coefs: np.ndarray
+    freqs: np.ndarray
+    events: np.ndarray
+    event_id: dict
+    ch_names: list
+
+    @classmethod
+    def from_epochs(
+        cls,
+        epochs: mne.Epochs,
+        fmin: float,
+        fmax: float,
+        tmin: float | None = None,
+        tmax: float | None = None,
+        n_fft: int | None = None,
+        picks="data",
+        remove_dc: bool = True,
+        dtype=np.complex128,
+        n_jobs: int = -1,
+    ):
+        """Compute the spectra of `epochs` one epoch at a time.
+
+        Parameters
+        ----------
+        epochs : mne.Epochs
+            Epochs to transform. Need not be preloaded.
+        fmin, fmax : float
+            Frequency range to keep, as in `compute_psd`.
+        tmin, tmax : float | None
+            Time range of each epoch to use. The FFT covers the first `n_fft` samples from tmin.
+        n_fft : int | None
+            FFT length, by default the number of samples between tmin and tmax.
+        picks : str | list
+            Channels to keep, as in `Epochs.get_data`. Bad channels are excluded for string picks.
+        remove_dc : bool
+            Whether to remove the mean of each epoch before the FFT, as `compute_psd` does.
+        dtype : numpy dtype
+            Complex dtype of the stored coefficients.
+        n_jobs : int
+            Number of workers for `scipy.fft.rfft`.
+        """
+        sfreq = epochs.info["sfreq"]
+        ch_names = pick_ch_names(epochs.info, picks)
+        first = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=[0])
+        n_times = first.shape[-1]
+        if n_fft is None:
+            n_fft = n_times
+        elif n_fft > n_times:
+            raise ValueError(f"n_fft of {n_fft} is longer than the {n_times} samples available.")
+
+        allfreqs = np.arange(n_fft // 2 + 1) * (sfreq / n_fft)
+        fsl = slice(*(np.flatnonzero((allfreqs >= fmin) & (allfreqs <= fmax))[[0, -1]] + [0, 1]))
+        # One-sided density scaling of a boxcar window, with every bin but DC and Nyquist doubled
+        scale = np.full(len(allfreqs), 2.0 / (sfreq * n_fft))
+        scale[0] = 1.0 / (sfreq * n_fft)
+        if n_fft % 2 == 0:
+            scale[-1] = 1.0 / (sfreq * n_fft)
+        scale = np.sqrt(scale[fsl])
+
+        coefs = np.empty((len(epochs), len(ch_names), fsl.stop - fsl.start), dtype=dtype)
+        for i in range(len(epochs)):
+            data = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=[i])[0, :, :n_fft]
+            if remove_dc:
+                data = data - data.mean(axis=-1, keepdims=True)
+            coefs[i] = scipy.fft.rfft(data, n=n_fft, axis=-1, workers=n_jobs)[:, fsl] * scale
+        return cls(
+            coefs=coefs,
+            freqs=allfreqs[fsl],
+            events=epochs.events[:, 2].copy(),
+            event_id=dict(epochs.event_id),
+            ch_names=ch_names,
+        )
+
+    def select(self, key: str | None = None) -> np.ndarray:
+        """Indices of the epochs matching all "/"-separated tags in `key` (all epochs if None)."""
+        if key is None:
+            return np.arange(len(self.events))
+        tags = set(key.split("/"))
+        codes = [v for k, v in self.event_id.items() if tags.issubset(k.split("/"))]
+        if not codes:
+            raise KeyError(f"No events match {key!r}")
+        return np.flatnonzero(np.isin(self.events, codes))
+
+    def __getitem__(self, key: str) -> "EpochSpectra":
+        idx = self.select(key)
+        return EpochSpectra(
+            coefs=self.coefs[idx],
+            freqs=self.freqs,
+            events=self.events[idx],
+            event_id=self.event_id,
+            ch_names=self.ch_names,
+        )
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def psd(self, key: str | None = None, average: bool = False) -> np.ndarray:
+        """PSD per epoch, shape (n_epochs, n_channels, n_freqs), for the epochs matching `key`.
+
+        With `average`, the PSD of the evoked response (mean of the complex coefficients) is
+        returned instead, shape (n_channels, n_freqs), as `epochs[key].average().compute_psd()`.
+        """
+        coefs = self.coefs[self.select(key)]
+        if average:
+            coefs = coefs.mean(axis=0)
+        return coefs.real**2 + coefs.imag**2
+
+    def snr(self, key: str | None = None, average: bool = False, **snr_kwargs) -> np.ndarray:
+        """SNR spectrum of `psd(key, average)`, with keyword arguments passed to `snr_spectrum`."""
+        return snr_spectrum(self.psd(key, average), **snr_kwargs)
+
+    def itc(self, key: str | None = None) -> np.ndarray:
+        """Inter-trial coherence across the epochs matching `key`, shape (n_channels, n_freqs)."""
+        coefs = self.coefs[self.select(key)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.abs(np.mean(coefs / np.abs(coefs), axis=0))
+
+
+@dataclass
+class InverseKernel:
+    """Imaging kernel of a minimum-norm inverse operator, for use on sensor spectra.
+
+    The inverse is linear, so the complex spectrum of a source time course is the kernel applied
+    to the sensor spectra. Projecting the FFT coefficients of `EpochSpectra` gives the same source
+    PSD as `apply_inverse` followed by a single-segment boxcar `psd_array_welch`, without ever
+    forming the source time courses.
+
+    With a free or loose orientation inverse and `pick_ori=None`, the power of the three
+    orientations is summed, i.e. the PSD of the vector source estimate. `apply_inverse` instead
+    takes the norm of the three orientations at every sample before the PSD is computed, which is
+    not linear and so cannot be done in the frequency domain. Fixed orientation inverses and
+    `pick_ori="normal"` match the time domain path exactly.
+    """
+
+    kernel: np.ndarray
+    ch_names: list
+    vertices: list
+    n_orient: int
+    noise_norm: np.ndarray | None
+    nave: int
+    subject: str | None = None
+
+    @classmethod
+    def from_inverse(
+        cls,
+        inverse_operator: mne.minimum_norm.InverseOperator,
+        lambda2: float,
+        method: str = "MNE",
+        pick_ori: str | None = None,
+        nave: int = 1,
+    ):
+        """Prepare `inverse_operator` with `prepare_inverse_operator` and take its kernel from
+        `apply_inverse`.
+
+        The kernel does not depend on `nave`. The dSPM and sLORETA noise normalisation does, and
+        is rescaled for the number of averages when the kernel is applied.
+        """
+        if pick_ori == "vector":
+            raise ValueError("Use pick_ori=None to get the summed power of each orientation.")
+        inv = mne.minimum_norm.prepare_inverse_operator(
+            inverse_operator, nave, lambda2, method, copy="non-src", verbose=False
+        )
+        free = inv["source_ori"] == FIFF.FIFFV_MNE_FREE_ORI and pick_ori != "normal"
+        n_orient = 3 if free else 1
+        ch_names = list(inv["noise_cov"].ch_names)
+        picks = mne.pick_channels(inv["info"]["ch_names"], ch_names, ordered=True)
+        ch_types = inv["info"].get_channel_types(picks)
+        # The inverse is linear, so its source estimate of an identity "evoked" response, one
+        # channel per sample, is the kernel itself
+        identity = mne.EvokedArray(
+            np.eye(len(ch_names)),
+            mne.create_info(ch_names, 1.0, ch_types),
+            nave=nave,
+            verbose=False,
+        )
+        identity.add_proj(inv["projs"], verbose=False)
+
+        def kernel_of(kernel_method):
+            stc = mne.minimum_norm.apply_inverse(
+                identity,
+                inv,
+                lambda2,
+                kernel_method,
+                pick_ori="vector" if free else pick_ori,
+                prepared=True,
+                verbose=False,
+            )
+            return stc, stc.data.reshape(-1, len(ch_names))
+
+        stc, kernel = kernel_of(method)
+        noise_norm = None
+        if method in ("dSPM", "sLORETA"):
+            # The noise normalisation scales the rows of each source of the MNE kernel
+            _, mne_kernel = kernel_of("MNE")
+            noise_norm = np.linalg.norm(kernel.reshape(-1, n_orient * len(ch_names)), axis=1)
+            noise_norm /= np.linalg.norm(mne_kernel.reshape(-1, n_orient * len(ch_names)), axis=1)
+            kernel = mne_kernel
+        return cls(
+            kernel=kernel,
+            ch_names=ch_names,
+            vertices=stc.vertices,
+            n_orient=n_orient,
+            noise_norm=noise_norm,
+            nave=nave,
+            subject=stc.subject,
+        )
+
+    def psd(
+        self,
+        spectra: EpochSpectra,
+        key: str | None = None,
+        average: bool = True,
+        chunk_freqs: int = 256,
+    ) -> np.ndarray:
+        """Source PSD of the epochs of `spectra` matching `key`.
+
+        Parameters
+        ----------
+        spectra : EpochSpectra
+            Sensor spectra, which must include every channel of the inverse operator.
+        key : str | None
+            Epoch selection, as in `EpochSpectra.psd`.
+        average : bool
+            Whether to project the evoked spectrum (shape (n_sources, n_freqs), as the inverse of
+            `epochs[key].average()`) or every epoch (shape (n_epochs, n_sources, n_freqs)).
+        chunk_freqs : int
+            Number of frequencies to project at once, bounding the memory used for the complex
+            source spectra of the free orientation components.
+        """
+        try:
+            chidx = [spectra.ch_names.index(ch) for ch in self.ch_names]
+        except ValueError as e:
+            raise ValueError(f"Spectra are missing a channel of the inverse operator: {e}")
+        idx = spectra.select(key)
+        coefs = spectra.coefs[idx][:, chidx]
+        if average:
+            coefs = coefs.mean(axis=0)
+        nave = len(idx) if average else 1
+
+        n_freqs = coefs.shape[-1]
+        out = np.empty((*coefs.shape[:-2], len(self.kernel) // self.n_orient, n_freqs))
+        for start in range(0, n_freqs, chunk_freqs):
+            fsl = slice(start, start + chunk_freqs)
+            # The kernel is real, so the real and imaginary parts are projected separately
+            power = np.matmul(self.kernel, coefs[..., fsl].real) ** 2
+            power += np.matmul(self.kernel, coefs[..., fsl].imag) ** 2
+            if self.n_orient > 1:
+                power = power.reshape(*power.shape[:-2], -1, self.n_orient, power.shape[-1])
+                power = power.sum(axis=-2)
+            out[..., fsl] = power
+        if self.noise_norm is not None:
+            # Noise normalisation scales with the square root of the number of averages
+            out *= (self.noise_norm**2 * (nave / self.nave))[:, None]
+        return out
+
+
+@dataclass
+class RunningMean:
+    """
+    Running mean and variance of a stream of equally shaped arrays, using Welford's algorithm.
+
+    Only the mean and the sum of squared deviations are kept, so memory does not grow with the
+    number of arrays added. Accumulation is done in float64 regardless of the input dtype.
+    """
+
+    count: int = 0
+    mean: np.ndarray | None = None
+    m2: np.ndarray | None = None
+
+    def update(self, data: np.ndarray):
+        data = np.asarray(data, dtype=np.float64)
+        self.count += 1
+        if self.mean is None:
+            self.mean = data.copy()
+            self.m2 = np.zeros_like(self.mean)
+            return
+        delta = data - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (data - self.mean)
+
+    @property
+    def var(self) -> np.ndarray:
+        """Sample variance (ddof=1). NaN with fewer than two arrays."""
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def sem(self) -> np.ndarray:
+        """Standard error of the mean."""
+        return np.sqrt(self.var / self.count)
+
+
+@dataclass
+class RunningITC:
+    """
+    Running inter-trial coherence of a stream of complex coefficients, one chunk of epochs at a
+    time along the first axis.
+
+    Each chunk is normalized to unit magnitude in place and only the sum of the unit phasors is
+    kept, so memory does not grow with the number of epochs. The ITC of `count` epochs is biased
+    upwards, by about `1 / sqrt(count)` for random phases.
+    """
+
+    count: int = 0
+    total: np.ndarray | None = None
+
+    def update(self, coefs: np.ndarray):
+        """Add a chunk of coefficients of shape (n_epochs, ...), which is overwritten."""
+        magnitude = np.abs(coefs)
+        # Coefficients of zero magnitude have no phase and add nothing to the sum
+        np.divide(coefs, magnitude, out=coefs, where=magnitude > 0)
+        chunk_sum = coefs.sum(axis=0, dtype=np.complex128)
+        self.count += len(coefs)
+        if self.total is None:
+            self.total = chunk_sum
+        else:
+            self.total += chunk_sum
+
+    @property
+    def itc(self) -> np.ndarray:
+        """Inter-trial coherence, the magnitude of the mean unit phasor."""
+        return np.abs(self.total) / self.count
@@ -0,0 +1,626 @@
+"""
+The design of a session: splitting the stimuli into miniblocks, ordering them and assigning the
+tag frequencies, for the seed and stimulus group chosen at the start of the experiment.
+
+Miniblocks are ordered on integer arrays, so that a design is drawn in milliseconds and
+reproducibly for any seed. Designs can also be generated and validated ahead of time for many
+seeds (see `scripts/design/generate_designs.py`) and saved to a design file, from which the
+experiment loads the design of a seed instead of preparing it at the start of the session.
+"""
+
+import hashlib
+from collections.abc import Sequence
+from functools import lru_cache
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from intermodulation.queries import QueryIndex
+
+
+def count_orderings(counts: np.ndarray, max_run: int = 2) -> np.ndarray:
+    """
+    Count the orderings of items of several conditions in which no condition is repeated more
+    than `max_run` times in a row.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Number of items of each condition
+    max_run : int, optional
+        Longest allowed run of one condition, by default 2
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (*(counts + 1), len(counts) + 1, max_run + 1). Entry `[*remaining, last,
+        run]` is the number of valid orderings of `remaining` items of each condition after a run
+        of `run` items of condition `last`. Before the first item `last` is `len(counts)` and
+        `run` is 0. Counts are floats, as they overflow integers for long designs.
+    """
+    return _count_orderings(tuple(int(n) for n in counts), max_run).copy()
+
+
+@lru_cache(maxsize=16)
+def _count_orderings(counts: tuple[int, ...], max_run: int) -> np.ndarray:
+    # Cached, as the blocks of a design have the same condition counts
+    counts = np.array(counts)
+    n_conds = len(counts)
+    ways = np.zeros((*(counts + 1), n_conds + 1, max_run + 1))
+    ways[(0,) * n_conds] = 1.0
+    # Removing an item gives a lexicographically smaller index, which is filled in first
+    for remaining in np.ndindex(*(counts + 1)):
+        if not any(remaining):
+            continue
+        for cond in np.flatnonzero(remaining):
+            after = list(remaining)
+            after[cond] -= 1
+            after = tuple(after)
+            # Switching to `cond` from any other condition starts a run of 1
+            switch = np.arange(n_conds + 1) != cond
+            ways[remaining][switch, :] += ways[after][cond, 1]
+            # Continuing a run of `cond`, as long as it is shorter than `max_run`
+            ways[remaining][cond, 1:max_run] += ways[after][cond, 2:]
+    return ways
+
+
+def constrained_order(labels: np.ndarray, rng: np.random.Generator, max_run: int = 2) -> np.ndarray:
+    """
+    Draw a uniformly random ordering of `labels` in which no label is repeated more than `max_run`
+    times in a row.
+
+    The label sequence is drawn one position at a time, weighting each label by the number of
+    valid orderings that remain after it, which takes a fixed number of steps. The items of each
+    label are then placed in a random order.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        Condition label of each item
+    rng : np.random.Generator
+        Random number generator to draw the ordering with
+    max_run : int, optional
+        Longest allowed run of one label, by default 2
+
+    Returns
+    -------
+    np.ndarray
+        Indices into `labels` in the drawn order
+
+    Raises
+    ------
+    ValueError
+        If no ordering of the labels satisfies the constraint
+    """
+    _, codes = np.unique(labels, return_inverse=True)
+    counts = np.bincount(codes)
+    n_conds = len(counts)
+    ways = _count_orderings(tuple(counts.tolist()), max_run)
+    remaining = counts.copy()
+    last, run = n_conds, 0
+    if ways[(*remaining, last, run)] == 0:
+        raise ValueError(
+            f"No ordering of {dict(zip(*np.unique(labels, return_counts=True)))} repeats a "
+            f"condition at most {max_run} times in a row."
+        )
+
+    sequence = np.empty(len(codes), dtype=int)
+    for pos in range(len(codes)):
+        weights = np.zeros(n_conds)
+        for cond in np.flatnonzero(remaining):
+            next_run = run + 1 if cond == last else 1
+            if next_run > max_run:
+                continue
+            remaining[cond] -= 1
+            weights[cond] = ways[(*remaining, cond, next_run)]
+            remaining[cond] += 1
+        cond = rng.choice(n_conds, p=weights / weights.sum())
+        run = run + 1 if cond == last else 1
+        last = cond
+        remaining[cond] -= 1
+        sequence[pos] = cond
+
+    order = np.empty(len(codes), dtype=int)
+    for cond in range(n_conds):
+        order[sequence == cond] = rng.permutation(np.flatnonzero(codes == cond))
+    return order
+
+
+def split_blocks(
+    groups: np.ndarray,
+    conditions: np.ndarray,
+    miniblock_len: int,
+    n_blocks: int,
+    rng: np.random.Generator,
+    max_run: int = 2,
+) -> np.ndarray:
+    """
+    Split items into blocks with an equal share of each group, cut each group's share into
+    miniblocks and order the miniblocks of each block with `constrained_order`.
+
+    Items left over when a group does not divide evenly into blocks, or its share into
+    miniblocks, are not used.
+
+    Parameters
+    ----------
+    groups : np.ndarray
+        Group of each item, every miniblock has items of a single group
+    conditions : np.ndarray
+        Condition of each item, constant within a group, which must not repeat more than
+        `max_run` times in a row in the miniblock order
+    miniblock_len : int
+        Number of items per miniblock
+    n_blocks : int
+        Number of blocks
+    rng : np.random.Generator
+        Random number generator to sample and order the miniblocks with
+    max_run : int, optional
+        Longest allowed run of miniblocks of one condition, by default 2
+
+    Returns
+    -------
+    np.ndarray
+        Indices of the used items in order, miniblock `i` being entries `i * miniblock_len` to
+        `(i + 1) * miniblock_len`
+    """
+    pools = [rng.permutation(np.flatnonzero(groups == group)) for group in np.unique(groups)]
+    blocks = []
+    for block in range(n_blocks):
+        miniblocks = []
+        for pool in pools:
+            per_block = len(pool) // n_blocks
+            n_mini = per_block // miniblock_len
+            start = block * per_block
+            miniblocks.append(
+                pool[start : start + n_mini * miniblock_len].reshape(n_mini, miniblock_len)
+            )
+        miniblocks = np.concatenate(miniblocks)
+        blocks.append(miniblocks[constrained_order(conditions[miniblocks[:, 0]], rng, max_run)])
+    return np.concatenate(blocks).ravel()
+
+
+def balanced_block_split(
+    df: pd.DataFrame, miniblock_len: int, N_blocks: int, rng: np.random.Generator
+) -> pd.DataFrame:
+    sampdf = df.copy().reset_index()
+    if "invertible" in df.columns:
+        groupers = ["condition", "invertible"]
+    else:
+        groupers = ["condition"]
+    # Sample the miniblocks of each block from each group, and order them so that the main
+    # condition isn't repeated more than 2x, on the integer group codes of the rows
+    groups = sampdf.groupby(groupers).ngroup().to_numpy()
+    rows = split_blocks(groups, sampdf["condition"].to_numpy(), miniblock_len, N_blocks, rng)
+
+    blockdf = sampdf.iloc[rows].reset_index(drop=True)
+    try:
+        blockdf = blockdf.drop(columns=["Unnamed: 0", "index"])
+    except KeyError:
+        pass
+    blockdf["miniblock"] = np.repeat(np.arange(len(rows) // miniblock_len), miniblock_len)
+    return blockdf
+
+
+def shuffle_condition(df: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Shuffle the condition column of a DataFrame, while keeping the number of each condition the same.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with a column named 'condition' that should be shuffled
+    rng : np.random.Generator
+        Random number generator to use for shuffling
+
+    Returns
+    -------
+    pd.DataFrame
+        The input DataFrame with the 'condition' column shuffled
+    """
+    df = df.copy()
+    if "invertible" in df.columns:
+        grp = df.groupby(["condition", "invertible"])
+    else:
+        grp = df.groupby("condition")
+    return grp.sample(frac=1, random_state=rng).reset_index(drop=True)
+
+
+def split_miniblocks(
+    df: pd.DataFrame,
+    miniblock_len: int,
+    N_blocks: int | None = None,
+    rng: np.random.Generator = np.random.default_rng(),
+    dup_extra: bool = False,
+) -> pd.DataFrame:
+    """
+    Split a dataframe into mini-blocks of a given length, and assign a miniblock number to each row.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe of stimuli which must have a 'condition' column. The number of elements per
+        condition must be divisible by the miniblock length if `dup_extra` is False.
+    miniblock_len : int
+        Length of each mini-block
+    rng : np.random.Generator
+        Random state to pass to the sampling function.
+    dup_extra : bool, optional
+        If the number of stimuli in a condition are not a whole-number multiple of `miniblock_len`,
+        whether to duplicate some elements to reach the whole-number. By default False
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe with new column `miniblock` containing the miniblock number for each row
+    """
+    df = df.copy()
+    n_mini = len(df) / miniblock_len  # Number of mini-blocks
+    if n_mini % 1 != 0:  # make sure we're not dropping stimuli
+        if not dup_extra:
+            raise ValueError("The miniblock length does not evently divide the number of stimuli.")
+        else:
+            condrem = {
+                cond: len(df.query(f"condition == '{cond}'")) % miniblock_len
+                for cond in df["condition"].unique()
+            }
+            dups = []
+            for cond, n in condrem.items():
+                dups.append(df.query(f"condition == '{cond}'").sample(n, random_state=rng))
+            dupdf = pd.concat(dups, ignore_index=True)
+            df = pd.concat([df, dupdf], ignore_index=True)
+    if N_blocks is not None:
+        df = balanced_block_split(df, miniblock_len, N_blocks, rng)
+    else:
+        df = balanced_block_split(df, miniblock_len, 1, rng)
+    return df
+
+
+def assign_miniblock_freqs(
+    df: pd.DataFrame, freqs: Sequence[float], rng: np.random.Generator = np.random.default_rng()
+) -> pd.DataFrame:
+    """
+    Tag the words of each miniblock with one of two frequencies, balancing the number of
+    miniblocks of each condition with `freqs[0]` (F1) and `freqs[1]` (F2) on the first word.
+
+    The F1/F2 order of the miniblocks of each condition is a random permutation, drawn for the
+    conditions in sorted order, whose i-th entry tags the condition's i-th miniblock by miniblock
+    number. The rows of a miniblock don't need to be contiguous.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Word list with `miniblock` and `condition` columns, and a `w2` column for two-word lists
+    freqs : Sequence[float]
+        The F1 and F2 frequencies
+    rng : np.random.Generator
+        Random state to draw the tag order with
+
+    Returns
+    -------
+    pd.DataFrame
+        Copy of `df` with the frequency of the first word in `w1_freq`, and the other frequency in
+        `w2_freq` for two-word lists
+
+    Raises
+    ------
+    ValueError
+        If a miniblock has words of several conditions
+    """
+    df = df.copy()
+    freqs = np.asarray(freqs, dtype=float)
+    # Factorize the miniblocks once, numbered in order, and take the condition of each
+    mini_codes, _ = pd.factorize(df["miniblock"], sort=True)
+    cond_codes, conds = pd.factorize(df["condition"], sort=True)
+    mini_conds = np.zeros(mini_codes.max() + 1, dtype=int)
+    mini_conds[mini_codes] = cond_codes
+    if np.any(mini_conds[mini_codes] != cond_codes):
+        raise ValueError("Each miniblock must have words of a single condition.")
+
+    # We want to balance the number of F1 and F2 tags in each condition, so we will create a
+    # balanced number of F1/F2 blocks and shuffle the indices. This biases our miniblocks to have
+    # one more F2 tag (idx 1) if there are an uneven number.
+    mini_tags = np.empty(len(mini_conds), dtype=int)
+    for cond in range(len(conds)):
+        cond_minis = np.flatnonzero(mini_conds == cond)
+        halfcondmini = len(cond_minis) // 2
+        freqids = np.concatenate([np.zeros(halfcondmini), np.ones(len(cond_minis) - halfcondmini)])
+        mini_tags[cond_minis] = rng.permutation(freqids)
+
+    # A single gather from the miniblock tags to the rows
+    tags = mini_tags[mini_codes]
+    df["w1_freq"] = freqs[tags]
+    if "w2" in df.columns:
+        df["w2_freq"] = freqs[1 - tags]
+    return df
+
+
+def prep_miniblocks(
+    task: Literal["twoword", "oneword"],
+    rng: np.random.Generator,
+    df: pd.DataFrame,
+    miniblock_len: int,
+    N_blocks: int | None,
+    freqs: Sequence[float],
+) -> pd.DataFrame:
+    # Shuffle within conditions and split into miniblocks.
+    miniblock_df = split_miniblocks(df, miniblock_len, N_blocks, rng)
+    # Assign frequencies to each miniblock
+    outdf = assign_miniblock_freqs(miniblock_df, freqs, rng)
+    return outdf
+
+
+def load_prep_words(
+    path_1w: str | Path,
+    path_2w: str | Path,
+    rng: np.random.Generator,
+    miniblock_len: int,
+    N_blocks: int,
+    freqs: Sequence[float],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    twowords = pd.read_csv(path_2w, index_col=0)
+    onewords = pd.read_csv(path_1w, index_col=0)
+    return prep_words(onewords, twowords, rng, miniblock_len, N_blocks, freqs)
+
+
+def prep_words(
+    onewords: pd.DataFrame,
+    twowords: pd.DataFrame,
+    rng: np.random.Generator,
+    miniblock_len: int,
+    N_blocks: int,
+    freqs: Sequence[float],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Prepare word stimuli by first shuffling, then assigning frequencies
+    twowords = twowords.sample(frac=1, random_state=rng)
+    twowords = prep_miniblocks("twoword", rng, twowords, miniblock_len, N_blocks, freqs)
+    onewords = onewords.sample(frac=1, random_state=rng)
+    onewords = prep_miniblocks("oneword", rng, onewords, miniblock_len, N_blocks=None, freqs=freqs)
+    return onewords, twowords, query_words(onewords, twowords)
+
+
+def query_words(onewords: pd.DataFrame, twowords: pd.DataFrame) -> pd.DataFrame:
+    # Generate a list of all used words together with their categories, for the query task
+    all_2w = pd.melt(
+        twowords,
+        id_vars=["w1_type", "w2_type"],
+        value_vars=["w1", "w2"],
+        var_name="position",
+        value_name="word",
+    )
+    all_2w["cond"] = all_2w["w1_type"].where(all_2w["position"] == "w1", all_2w["w2_type"])
+    all_2w = all_2w[["word", "cond"]]
+    allwords = pd.concat(
+        [
+            all_2w,
+            onewords[["w1", "condition"]].rename(columns={"w1": "word", "condition": "cond"}),
+        ],
+        ignore_index=True,
+    ).drop_duplicates()
+    return allwords
+
+
+def stimulus_paths(stimpath: str | Path, group: Literal["even", "odd"]) -> tuple[Path, Path]:
+    """Paths of the one-word and two-word stimulus lists of a stimulus group."""
+    stimpath = Path(stimpath)
+    return (
+        stimpath / f"{group}_one_word_stimuli.csv",
+        stimpath / f"new_{group}_two_word_stimuli.csv",
+    )
+
+
+def stimulus_hash(df: pd.DataFrame) -> str:
+    """Hash of the columns, index and values of a stimulus list, as read from its file."""
+    digest = hashlib.sha256(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def validate_design(
+    onewords: pd.DataFrame,
+    twowords: pd.DataFrame,
+    allwords: pd.DataFrame,
+    miniblock_len: int,
+    N_blocks: int,
+    freqs: Sequence[float],
+    max_run: int = 2,
+) -> list[str]:
+    """
+    Check the balance constraints of a prepared design.
+
+    Each miniblock must have `miniblock_len` words of one condition and one pair of tag
+    frequencies, each condition must have as many F1 as F2 miniblocks (to within one), no
+    condition may be repeated more than `max_run` times in a row within a block, and every query
+    category that can follow a miniblock must have candidate words.
+
+    Returns
+    -------
+    list[str]
+        Descriptions of the constraints that are violated, empty if the design is valid
+    """
+    problems = []
+    for task, df, n_blocks in (("twoword", twowords, N_blocks), ("oneword", onewords, 1)):
+        freqcols = ["w1_freq", "w2_freq"] if "w2" in df.columns else ["w1_freq"]
+        minis = df.groupby("miniblock")
+        sizes = minis.size()
+        if (sizes != miniblock_len).any() or not np.array_equal(sizes.index, np.arange(len(sizes))):
+            problems.append(
+                f"{task}: miniblocks are not numbered from 0 with {miniblock_len} words"
+            )
+        if (minis[["condition", *freqcols]].nunique() > 1).any(axis=None):
+            problems.append(f"{task}: miniblocks mix conditions or tag frequencies")
+        if len(freqcols) == 2 and (df["w1_freq"] == df["w2_freq"]).any():
+            problems.append(f"{task}: words tagged at the same frequency")
+
+        mini_conds = minis["condition"].first().to_numpy()
+        n_f1 = pd.crosstab(mini_conds, minis["w1_freq"].first().to_numpy() == freqs[0])
+        n_f1 = n_f1.reindex(columns=[True, False], fill_value=0)
+        if ((n_f1[True] - n_f1[False]).abs() > 1).any():
+            problems.append(f"{task}: F1/F2 tags unbalanced within a condition")
+
+        for block, conds in enumerate(np.array_split(mini_conds, n_blocks)):
+            runs = np.diff(np.flatnonzero(np.r_[True, conds[1:] != conds[:-1], True]))
+            if runs.max() > max_run:
+                problems.append(f"{task}: block {block} repeats a condition {runs.max()} times")
+
+        index = QueryIndex.build(df, allwords)
+        for miniblock in range(index.n_miniblocks):
+            if index.has_nonword[miniblock]:
+                kinds = ["word", "nonword"] if len(freqcols) == 2 else ["nonword"]
+            else:
+                kinds = ["word"]
+            cats = [(kind, seen) for kind in kinds for seen in ("seen", "unseen")]
+            if any(len(index.candidates(miniblock, cat)) == 0 for cat in cats):
+                problems.append(f"{task}: no query candidates after miniblock {miniblock}")
+                break
+    return problems
+
+
+def design_arrays(
+    onewords: pd.DataFrame,
+    twowords: pd.DataFrame,
+    rng: np.random.Generator,
+    miniblock_len: int,
+    N_blocks: int,
+) -> tuple[dict[str, np.ndarray], list[str]]:
+    """
+    Prepare and validate a design from the stimulus lists as read from their files, as compact
+    arrays indexing their rows.
+
+    The design is drawn exactly as `prep_words` would draw it with the same `rng`. Tags are
+    assigned as the index of the frequency of the first word (0 for F1, 1 for F2), so the design
+    does not depend on the frequencies used in the session.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        `oneword_rows` and `twoword_rows`, the row positions in the stimulus lists in order of
+        presentation (miniblock `i` being entries `i * miniblock_len` to `(i + 1) *
+        miniblock_len`), and `oneword_tags` and `twoword_tags`, the tag index of each entry
+    list[str]
+        Problems found by `validate_design`
+    """
+    onewords = onewords.assign(_row=np.arange(len(onewords)))
+    twowords = twowords.assign(_row=np.arange(len(twowords)))
+    tags = (0.0, 1.0)
+    oneprep, twoprep, allwords = prep_words(onewords, twowords, rng, miniblock_len, N_blocks, tags)
+    problems = validate_design(oneprep, twoprep, allwords, miniblock_len, N_blocks, tags)
+    arrays = {}
+    for task, df in (("oneword", oneprep), ("twoword", twoprep)):
+        arrays[f"{task}_rows"] = df["_row"].to_numpy(dtype=np.int16)
+        arrays[f"{task}_tags"] = df["w1_freq"].to_numpy(dtype=np.int8)
+    return arrays, problems
+
+
+def select_design(
+    onewords: pd.DataFrame,
+    twowords: pd.DataFrame,
+    arrays: dict[str, np.ndarray],
+    miniblock_len: int,
+    freqs: Sequence[float],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Build the word lists of a design from the stimulus lists and the arrays of `design_arrays`,
+    with the `miniblock` and tag frequency columns used by the miniblock states.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    out = []
+    for task, df in (("oneword", onewords), ("twoword", twowords)):
+        rows, tags = arrays[f"{task}_rows"], arrays[f"{task}_tags"]
+        df = df.iloc[rows].reset_index(drop=True)
+        df["miniblock"] = np.arange(len(rows)) // miniblock_len
+        df["w1_freq"] = freqs[tags]
+        if "w2" in df.columns:
+            df["w2_freq"] = freqs[1 - tags]
+        out.append(df)
+    onewords, twowords = out
+    return onewords, twowords, query_words(onewords, twowords)
+
+
+def save_designs(
+    path: str | Path,
+    designs: dict[tuple[int, str], dict[str, np.ndarray]],
+    miniblock_len: int,
+    N_blocks: int,
+    stimpath: str | Path,
+):
+    """
+    Write designs, keyed by seed and stimulus group, to a compressed `.npz` design file.
+
+    For each group the file has a `<group>_seeds` array, for each array of `design_arrays` a
+    `<group>_<array>` array with one row per seed, and the `stimulus_hash` of the one-word and
+    two-word lists in `stimpath` the designs index, as `<group>_oneword_hash` and
+    `<group>_twoword_hash`.
+    """
+    out = {"miniblock_len": np.array(miniblock_len), "N_blocks": np.array(N_blocks)}
+    for group in sorted({group for _, group in designs}):
+        seeds = sorted(seed for seed, g in designs if g == group)
+        out[f"{group}_seeds"] = np.array(seeds)
+        for task, stimfile in zip(("oneword", "twoword"), stimulus_paths(stimpath, group)):
+            out[f"{group}_{task}_hash"] = np.array(
+                stimulus_hash(pd.read_csv(stimfile, index_col=0))
+            )
+        for name in designs[(seeds[0], group)]:
+            out[f"{group}_{name}"] = np.stack([designs[(seed, group)][name] for seed in seeds])
+    np.savez_compressed(path, **out)
+
+
+def load_design(
+    path: str | Path,
+    seed: int,
+    group: Literal["even", "odd"],
+    stimpath: str | Path,
+    miniblock_len: int,
+    N_blocks: int,
+    freqs: Sequence[float],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Load the design of a seed and stimulus group from a design file written by `save_designs`,
+    checking that it was generated with `miniblock_len` words per miniblock and `N_blocks`
+    two-word blocks, from the stimulus lists now in `stimpath`.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+        The one-word and two-word lists and the query words, like `load_prep_words`
+
+    Raises
+    ------
+    KeyError
+        If the design file has no design for the seed and group
+    ValueError
+        If the designs were generated with another miniblock length or number of blocks, or from
+        other stimulus lists
+    """
+    with np.load(path) as designs:
+        saved = (int(designs["miniblock_len"]), int(designs["N_blocks"]))
+        if saved != (miniblock_len, N_blocks):
+            raise ValueError(
+                f"The designs in {path} have miniblocks of {saved[0]} words and {saved[1]} "
+                f"blocks, not {miniblock_len} and {N_blocks}."
+            )
+        if f"{group}_seeds" not in designs:
+            raise KeyError(f"No designs for the {group} group in {path}.")
+        match = np.flatnonzero(designs[f"{group}_seeds"] == seed)
+        if len(match) == 0:
+            raise KeyError(f"No design for seed {seed} of the {group} group in {path}.")
+        arrays = {
+            name: designs[f"{group}_{name}"][match[0]]
+            for name in ("oneword_rows", "oneword_tags", "twoword_rows", "twoword_tags")
+        }
+        saved_hashes = [
+            str(designs[key]) if key in designs else None
+            for key in (f"{group}_oneword_hash", f"{group}_twoword_hash")
+        ]
+    path_1w, path_2w = stimulus_paths(stimpath, group)
+    onewords = pd.read_csv(path_1w, index_col=0)
+    twowords = pd.read_csv(path_2w, index_col=0)
+    # The designs are row positions, which select other words if the lists have been edited
+    for stimfile, df, saved_hash in zip((path_1w, path_2w), (onewords, twowords), saved_hashes):
+        if saved_hash != stimulus_hash(df):
+            raise ValueError(
+                f"{stimfile} differs from the stimulus list the designs in {path} were "
+                "generated from. Regenerate the designs with scripts/design/generate_designs.py."
+            )
+    return select_design(onewords, twowords, arrays, miniblock_len, freqs)
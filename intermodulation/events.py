@@ -0,0 +1,143 @@
+"""
+Building the BIDS event table and MNE events array of a recording from the trigger events found
+on its stim channel, shared by the `01_*events.py` scripts of the main task and the localizer.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+END_LABELS = ("STATEEND", "TRIALEND", "BLOCKEND")
+
+
+def stepfix_events(events: np.ndarray) -> np.ndarray:
+    """
+    Merge trigger steps, where the stim channel went from one non-zero value to another without
+    returning to zero first.
+
+    `mne.find_events` reports such a step as a separate event with a non-zero previous value
+    (`v1`). Its value is moved onto the event before it, and the step event is dropped.
+
+    Parameters
+    ----------
+    events : np.ndarray
+        Events array of shape (n_events, 3), as returned by `mne.find_events`
+
+    Returns
+    -------
+    np.ndarray
+        Events with steps merged
+    """
+    events = np.array(events, copy=True)
+    step = np.flatnonzero(events[1:, 1] != 0) + 1
+    events[step - 1, 2] = events[step, 2]
+    return events[events[:, 1] == 0]
+
+
+def trigger_event_table(
+    events: np.ndarray,
+    lut_triggers: dict[int, str],
+    sfreq: float,
+    first_samp: int,
+    last_time: float,
+    stim_channel: str,
+    miniblock_conditions: Sequence[str] | None = None,
+    ev_offset: int = 0,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Convert trigger events into a BIDS events table and an MNE events array, optionally adding an
+    event spanning each miniblock.
+
+    STATEEND, TRIALEND and BLOCKEND triggers are dropped, and every other event lasts until the
+    next trigger. With `miniblock_conditions`, a miniblock starts at a word trigger of one of these
+    conditions directly following a FIXATION trigger, and ends at the last of a run of identical
+    word triggers. A `MINIBLOCK/<label>` event, with value 100 + the trigger value, is placed
+    right before the event which ends the miniblock.
+
+    Parameters
+    ----------
+    events : np.ndarray
+        Events array of shape (n_events, 3), as returned by `mne.find_events` (and optionally
+        `stepfix_events`)
+    lut_triggers : dict[int, str]
+        Mapping of trigger values to "/"-separated labels, e.g. "ONEWORD/WORD/F1"
+    sfreq : float
+        Sampling frequency of the recording
+    first_samp : int
+        First sample of the recording, `raw.first_samp`
+    last_time : float
+        End time of the last event, `raw.times[-1]`
+    stim_channel : str
+        Name of the stim channel, for the `channel` column of the table
+    miniblock_conditions : Sequence[str] | None, optional
+        Labels (first "/"-separated part) of the word triggers which make up miniblocks, e.g.
+        ("ONEWORD", "TWOWORD"). No miniblock events are added if None, by default None
+    ev_offset : int, optional
+        Number of samples by which to shift the events array (not the table), by default 0
+
+    Returns
+    -------
+    tuple[pd.DataFrame, np.ndarray]
+        The events table with columns onset, duration, trial_type, value, sample and channel, and
+        the matching (n_events, 3) events array
+
+    Raises
+    ------
+    ValueError
+        If a miniblock ends without a start since the previous miniblock
+    """
+    samples = events[:, 0]
+    values = events[:, 2]
+    n_events = len(events)
+    labels = pd.Series(values).map(lut_triggers).to_numpy(dtype=object)
+    offset = first_samp / sfreq
+    onsets = samples / sfreq + offset
+    ends = np.append(onsets[1:], last_time)
+
+    keep = ~np.isin(labels, END_LABELS)
+    rows = np.flatnonzero(keep)
+    table = pd.DataFrame({
+        "onset": onsets[rows],
+        "duration": ends[rows] - onsets[rows],
+        "trial_type": labels[rows],
+        "value": values[rows],
+        "sample": samples[rows],
+    })
+    # Sort key: each event sits at twice its row, with miniblock events just before their end row
+    order = 2 * rows + 1
+
+    if miniblock_conditions is not None:
+        last = np.roll(labels, 1)
+        nextlab = np.append(labels[1:], None)
+        prefix = np.array([str(lab).split("/")[0] for lab in labels], dtype=object)
+        is_word = keep & np.isin(prefix, list(miniblock_conditions))
+        starts = is_word & (last == "FIXATION")
+        stops = is_word & ~starts & (last == labels) & (nextlab != labels)
+
+        # Latest start at or before each row, and the stop before each stop
+        start_idx = np.maximum.accumulate(np.where(starts, np.arange(n_events), -1))
+        stop_rows = np.flatnonzero(stops)
+        mb_start = start_idx[stop_rows]
+        prev_stop = np.append(-1, stop_rows[:-1])
+        if np.any(mb_start <= prev_stop):
+            raise ValueError("MINIBLOCK start not found!")
+
+        miniblocks = pd.DataFrame({
+            "onset": onsets[mb_start],
+            "duration": onsets[stop_rows] - onsets[mb_start],
+            "trial_type": "MINIBLOCK/" + pd.Series(labels[stop_rows], dtype=object),
+            "value": 100 + values[stop_rows],
+            "sample": samples[mb_start],
+        })
+        table = pd.concat((table, miniblocks), ignore_index=True)
+        order = np.concatenate((order, 2 * stop_rows))
+
+    table = table.iloc[np.argsort(order, kind="stable")].reset_index(drop=True)
+    table["channel"] = stim_channel
+    newevs = np.column_stack((
+        table["sample"].to_numpy() + ev_offset,
+        np.zeros(len(table), dtype=int),
+        table["value"].to_numpy(),
+    ))
+    return table, newevs
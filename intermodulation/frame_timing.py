@@ -0,0 +1,107 @@
+"""
+Timing of the display flips of flickering states, recorded into a preallocated ring buffer so that
+late and dropped frames are counted as they happen and summarized after each miniblock.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class FrameTimer:
+    """
+    Ring buffer of flip times at a nominal `framerate`, keeping the last `capacity` flips.
+
+    A flip is late when it comes more than `late_tolerance` frame intervals after the expected
+    time of the next frame, i.e. its interval to the previous flip is over (1 + `late_tolerance`)
+    frame intervals. Each late flip counts as the number of whole frame intervals it missed in
+    `n_dropped`.
+
+    Attributes
+    ----------
+    n_flips : int
+        Number of flips recorded since the last reset, which can exceed `capacity`
+    n_late : int
+        Number of late flips since the last reset
+    n_dropped : int
+        Estimated number of dropped frames since the last reset
+    late : bool
+        Whether the last recorded flip was late
+    """
+
+    framerate: float
+    capacity: int = 2**14
+    late_tolerance: float = 0.5
+
+    def __post_init__(self):
+        self.times = np.full(self.capacity, np.nan)
+        self.late_flips = np.zeros(self.capacity, dtype=bool)
+        self._late_interval = (1 + self.late_tolerance) / self.framerate
+        self.reset()
+
+    def reset(self):
+        self.n_flips = 0
+        self.n_late = 0
+        self.n_dropped = 0
+        self.late = False
+        self._first = None
+        self._last = None
+
+    def record(self, t: float):
+        """Record a flip at time `t`, as timestamped by the window on flipping."""
+        if self._last is None:
+            self._first = t
+            self.late = False
+        else:
+            interval = t - self._last
+            self.late = interval > self._late_interval
+            if self.late:
+                self.n_late += 1
+                self.n_dropped += max(int(np.round(interval * self.framerate)) - 1, 1)
+        idx = self.n_flips % self.capacity
+        self.times[idx] = t
+        self.late_flips[idx] = self.late
+        self.n_flips += 1
+        self._last = t
+
+    def flip_times(self) -> np.ndarray:
+        """Times of the flips kept in the buffer, oldest first."""
+        if self.n_flips <= self.capacity:
+            return self.times[: self.n_flips].copy()
+        return np.roll(self.times, -(self.n_flips % self.capacity))
+
+    def summary(self) -> dict:
+        """
+        Summary of the flips since the last reset. Interval statistics use the flips kept in the
+        buffer, counts and the effective frame rate use all of them.
+
+        Returns
+        -------
+        dict
+            With keys n_flips, t_first, duration, mean_interval, std_interval, max_interval,
+            n_late, n_dropped, effective_framerate and framerate_ratio (effective over nominal
+            frame rate, by which all frame-locked flicker frequencies are scaled)
+        """
+        intervals = np.diff(self.flip_times())
+        duration = self._last - self._first if self.n_flips > 1 else np.nan
+        effective = (self.n_flips - 1) / duration if self.n_flips > 1 else np.nan
+        return {
+            "n_flips": self.n_flips,
+            "t_first": self._first,
+            "duration": duration,
+            "mean_interval": intervals.mean() if len(intervals) else np.nan,
+            "std_interval": intervals.std() if len(intervals) else np.nan,
+            "max_interval": intervals.max() if len(intervals) else np.nan,
+            "n_late": self.n_late,
+            "n_dropped": self.n_dropped,
+            "effective_framerate": effective,
+            "framerate_ratio": effective / self.framerate,
+        }
+
+
+def save_timing_summaries(summaries: list[dict], path: str | Path):
+    """Write per-miniblock timing summaries to a CSV file, one row per miniblock run."""
+    pd.DataFrame.from_records(summaries).to_csv(path, index=False)
@@ -14,6 +14,7 @@ ITI_BOUNDS = [1.0, 3.0]
 FIXATION_DUR = 0.5
 QUERY_PAUSE_DUR = 1.0
 QUERY_DUR = 3.0
+DESIGN_PATH = None  # Design file from scripts/design/generate_designs.py, to skip preparing words
 LOCALIZER_MINIBLOCK_LEN = 12
 LOCALIZER_WORD_DUR = 0.2
 LOCALIZER_ITI_BOUNDS = [0.4, 0.6]
@@ -80,6 +81,7 @@ DISPLAY_WIDTH = 55 * (1280 / 1920)  # cm
 FOVEAL_ANGLE = 5.0  # degrees
 REPORT_PIX = True
 REPORT_PIX_SIZE = 36
+PRERENDER_WORDS = False  # Swap pre-rendered word textures rather than re-rendering text
 WINDOW_CONFIG = {
     "screen": 0,  # 0 is the primary monitor
     "fullscr": True,
@@ -0,0 +1,177 @@
+from collections.abc import Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+from intermodulation.freqtag_spec import FREQUENCIES
+
+
+def im_combinations(
+    freqs: Sequence[float] = FREQUENCIES,
+    max_order: int = 2,
+    fmin: float = 0.0,
+    fmax: float | None = None,
+) -> Iterator[tuple[int, int, float]]:
+    """
+    Generate the harmonic and intermodulation terms n * f1 + m * f2 of two tagging frequencies.
+
+    Terms are yielded by increasing order (|n| + |m|), then by increasing frequency. Only positive
+    frequencies are produced, so each (n, m) pair appears once with its sign chosen such that the
+    resulting frequency is positive.
+
+    Parameters
+    ----------
+    freqs : Sequence[float], optional
+        The two tagging frequencies (f1, f2), by default `freqtag_spec.FREQUENCIES`
+    max_order : int, optional
+        Maximum order |n| + |m| of the terms to generate, by default 2
+    fmin : float, optional
+        Lowest frequency to include, by default 0.0
+    fmax : float | None, optional
+        Highest frequency to include, if any, by default None
+
+    Yields
+    ------
+    tuple[int, int, float]
+        The coefficients n and m, and the frequency n * f1 + m * f2
+    """
+    if len(freqs) != 2:
+        raise ValueError("freqs must be a sequence of two frequencies.")
+    f1, f2 = freqs
+    for order in range(1, max_order + 1):
+        terms = []
+        for n in range(-order, order + 1):
+            for m in (order - abs(n), abs(n) - order):
+                freq = n * f1 + m * f2
+                if freq <= 0 or freq < fmin or (fmax is not None and freq > fmax):
+                    continue
+                if (n, m, freq) not in terms:
+                    terms.append((n, m, freq))
+        yield from sorted(terms, key=lambda t: t[2])
+
+
+def im_frequencies(
+    freqs: Sequence[float] = FREQUENCIES,
+    max_order: int = 2,
+    fmin: float = 0.0,
+    fmax: float | None = None,
+) -> np.ndarray:
+    """Array of the frequencies produced by `im_combinations` with the same arguments."""
+    return np.array([f for _, _, f in im_combinations(freqs, max_order, fmin, fmax)])
+
+
+def im_label(n: int, m: int) -> str:
+    """Readable name of the n * f1 + m * f2 term, e.g. "f2-f1", "2f1" or "f1+f2"."""
+    parts = []
+    for coef, name in ((n, "f1"), (m, "f2")):
+        if coef == 0:
+            continue
+        sign = "-" if coef < 0 else ("+" if parts else "")
+        parts.append(f"{sign}{abs(coef) if abs(coef) != 1 else ''}{name}")
+    if parts[0].startswith("-"):
+        parts = parts[::-1]
+        parts[0] = parts[0].lstrip("+")
+        parts[1] = "-" + parts[1].lstrip("-")
+    return "".join(parts)
+
+
+def im_catalogue(
+    sfreq: float,
+    n_fft: int,
+    freqs: Sequence[float] = FREQUENCIES,
+    max_order: int = 2,
+    fmin: float = 0.0,
+    fmax: float | None = None,
+    samprate_correction: float = 1.0,
+    bin_offset: int = 0,
+) -> pd.DataFrame:
+    """
+    Catalogue of harmonic and intermodulation terms with their bins in an FFT of length `n_fft`.
+
+    Parameters
+    ----------
+    sfreq : float
+        Sampling frequency of the data, in Hz
+    n_fft : int
+        Length of the FFT (window length in samples for the boxcar FFTs used in the analysis)
+    freqs : Sequence[float], optional
+        The two tagging frequencies (f1, f2), by default `freqtag_spec.FREQUENCIES`
+    max_order : int, optional
+        Maximum order |n| + |m| of the terms to include, by default 2
+    fmin : float, optional
+        Lowest frequency of the spectrum, as passed to the PSD functions. Bins are indexed
+        relative to the first FFT bin at or above this, by default 0.0
+    fmax : float | None, optional
+        Highest frequency of the spectrum, by default the Nyquist frequency
+    samprate_correction : float, optional
+        Ratio of the nominal to true sampling rate of the recording. A system which samples
+        faster than advertised shows each frequency at `f * samprate_correction`, by default 1.0
+    bin_offset : int, optional
+        Number of bins by which to shift every term, as with `--freq-bin-offset` in the plotting
+        scripts. Negative values are ok, by default 0
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per term, indexed by label (e.g. "f1", "f2-f1"), with columns
+          - `n`, `m`, `order`: coefficients and order of the term
+          - `freq`: the frequency n * f1 + m * f2
+          - `bin`: FFT bin of the term, after the sampling rate correction and bin offset
+          - `idx`: index of that bin in a spectrum starting at `fmin`
+          - `bin_freq`: frequency of that bin
+          - `bin_frac`: distance from the corrected frequency to the bin centre, in bins
+          - `power_ratio`: fraction of the power at the corrected frequency which falls in the
+            bin with a boxcar window (1 when exactly on-bin)
+        Terms whose bin falls outside of the spectrum are dropped.
+    """
+    if fmax is None:
+        fmax = sfreq / 2
+    df = sfreq / n_fft
+    first_bin = int(np.ceil(fmin / df - 1e-9))
+    last_bin = int(np.floor(min(fmax, sfreq / 2) / df + 1e-9))
+    return _bin_table(
+        im_combinations(freqs, max_order, fmin, fmax),
+        df,
+        first_bin,
+        last_bin,
+        samprate_correction,
+        bin_offset,
+    )
+
+
+def im_catalogue_from_freqs(
+    spectrum_freqs: np.ndarray,
+    freqs: Sequence[float] = FREQUENCIES,
+    max_order: int = 2,
+    samprate_correction: float = 1.0,
+    bin_offset: int = 0,
+) -> pd.DataFrame:
+    """
+    As `im_catalogue`, with the FFT resolution and range taken from the frequencies of an existing
+    spectrum, e.g. the `freqs` array saved alongside PSDs and SNRs.
+    """
+    spectrum_freqs = np.asarray(spectrum_freqs)
+    df = spectrum_freqs[1] - spectrum_freqs[0]
+    first_bin = int(np.round(spectrum_freqs[0] / df))
+    return _bin_table(
+        im_combinations(freqs, max_order, spectrum_freqs[0], spectrum_freqs[-1]),
+        df,
+        first_bin,
+        first_bin + len(spectrum_freqs) - 1,
+        samprate_correction,
+        bin_offset,
+    )
+
+
+def _bin_table(terms, df, first_bin, last_bin, samprate_correction, bin_offset):
+    table = pd.DataFrame(terms, columns=["n", "m", "freq"])
+    table.index = pd.Index([im_label(n, m) for n, m in zip(table["n"], table["m"])], name="term")
+    table.insert(2, "order", table["n"].abs() + table["m"].abs())
+    exact = table["freq"].to_numpy() * samprate_correction / df
+    nearest = np.round(exact).astype(int)
+    table["bin"] = nearest + bin_offset
+    table["idx"] = table["bin"] - first_bin
+    table["bin_freq"] = table["bin"] * df
+    table["bin_frac"] = exact - nearest
+    table["power_ratio"] = np.sinc(table["bin_frac"]) ** 2
+    return table[(table["bin"] >= first_bin) & (table["bin"] <= last_bin)]
@@ -0,0 +1,429 @@
+"""
+Lock-in spectra: the Fourier coefficients of a few target frequencies and the neighbouring bins
+used for their SNR, computed straight from the time series rather than from a full spectrum.
+
+The coefficients are the DFT bins an FFT of the same length would give, as a matrix product of
+the data with precomputed cosine and sine bases for just those bins. For the few dozen tag,
+harmonic and intermodulation frequencies of the analysis (e.g. from `imfreqs.im_frequencies`),
+this avoids the full 0.1-140 Hz spectrum of every epoch and channel, and the output holds only the
+bins that are interpreted.
+
+`sliding_snr_itc` applies the same bins to sliding windows of the epochs, for SNR and ITC that
+resolve how the responses build up over a miniblock, and `LockIn.word_spectra` to each word of
+the miniblocks.
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import mne
+import numpy as np
+import scipy.fft
+
+from intermodulation.analysis import EpochSpectra, RunningITC, nearest_bins, pick_ch_names
+
+
+def _density_scale(bins: np.ndarray, sfreq: float, n_fft: int) -> np.ndarray:
+    # One-sided density scaling of a boxcar window, with every bin but DC and Nyquist doubled
+    return np.where((bins == 0) | (2 * bins == n_fft), 1.0, 2.0) / (sfreq * n_fft)
+
+
+@dataclass(frozen=True)
+class LockIn:
+    """
+    Bases of the DFT bins of a set of target frequencies and of their SNR neighbours.
+
+    Coefficients are scaled as in `EpochSpectra`, so that their squared magnitude is the
+    one-sided boxcar PSD. `snr` matches `analysis.snr_at` on the full spectrum between `fmin` and
+    `fmax`, and `itc` matches `EpochSpectra.itc` at the target bins.
+
+    Attributes
+    ----------
+    sfreq : float
+        Sampling frequency of the data
+    n_fft : int
+        Length of the DFT. Longer data is cut to its first `n_fft` samples, shorter data is
+        zero-padded.
+    targets : np.ndarray
+        The target frequencies
+    bins : np.ndarray
+        The DFT bins computed, sorted, with the frequencies `freqs`
+    target_idx : np.ndarray
+        Index into `bins` of the bin nearest to each target
+    noise_idx : np.ndarray
+        Index into `bins` of the noise neighbours of each target, shape (n_targets, 2 * n_neighbor)
+    valid : np.ndarray
+        Whether all noise neighbours of each target lie between `fmin` and `fmax`, the SNR is NaN
+        otherwise
+    basis : np.ndarray
+        Real array of shape (2, n_fft, n_bins), the scaled cosine and negative sine of each bin
+    remove_dc : bool
+        Whether to remove the mean of the data before projecting, as `compute_psd` does
+    """
+
+    sfreq: float
+    n_fft: int
+    targets: np.ndarray
+    bins: np.ndarray
+    target_idx: np.ndarray
+    noise_idx: np.ndarray
+    valid: np.ndarray
+    basis: np.ndarray
+    remove_dc: bool = True
+
+    @classmethod
+    def design(
+        cls,
+        sfreq: float,
+        n_fft: int,
+        targets: Sequence[float],
+        noise_n_neighbor_freqs: int = 1,
+        noise_skip_neighbor_freqs: int = 1,
+        fmin: float = 0.0,
+        fmax: float | None = None,
+        remove_dc: bool = True,
+    ) -> "LockIn":
+        """
+        Build the bases for `targets` and their `noise_n_neighbor_freqs` neighbours on either
+        side, skipping `noise_skip_neighbor_freqs` bins, as in `analysis.snr_spectrum`. Targets
+        are assigned to the nearest bin between `fmin` and `fmax` (default Nyquist), as with
+        `analysis.snr_at` on a spectrum over that range.
+
+        The bases take `2 * n_fft * n_bins` floats, with `n_bins` at most `len(targets) *
+        (2 * noise_n_neighbor_freqs + 1)`.
+        """
+        targets = np.asarray(targets, dtype=float)
+        df = sfreq / n_fft
+        first = int(np.ceil(fmin / df - 1e-9))
+        last = int(np.floor(min(fmax if fmax is not None else sfreq / 2, sfreq / 2) / df + 1e-9))
+        target_bins = first + nearest_bins(np.arange(first, last + 1) * df, targets)
+
+        n_neighbor, n_skip = noise_n_neighbor_freqs, noise_skip_neighbor_freqs
+        edge = n_neighbor + n_skip
+        offsets = np.concatenate((np.arange(-edge, -n_skip), np.arange(n_skip + 1, edge + 1)))
+        noise_bins = target_bins[:, None] + offsets[None, :]
+        valid = (target_bins - edge >= first) & (target_bins + edge <= last)
+        noise_bins = np.clip(noise_bins, first, last)
+
+        bins, inverse = np.unique(
+            np.concatenate((target_bins, noise_bins.ravel())), return_inverse=True
+        )
+        phase = 2 * np.pi * np.outer(np.arange(n_fft), bins) / n_fft
+        basis = np.stack((np.cos(phase), -np.sin(phase))) * np.sqrt(
+            _density_scale(bins, sfreq, n_fft)
+        )
+        return cls(
+            sfreq=sfreq,
+            n_fft=n_fft,
+            targets=targets,
+            bins=bins,
+            target_idx=inverse[: len(targets)],
+            noise_idx=inverse[len(targets) :].reshape(noise_bins.shape),
+            valid=valid,
+            basis=basis,
+            remove_dc=remove_dc,
+        )
+
+    @property
+    def freqs(self) -> np.ndarray:
+        """Frequencies of the computed bins."""
+        return self.bins * (self.sfreq / self.n_fft)
+
+    @property
+    def target_freqs(self) -> np.ndarray:
+        """Frequencies of the bins nearest to each target."""
+        return self.freqs[self.target_idx]
+
+    def transform(self, data: np.ndarray) -> np.ndarray:
+        """
+        Coefficients of the computed bins for data of shape (..., n_times), e.g. an epochs
+        array, a raw data array or the data of a source estimate.
+
+        Returns
+        -------
+        np.ndarray
+            Complex array of shape (..., n_bins)
+        """
+        data = np.asarray(data)[..., : self.n_fft]
+        if self.remove_dc:
+            data = data - data.mean(axis=-1, keepdims=True)
+        basis = self.basis[:, : data.shape[-1]]
+        coefs = np.matmul(data, basis[0]).astype(np.complex128)
+        coefs.imag = np.matmul(data, basis[1])
+        return coefs
+
+    def transform_stc(self, stcs: mne.SourceEstimate | Sequence[mne.SourceEstimate]) -> np.ndarray:
+        """Coefficients of the source time courses of one or several source estimates."""
+        if isinstance(stcs, mne.SourceEstimate):
+            return self.transform(stcs.data)
+        return np.stack([self.transform(stc.data) for stc in stcs])
+
+    def epoch_spectra(
+        self,
+        epochs: mne.Epochs,
+        tmin: float | None = None,
+        tmax: float | None = None,
+        picks="data",
+        chunk_size: int = 16,
+    ) -> EpochSpectra:
+        """
+        Coefficients of every epoch, `chunk_size` epochs at a time, as an `EpochSpectra` holding
+        only the computed bins. Condition subsets and `InverseKernel.psd` can then be used as with
+        the full spectra, and `snr` takes the PSDs they return.
+
+        Parameters
+        ----------
+        epochs : mne.Epochs
+            Epochs to transform. Need not be preloaded.
+        tmin, tmax : float | None
+            Time range of each epoch to use, from which the first `n_fft` samples are projected.
+        picks : str | list
+            Channels to keep, as in `Epochs.get_data`. Bad channels are excluded for string picks.
+        chunk_size : int
+            Number of epochs to read at once.
+        """
+        ch_names = pick_ch_names(epochs.info, picks)
+        coefs = np.empty((len(epochs), len(ch_names), len(self.bins)), dtype=np.complex128)
+        for start in range(0, len(epochs), chunk_size):
+            items = np.arange(start, min(start + chunk_size, len(epochs)))
+            data = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=items)
+            coefs[items] = self.transform(data)
+        return EpochSpectra(
+            coefs=coefs,
+            freqs=self.freqs,
+            events=epochs.events[:, 2].copy(),
+            event_id=dict(epochs.event_id),
+            ch_names=ch_names,
+        )
+
+    def word_spectra(
+        self,
+        epochs: mne.Epochs,
+        word_dur: float,
+        n_words: int,
+        tmin: float = 0.0,
+        picks="data",
+        chunk_size: int = 8,
+    ) -> EpochSpectra:
+        """
+        Coefficients of each word of miniblock epochs, as an `EpochSpectra` with one entry per
+        word. Word `w` of epoch `i` is entry `i * n_words + w`.
+
+        The words start every `word_dur` seconds from `tmin`, rounded to the nearest sample, and
+        their first `n_fft` samples are projected. They are cut from a strided view of the epoch
+        data without copying it, and the words of `chunk_size` epochs are projected at once.
+
+        The miniblocks of the task have a single condition, so each word is labelled with the
+        trigger of its words, e.g. "TWOWORD/PHRASE/F1LEFT" for a "MINIBLOCK/TWOWORD/PHRASE/F1LEFT"
+        epoch (`analysis.miniblock_events` adds 100 to the word trigger for the miniblock).
+        """
+        miniblock_id = {k: v for k, v in epochs.event_id.items() if k.startswith("MINIBLOCK/")}
+        if len(miniblock_id) < len(epochs.event_id):
+            raise ValueError("Word spectra need epochs of MINIBLOCK events only.")
+        sfreq = epochs.info["sfreq"]
+        starts = np.round(np.arange(n_words) * word_dur * sfreq).astype(int)
+        offset = int(round((tmin - epochs.tmin) * sfreq))
+        if offset < 0 or offset + starts[-1] + self.n_fft > len(epochs.times):
+            raise ValueError(
+                f"{n_words} words of {self.n_fft} samples from tmin={tmin} do not fit in the epochs."
+            )
+        starts += offset
+
+        ch_names = pick_ch_names(epochs.info, picks)
+        coefs = np.empty((len(epochs), n_words, len(ch_names), len(self.bins)), np.complex128)
+        for start in range(0, len(epochs), chunk_size):
+            items = np.arange(start, min(start + chunk_size, len(epochs)))
+            data = epochs.get_data(picks=ch_names, item=items)
+            words = np.lib.stride_tricks.sliding_window_view(data, self.n_fft, axis=-1)
+            coefs[items] = self.transform(words[:, :, starts]).transpose(0, 2, 1, 3)
+
+        return EpochSpectra(
+            coefs=coefs.reshape(-1, len(ch_names), len(self.bins)),
+            freqs=self.freqs,
+            events=np.repeat(epochs.events[:, 2] - 100, n_words),
+            event_id={k.removeprefix("MINIBLOCK/"): v - 100 for k, v in miniblock_id.items()},
+            ch_names=ch_names,
+        )
+
+    def word_snr_itc(
+        self, spectra: EpochSpectra, n_words: int, key: str | None = None, average: bool = False
+    ) -> dict[str, np.ndarray]:
+        """
+        PSD, SNR and ITC at the targets for each word position of the miniblocks matching `key`,
+        from the output of `word_spectra`.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            `psds`, `snrs` and `itcs` of shape (n_words, n_channels, n_targets), as from the
+            miniblocks' words at each position, with the PSD and SNR of the evoked response if
+            `average`, and the target bin frequencies `freqs`
+        """
+        coefs = spectra[key].coefs if key is not None else spectra.coefs
+        coefs = coefs.reshape(-1, n_words, *coefs.shape[1:])
+        psd = self.psd(coefs, average) if average else self.psd(coefs).mean(axis=0)
+        return dict(
+            psds=self.target_psd(psd),
+            snrs=self.snr(psd),
+            itcs=self.itc(coefs),
+            freqs=self.target_freqs,
+        )
+
+    def psd(self, coefs: np.ndarray, average: bool = False) -> np.ndarray:
+        """
+        PSD of all computed bins, of each epoch along the first axis of `coefs` or, with
+        `average`, of their mean (the evoked response).
+        """
+        if average:
+            coefs = coefs.mean(axis=0)
+        return coefs.real**2 + coefs.imag**2
+
+    def target_psd(self, psd: np.ndarray) -> np.ndarray:
+        """The PSD at the bin of each target, shape (..., n_targets)."""
+        return psd[..., self.target_idx]
+
+    def snr(self, psd: np.ndarray) -> np.ndarray:
+        """SNR at each target from the PSD of all computed bins, shape (..., n_targets)."""
+        mean_noise = psd[..., self.noise_idx].mean(axis=-1)
+        mean_noise[..., ~self.valid] = np.nan
+        return psd[..., self.target_idx] / mean_noise
+
+    def itc(self, coefs: np.ndarray) -> np.ndarray:
+        """Inter-trial coherence at each target across the epochs along the first axis."""
+        coefs = coefs[..., self.target_idx]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.abs(np.mean(coefs / np.abs(coefs), axis=0))
+
+
+def sliding_snr_itc(
+    epochs: mne.Epochs,
+    targets: Sequence[float],
+    window: float,
+    step: float,
+    tmin: float | None = None,
+    tmax: float | None = None,
+    noise_n_neighbor_freqs: int = 1,
+    noise_skip_neighbor_freqs: int = 1,
+    fmin: float = 0.0,
+    fmax: float | None = None,
+    average: bool = False,
+    picks="data",
+    chunk_size: int = 8,
+    chunk_elems: int = 2**24,
+    n_jobs: int = -1,
+) -> dict[str, np.ndarray]:
+    """
+    Time-resolved PSD, SNR and ITC at the target bins, from windows of `window` seconds every
+    `step` seconds between `tmin` and `tmax` of each epoch.
+
+    The windows are strided views of the epoch data, transformed with one batched rFFT per block
+    of channels, from which the bins of `LockIn.design` for the window length are kept. Epochs
+    are read `chunk_size` at a time and the rFFT input is at most about `chunk_elems` samples, so
+    memory does not grow with the number of epochs or windows. Each window is treated as
+    `LockIn.epoch_spectra` treats a whole epoch: the SNR matches `analysis.snr_at` and the ITC
+    `EpochSpectra.itc` on the epochs cropped to the window.
+
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epochs to analyse, e.g. those of one condition. Need not be preloaded.
+    targets : Sequence[float]
+        Target frequencies, assigned to the nearest bin of the window length.
+    window, step : float
+        Length of the windows and the step between their starts, in seconds.
+    tmin, tmax : float | None
+        Time range of each epoch covered by the windows.
+    noise_n_neighbor_freqs, noise_skip_neighbor_freqs, fmin, fmax
+        SNR neighbours and frequency range, as in `LockIn.design`.
+    average : bool
+        Whether the PSD and SNR are of the mean coefficients of the epochs (the evoked response)
+        rather than the mean PSD of each epoch.
+    picks : str | list
+        Channels to keep, as in `Epochs.get_data`. Bad channels are excluded for string picks.
+    chunk_size : int
+        Number of epochs to read at once.
+    chunk_elems : int
+        Approximate number of window samples transformed at once.
+    n_jobs : int
+        Number of workers for `scipy.fft.rfft`.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        `psds`, `snrs` and `itcs` of shape (n_channels, n_targets, n_windows), the target bin
+        frequencies `freqs`, the window centres `times`, the number of epochs `nave` and the
+        channel names `ch_names`. `sliding_tfr` makes an `AverageTFR` of one of the measures,
+        for e.g. `plot.itc_singlefreq_topo`.
+    """
+    sfreq = epochs.info["sfreq"]
+    n_win = int(round(window * sfreq))
+    n_step = max(1, int(round(step * sfreq)))
+    ch_names = pick_ch_names(epochs.info, picks)
+    # The times of the samples `get_data` reads, from the truncated index of tmin with tmax
+    # excluded, so that the windows and their centres fit the data of every chunk
+    n_times = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=[0]).shape[-1]
+    first = 0 if tmin is None else max(0, int((tmin - epochs.times[0]) * sfreq))
+    times = epochs.times[first : first + n_times]
+    starts = np.arange(0, n_times - n_win + 1, n_step)
+    if not len(starts):
+        raise ValueError(f"No window of {window} s fits between tmin and tmax.")
+    lockin = LockIn.design(
+        sfreq,
+        n_win,
+        targets,
+        noise_n_neighbor_freqs,
+        noise_skip_neighbor_freqs,
+        fmin=fmin,
+        fmax=fmax,
+    )
+    scale = np.sqrt(_density_scale(lockin.bins, sfreq, n_win))
+    # Removing the mean of a window only changes its DC bin
+    dc = lockin.bins == 0
+
+    total_shape = (len(ch_names), len(starts), len(lockin.bins))
+    total = np.zeros(total_shape, dtype=np.complex128 if average else np.float64)
+    running = RunningITC()
+    rows_per_batch = max(1, chunk_elems // (len(starts) * n_win))
+    for start in range(0, len(epochs), chunk_size):
+        items = np.arange(start, min(start + chunk_size, len(epochs)))
+        data = epochs.get_data(picks=ch_names, tmin=tmin, tmax=tmax, item=items)
+        rows = data.reshape(-1, data.shape[-1])
+        coefs = np.empty((len(rows), len(starts), len(lockin.bins)), dtype=np.complex128)
+        for first in range(0, len(rows), rows_per_batch):
+            batch = slice(first, first + rows_per_batch)
+            windows = np.lib.stride_tricks.sliding_window_view(rows[batch], n_win, axis=-1)
+            spectrum = scipy.fft.rfft(windows[:, starts], axis=-1, workers=n_jobs)
+            coefs[batch] = spectrum[..., lockin.bins] * scale
+        coefs[..., dc] = 0
+        coefs = coefs.reshape(*data.shape[:-1], len(starts), len(lockin.bins))
+        total += coefs.sum(axis=0) if average else lockin.psd(coefs).sum(axis=0)
+        running.update(coefs[..., lockin.target_idx])
+
+    psd = lockin.psd(total / running.count) if average else total / running.count
+    return dict(
+        psds=lockin.target_psd(psd).transpose(0, 2, 1),
+        snrs=lockin.snr(psd).transpose(0, 2, 1),
+        itcs=running.itc.transpose(0, 2, 1),
+        freqs=lockin.target_freqs,
+        times=times[starts] + (n_win - 1) / (2 * sfreq),
+        nave=np.array(running.count),
+        ch_names=np.array(ch_names),
+    )
+
+
+def sliding_tfr(
+    info: mne.Info, spectra: dict[str, np.ndarray], measure: str = "itcs"
+) -> mne.time_frequency.AverageTFRArray:
+    """
+    One measure of the output of `sliding_snr_itc`, or of a spectral store key saved from it,
+    as an `AverageTFR` with the channels of `info` it was computed on.
+    """
+    info = mne.pick_info(info, mne.pick_channels(info["ch_names"], list(spectra["ch_names"])))
+    return mne.time_frequency.AverageTFRArray(
+        info=info,
+        data=spectra[measure],
+        times=spectra["times"],
+        freqs=spectra["freqs"],
+        nave=int(spectra["nave"]),
+        comment=measure,
+    )
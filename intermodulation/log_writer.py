@@ -0,0 +1,139 @@
+"""
+Writing the logs of a `psystate.events.ExperimentLog` to disk while the experiment runs.
+
+The logs of finished states are removed from the logger and passed to a background thread,
+which appends them to CSV files. Memory use stays flat over a session, and a crash only loses the
+logs since the last flush. Both files are in long format, one logged value per row:
+
+- states: `state_number, key, value`, the per-state logs (`ExperimentLog.states`)
+- continuous: `state_number, key, key_number, value, tag`, the logs made several times per state
+  (`ExperimentLog.continuous`), like `ExperimentLog.contdf`
+"""
+
+import csv
+import queue
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+COLUMNS = {
+    "states": ("state_number", "key", "value"),
+    "continuous": ("state_number", "key", "key_number", "value", "tag"),
+}
+
+
+def drain_log(states: dict, continuous: dict, before: int | float) -> tuple[list, list]:
+    """
+    Remove the logs of the states numbered below `before` from the `states` and `continuous`
+    dicts of an `ExperimentLog`.
+
+    Returns
+    -------
+    tuple[list, list]
+        Rows of the states and continuous logs, in the columns of `COLUMNS`
+    """
+    state_rows = []
+    for sn in sorted(sn for sn in states if sn < before):
+        logs = states.pop(sn)
+        state_rows.extend((sn, key, value) for key, value in logs.items() if key != "state_number")
+
+    cont_rows = []
+    for sn in sorted(sn for sn in continuous if sn < before):
+        logs = continuous.pop(sn)
+        for key, values in logs.items():
+            if isinstance(key, str) and key.endswith("_tag"):
+                continue
+            tags = logs[f"{key}_tag"]
+            cont_rows.extend(
+                (sn, key, i, val, tag) for i, (val, tag) in enumerate(zip(values, tags))
+            )
+    return state_rows, cont_rows
+
+
+class AsyncLogWriter:
+    """
+    Background thread appending batches of log rows to the states and continuous CSV files.
+
+    Batches wait in a queue of at most `maxsize` batches. Submitting to a full queue blocks until
+    the thread catches up, so flushes should be made outside of the flickering states (e.g. at the
+    start of ITIs and query pauses). Errors in the thread are raised on the next submit or close.
+
+    Parameters
+    ----------
+    states_path : str | Path
+        CSV file of the per-state logs, appended to if it exists
+    continuous_path : str | Path
+        CSV file of the continuous logs, appended to if it exists
+    maxsize : int, optional
+        Maximum number of batches waiting to be written, by default 16
+    """
+
+    def __init__(self, states_path: str | Path, continuous_path: str | Path, maxsize: int = 16):
+        self.paths = {"states": Path(states_path), "continuous": Path(continuous_path)}
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, rows: list):
+        """Queue `rows` to be appended to the `kind` ("states" or "continuous") file."""
+        if kind not in COLUMNS:
+            raise ValueError(f"Unknown log kind {kind}, must be one of {list(COLUMNS)}.")
+        self._raise_error()
+        if rows:
+            self._queue.put((kind, rows))
+
+    def flush_log(self, logger, before: int | float = float("inf")):
+        """
+        Move the logs of the states numbered below `before` from an `ExperimentLog` to the queue.
+        All logs are moved by default, e.g. at the end of the experiment.
+        """
+        state_rows, cont_rows = drain_log(logger.states, logger.continuous, before)
+        self.submit("states", state_rows)
+        self.submit("continuous", cont_rows)
+
+    def close(self):
+        """Write all queued batches and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while (batch := self._queue.get()) is not None:
+            try:
+                self._write(*batch)
+            except Exception as err:  # Kept to be raised in the main thread
+                self._error = err
+
+    def _write(self, kind: str, rows: list):
+        path = self.paths[kind]
+        new = not path.exists() or path.stat().st_size == 0
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(COLUMNS[kind])
+            writer.writerows(rows)
+
+    def _raise_error(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError("Writing the experiment log failed.") from err
+
+
+def read_states_log(path: str | Path) -> pd.DataFrame:
+    """
+    Read a states log written by `AsyncLogWriter` into one row per state, like
+    `ExperimentLog.statesdf`. Values are read back as strings.
+    """
+    long = pd.read_csv(path, dtype={"key": str, "value": str})
+    wide = long.pivot(index="state_number", columns="key", values="value")
+    wide.columns.name = None
+    return wide
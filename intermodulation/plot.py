@@ -10,7 +10,7 @@ from matplotlib import pyplot as plt
 
 def snr_topo(
     snrs: np.ndarray,
-    epochs: mne.Epochs,
+    epochs: mne.Epochs | mne.Info,
     freqs: np.ndarray,
     fmin: float | None = None,
     fmax: float | None = None,
@@ -47,8 +47,9 @@ def snr_topo(
         spinecolor = "w"
     else:
         spinecolor = "k"
+    info = epochs if isinstance(epochs, mne.Info) else epochs.info
     itertopo = mne.viz.iter_topography(
-        epochs.info, on_pick=plotcallback, fig=fig, axis_spinecolor=spinecolor
+        info, on_pick=plotcallback, fig=fig, axis_spinecolor=spinecolor
     )
 
     for ax, idx in itertopo:
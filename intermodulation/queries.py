@@ -0,0 +1,86 @@
+"""
+Candidate words of the memory queries, indexed once before the session so that choosing a query
+word in the query pause is boolean indexing over integer word ids rather than pandas filtering.
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+QueryCategory = tuple[Literal["word", "nonword"], Literal["seen", "unseen"]]
+
+
+@dataclass(frozen=True)
+class QueryIndex:
+    """
+    The words that can be queried, with their category and the miniblocks they were shown in.
+
+    Entry `i` is row `i` of the `allwords` table the index was built from. A word listed under
+    several categories has one entry per category, and is seen in a miniblock when it was shown
+    in any word column of that miniblock.
+
+    Attributes
+    ----------
+    words : np.ndarray
+        Word of each entry
+    is_word : np.ndarray
+        Whether each entry is in the "word" category, all other categories are non-words
+    seen : np.ndarray
+        Boolean array of shape (n_miniblocks, n_entries), whether each entry was shown in each
+        miniblock
+    has_nonword : np.ndarray
+        Whether each miniblock has a "non-word" condition item
+    """
+
+    words: np.ndarray
+    is_word: np.ndarray
+    seen: np.ndarray
+    has_nonword: np.ndarray
+
+    @classmethod
+    def build(
+        cls,
+        word_list: pd.DataFrame,
+        allwords: pd.DataFrame,
+        word_cols: Sequence[str] = ("w1", "w2"),
+    ) -> "QueryIndex":
+        """
+        Index the `word` and `cond` columns of `allwords` against a word list with a `miniblock`
+        column numbering the miniblocks from 0, a `condition` column and the word columns
+        `word_cols` (those missing from the word list are skipped).
+        """
+        word_cols = [col for col in word_cols if col in word_list.columns]
+        word_ids, vocab = pd.factorize(allwords["word"])
+        miniblock = word_list["miniblock"].to_numpy(dtype=int)
+        n_miniblocks = miniblock.max() + 1
+
+        # Words shown but not in `allwords` get id -1, which lands in a dropped last column
+        shown = vocab.get_indexer(word_list[word_cols].to_numpy(dtype=object).ravel())
+        seen_vocab = np.zeros((n_miniblocks, len(vocab) + 1), dtype=bool)
+        seen_vocab[np.repeat(miniblock, len(word_cols)), shown] = True
+        nonword = (word_list["condition"] == "non-word").to_numpy()
+        return cls(
+            words=allwords["word"].to_numpy(dtype=object),
+            is_word=(allwords["cond"] == "word").to_numpy(),
+            seen=seen_vocab[:, :-1][:, word_ids],
+            has_nonword=np.bincount(miniblock[nonword], minlength=n_miniblocks) > 0,
+        )
+
+    @property
+    def n_miniblocks(self) -> int:
+        return self.seen.shape[0]
+
+    def candidates(self, miniblock: int, category: QueryCategory) -> np.ndarray:
+        """Entries of a query category after a miniblock."""
+        mask = self.is_word if category[0] == "word" else ~self.is_word
+        seen = self.seen[miniblock]
+        return np.flatnonzero(mask & (seen if category[1] == "seen" else ~seen))
+
+    def candidate_sets(
+        self, miniblock: int, categories: Sequence[QueryCategory]
+    ) -> dict[QueryCategory, np.ndarray]:
+        """Entries of each distinct query category after a miniblock."""
+        return {cat: self.candidates(miniblock, cat) for cat in dict.fromkeys(categories)}
@@ -0,0 +1,234 @@
+"""
+Epochs read from an unloaded raw recording one chunk of windows at a time, so that the spectral
+accumulators (`analysis.EpochSpectra.from_epochs`, `analysis.itc_epochs`, the `lockin` engines)
+hold a bounded number of miniblocks in memory rather than the whole session.
+
+`mne.Epochs` without preloading also reads from the raw file, but only learns which epochs
+overlap bad segments by reading them all, and has no length until then. `RawEpochs` screens the
+windows against the BAD annotations and the extent of the recording from the events alone.
+"""
+
+from dataclasses import dataclass, replace
+
+import mne
+import numpy as np
+from mne.proj import make_projector
+
+from intermodulation.analysis import pick_ch_names
+
+
+@dataclass(frozen=True)
+class RawEpochs:
+    """
+    Epochs of a raw recording, with the part of the `mne.Epochs` interface the spectral
+    accumulators use: `info`, `ch_names`, `times`, `tmin`, `events`, `event_id`, `len`, selection
+    by "/"-separated tags and `get_data` of a few items at a time.
+
+    Each window is read at the raw sampling rate for the channels in `picks` only, projected with
+    the SSP projectors of the recording and baseline corrected as by `mne.Epochs`, then decimated
+    by `decim` without filtering (as `Epochs.decimate`), so the raw data must already be
+    low-passed below the new Nyquist frequency.
+
+    Attributes
+    ----------
+    raw : mne.io.BaseRaw
+        The recording, which should not be preloaded
+    events : np.ndarray
+        Events of the kept windows, in raw samples
+    event_id : dict
+        Names of the event codes
+    picks : np.ndarray
+        Raw channel indices of the epoch channels
+    info : mne.Info
+        Measurement info of the epoch channels at the decimated sampling rate
+    first, n_samples : int
+        Offset from the event of the first sample read for each window and the number of samples
+        read, at the raw sampling rate
+    decim : int
+        Decimation factor
+    baseline : tuple | None
+        Baseline interval in seconds, as for `mne.Epochs`
+    projector : np.ndarray | None
+        SSP projection operator of the epoch channels, None without projectors
+    """
+
+    raw: mne.io.BaseRaw
+    events: np.ndarray
+    event_id: dict
+    picks: np.ndarray
+    info: mne.Info
+    first: int
+    n_samples: int
+    decim: int = 1
+    baseline: tuple | None = (None, 0)
+    projector: np.ndarray | None = None
+
+    @classmethod
+    def from_raw(
+        cls,
+        raw: mne.io.BaseRaw,
+        events: np.ndarray,
+        event_id: dict,
+        tmin: float,
+        tmax: float,
+        picks="data",
+        decim: int = 1,
+        baseline: tuple | None = (None, 0),
+        reject_by_annotation: bool = True,
+    ) -> "RawEpochs":
+        """
+        Windows from `tmin` to `tmax` around the events of `events` whose code is in
+        `event_id`. Windows that run past the recording are dropped, as are those overlapping an
+        annotation starting with "bad" (case insensitive) with `reject_by_annotation`, as
+        `mne.Epochs` would.
+        """
+        sfreq = raw.info["sfreq"]
+        # Windows are read from their first to their last sample kept after decimation, which
+        # keeps the sample of the event itself (time 0) when it lies in the window
+        first = int(round(tmin * sfreq))
+        last = int(round(tmax * sfreq))
+        first += -first % decim
+        n_samples = (last - first) // decim * decim + 1
+        events = events[np.isin(events[:, 2], list(event_id.values()))]
+        starts = events[:, 0] - raw.first_samp + first
+        stops = starts + n_samples
+        keep = (starts >= 0) & (stops <= raw.n_times)
+
+        annot = raw.annotations
+        bad = np.array([desc.lower().startswith("bad") for desc in annot.description], dtype=bool)
+        if reject_by_annotation and bad.any():
+            bad_starts = raw.time_as_index(annot.onset[bad], origin=annot.orig_time)
+            bad_stops = bad_starts + np.round(annot.duration[bad] * sfreq).astype(int)
+            overlap = (starts[:, None] < bad_stops) & (stops[:, None] > bad_starts)
+            keep &= ~overlap.any(axis=1)
+
+        picks = mne.pick_channels(
+            raw.ch_names, pick_ch_names(raw.info, picks, exclude=()), ordered=True
+        )
+        # The info of a one-sample evoked response over the channels, with its projectors
+        # applied as by `mne.Epochs(..., proj=True)` and decimated as by `Epochs.decimate`
+        evoked = mne.EvokedArray(
+            np.zeros((len(picks), 1)), mne.pick_info(raw.info, picks), verbose=False
+        )
+        info = evoked.apply_proj(verbose=False).decimate(decim).info
+        projector, n_proj, _ = make_projector(info["projs"], info["ch_names"], info["bads"])
+        used = np.unique(events[keep, 2])
+        return cls(
+            raw=raw,
+            events=events[keep],
+            event_id={k: v for k, v in event_id.items() if v in used},
+            picks=picks,
+            info=info,
+            first=first,
+            n_samples=n_samples,
+            decim=decim,
+            baseline=baseline,
+            projector=projector if n_proj else None,
+        )
+
+    @property
+    def _raw_times(self) -> np.ndarray:
+        return (self.first + np.arange(self.n_samples)) / self.raw.info["sfreq"]
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._raw_times[:: self.decim]
+
+    @property
+    def tmin(self) -> float:
+        return self.times[0]
+
+    @property
+    def ch_names(self) -> list[str]:
+        return self.info["ch_names"]
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __getitem__(self, key: str) -> "RawEpochs":
+        """The epochs of the events matching all "/"-separated tags in `key`."""
+        tags = set(key.split("/"))
+        event_id = {k: v for k, v in self.event_id.items() if tags.issubset(k.split("/"))}
+        if not event_id:
+            raise KeyError(f"No events match {key!r}")
+        keep = np.isin(self.events[:, 2], list(event_id.values()))
+        return replace(self, events=self.events[keep], event_id=event_id)
+
+    def get_data(
+        self,
+        picks=None,
+        tmin: float | None = None,
+        tmax: float | None = None,
+        item=None,
+    ) -> np.ndarray:
+        """
+        Data of the epochs in `item` (all if None), shape (n_items, n_channels, n_times), read
+        from the raw file one window at a time. As for `mne.Epochs`, bad channels are kept in the
+        epochs and excluded by string `picks`.
+        """
+        if picks is None:
+            ch_idx = np.arange(len(self.ch_names))
+        else:
+            ch_idx = mne.pick_channels(self.ch_names, pick_ch_names(self.info, picks), ordered=True)
+        items = np.atleast_1d(np.arange(len(self))[item if item is not None else slice(None)])
+        times = self.times
+        # Start and stop indices as `mne.Epochs.get_data` takes them, with tmax excluded
+        start = 0 if tmin is None else int((tmin - times[0]) * self.info["sfreq"])
+        stop = len(times) if tmax is None else int((tmax - times[0]) * self.info["sfreq"])
+        tslice = slice(*np.clip([start, stop], 0, len(times)))
+        if self.baseline is not None:
+            # Baseline samples at the raw sampling rate, from the sample nearest bmin to that
+            # nearest bmax inclusive
+            bmin, bmax = self.baseline
+            sfreq = self.raw.info["sfreq"]
+            bstart = 0 if bmin is None else max(0, int(round(bmin * sfreq)) - self.first)
+            bstop = self.n_samples if bmax is None else int(round(bmax * sfreq)) - self.first + 1
+            bslice = slice(bstart, bstop)
+            # Only data channels are baseline corrected, as by `mne.Epochs`
+            data_names = pick_ch_names(self.info, "data", exclude=(), allow_empty=True)
+            rescale = np.isin(np.array(self.ch_names)[ch_idx], data_names)
+
+        # Projection mixes channels, so all epoch channels are read when there is a projector
+        read_idx = ch_idx if self.projector is None else slice(None)
+        data = np.empty((len(items), len(ch_idx), len(times[tslice])))
+        for out, idx in zip(data, items):
+            start = self.events[idx, 0] - self.raw.first_samp + self.first
+            window = self.raw.get_data(
+                picks=self.picks[read_idx], start=start, stop=start + self.n_samples
+            )
+            if self.projector is not None:
+                window = (self.projector @ window)[ch_idx]
+            if self.baseline is not None:
+                window[rescale] -= window[rescale][:, bslice].mean(axis=-1, keepdims=True)
+            out[:] = window[:, :: self.decim][:, tslice]
+        return data
+
+    def average(self) -> mne.EvokedArray:
+        """
+        Evoked response of the data channels (bad ones included) of all epochs, as from
+        `Epochs.average`, accumulated one window at a time.
+        """
+        ch_names = pick_ch_names(self.info, "data", exclude=())
+        data_idx = mne.pick_channels(self.ch_names, ch_names, ordered=True)
+        total = np.zeros((len(ch_names), len(self.times)))
+        for idx in range(len(self)):
+            total += self.get_data(picks=ch_names, item=[idx])[0]
+        return mne.EvokedArray(
+            total / len(self),
+            mne.pick_info(self.info, data_idx),
+            tmin=self.tmin,
+            nave=len(self),
+            verbose=False,
+        )
+
+
+def miniblock_epochs(
+    raw: mne.io.BaseRaw, tmin: float, tmax: float, picks="data", decim: int = 1
+) -> RawEpochs:
+    """
+    `RawEpochs` of the MINIBLOCK events in the annotations of `raw` (see
+    `analysis.miniblock_events`), in place of `mne.Epochs(..., preload=True)` on the recording.
+    """
+    events, event_id = mne.events_from_annotations(raw, verbose=False)
+    event_id = {k: v for k, v in event_id.items() if k.split("/")[0] == "MINIBLOCK"}
+    return RawEpochs.from_raw(raw, events, event_id, tmin, tmax, picks=picks, decim=decim)
@@ -0,0 +1,276 @@
+"""
+Word lists of the miniblock states compiled into plain arrays when the state is constructed, so
+that the lookups made while frames are being drawn are array indexing rather than pandas calls,
+and the frame-by-frame flicker and word changes of each miniblock, which can also be checked
+offline before a session.
+"""
+
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from intermodulation.freqtag_spec import TRIGGERS
+
+REPORT_PIX_VALS = {
+    (False, False): (-1, -1, -1),
+    (True, False): (-(1 / 3), -(1 / 3), -(1 / 3)),
+    (False, True): (1 / 3, 1 / 3, 1 / 3),
+    (True, True): (1, 1, 1),
+}
+TRIGGER_CONDS = {
+    "phrase": "PHRASE",
+    "non-phrase": "NONPHRASE",
+    "non-word": "NONWORD",
+    "word": "WORD",
+}
+
+
+@dataclass(frozen=True)
+class WordSchedule:
+    """
+    The words, conditions and frequencies of a miniblock word list, with the words of each
+    miniblock stored contiguously.
+
+    Miniblock `i` covers entries `offsets[i]` to `offsets[i + 1]` of the arrays, in the order its
+    rows appear in the word list, and `rows` holds the position in the word list of each entry.
+    """
+
+    words: np.ndarray
+    conditions: np.ndarray
+    freqs: np.ndarray
+    offsets: np.ndarray
+    rows: np.ndarray
+
+    @classmethod
+    def from_word_list(
+        cls, word_list: pd.DataFrame, word_cols: Sequence[str] = ("w1", "w2")
+    ) -> "WordSchedule":
+        """
+        Compile a word list with a `miniblock` column numbering the miniblocks from 0, the word
+        columns `word_cols`, their frequency columns (`<col>_freq`) and a `condition` column.
+        """
+        miniblock = word_list["miniblock"].to_numpy()
+        n_miniblocks = len(np.unique(miniblock))
+        rows = np.argsort(miniblock, kind="stable")
+        offsets = np.searchsorted(miniblock[rows], np.arange(n_miniblocks + 1))
+        if np.any(np.diff(offsets) == 0):
+            raise ValueError(f"Miniblocks must be numbered 0 to {n_miniblocks - 1} without gaps.")
+        return cls(
+            words=word_list[list(word_cols)].to_numpy(dtype=object)[rows],
+            conditions=word_list["condition"].to_numpy(dtype=object)[rows],
+            freqs=word_list[[f"{col}_freq" for col in word_cols]].to_numpy(dtype=float)[rows],
+            offsets=offsets,
+            rows=rows,
+        )
+
+    @property
+    def n_miniblocks(self) -> int:
+        return len(self.offsets) - 1
+
+    def index(self, miniblock: int, word_idx: int) -> int:
+        """Entry of the `word_idx`-th word of a miniblock."""
+        return int(self.offsets[miniblock]) + word_idx
+
+    def next_word_idx(self, miniblock: int, word_idx: int) -> int:
+        """Index of the word after `word_idx`, staying on the last word of the miniblock."""
+        return min(word_idx + 1, int(self.offsets[miniblock + 1] - self.offsets[miniblock]) - 1)
+
+    def next_miniblock(self, miniblock: int) -> int:
+        """Index of the miniblock after `miniblock`, starting over after the last one."""
+        return (miniblock + 1) % self.n_miniblocks
+
+    def wordset(self, word_list: pd.DataFrame, miniblock: int) -> pd.DataFrame:
+        """The rows of `word_list` in a miniblock."""
+        return word_list.iloc[self.rows[self.offsets[miniblock] : self.offsets[miniblock + 1]]]
+
+
+def flicker_opacity(freq: float | None, framerate: float, n_frames: int) -> np.ndarray:
+    """
+    Opacity of a square-wave flicker at `freq` after each of `n_frames` frames, as switched by
+    `psystate.states.FrameFlickerStimState`: visible at first, then switching state at the end of
+    every half cycle. Stimuli without a frequency (None or 0) stay visible.
+    """
+    opacity = np.ones(n_frames)
+    if freq is None or freq == 0:
+        return opacity
+    halfcycle = int(np.round(framerate / (2 * freq)))
+    opacity[(np.arange(n_frames) + 1) // halfcycle % 2 == 1] = 0.0
+    return opacity
+
+
+def word_trigger(
+    condition: str,
+    w1_freq: float,
+    f1: float,
+    n_words: int,
+    miniblock_start: bool,
+    triggers: Mapping = TRIGGERS,
+) -> int:
+    """
+    Trigger value of a word (pair) of a miniblock, from its condition and whether the first word is
+    tagged at `f1`. The first words of a miniblock use the `MINIBLOCK` triggers.
+    """
+    task = "TWOWORD" if n_words == 2 else "ONEWORD"
+    if condition not in TRIGGER_CONDS:
+        raise ValueError(f"Invalid condition for {task.lower()} triggers: {condition}")
+    if task == "TWOWORD":
+        tag = "F1LEFT" if np.isclose(w1_freq, f1) else "F1RIGHT"
+    else:
+        tag = "F1" if np.isclose(w1_freq, f1) else "F2"
+    group = triggers["MINIBLOCK"] if miniblock_start else triggers
+    return int(group[task][TRIGGER_CONDS[condition]][tag])
+
+
+@dataclass(frozen=True)
+class FrameSchedule:
+    """
+    Frame-by-frame table of a miniblock, holding for each frame update the state of the display
+    once the update is made.
+
+    Attributes
+    ----------
+    parts : tuple[str, ...]
+        Flickering stimulus parts, the columns of `opacity` and `switch`
+    opacity : np.ndarray
+        Opacity of each part, shape (n_frames, n_parts)
+    switch : np.ndarray
+        Whether the opacity of each part changes on the frame, shape (n_frames, n_parts)
+    word_idx : np.ndarray
+        Index of the word (pair) shown within the miniblock, shape (n_frames,)
+    word_change : np.ndarray
+        Whether the next word (pair) of the miniblock is shown from the frame, shape (n_frames,)
+    text_change : np.ndarray
+        Whether the text on screen changes on the frame, shape (n_frames,)
+    trigger : np.ndarray
+        Trigger value sent on the frame, 0 for none, shape (n_frames,)
+    pix_color : np.ndarray
+        Fill colour of the reporting pixel, shape (n_frames, 3)
+    framerate : float
+        Frame rate of the display
+    """
+
+    parts: tuple[str, ...]
+    opacity: np.ndarray
+    switch: np.ndarray
+    word_idx: np.ndarray
+    word_change: np.ndarray
+    text_change: np.ndarray
+    trigger: np.ndarray
+    pix_color: np.ndarray
+    framerate: float
+
+    @classmethod
+    def compile(
+        cls,
+        schedule: WordSchedule,
+        miniblock: int,
+        framerate: float,
+        word_dur: float,
+        n_frames: int,
+        freqs: Sequence[float] | None = None,
+        reporting_pix: bool = False,
+    ) -> "FrameSchedule":
+        """
+        Compile the frames of a miniblock of `schedule`.
+
+        Parameters
+        ----------
+        schedule : WordSchedule
+            Compiled word list of the state
+        miniblock : int
+            Index of the miniblock
+        framerate : float
+            Frame rate of the display
+        word_dur : float
+            Duration of each word (pair) in seconds. The last word stays on screen if the
+            miniblock lasts longer than all of its words.
+        n_frames : int
+            Number of frames to compile
+        freqs : Sequence[float] | None, optional
+            The two tag frequencies (F1, F2), used to fill in the trigger values. No triggers are
+            compiled if None, by default None
+        reporting_pix : bool, optional
+            Whether the stimulus has a reporting pixel. A one-word stimulus flickers it along with
+            the word, by default False
+
+        Returns
+        -------
+        FrameSchedule
+            The frames of the miniblock
+        """
+        n_cols = schedule.words.shape[1]
+        start, stop = schedule.offsets[miniblock], schedule.offsets[miniblock + 1]
+        frames = np.arange(n_frames)
+        wordframes = int(np.round(word_dur * framerate))
+        word_idx = np.minimum(frames // wordframes, stop - start - 1)
+        word_change = np.diff(word_idx, prepend=0) != 0
+        words = schedule.words[start + word_idx]
+        text_change = word_change & np.any(words != np.roll(words, 1, axis=0), axis=1)
+
+        parts = ("word1", "word2")[:n_cols]
+        part_freqs = list(schedule.freqs[start])
+        if n_cols == 1 and reporting_pix:
+            parts += ("reporting_pix",)
+            part_freqs.append(part_freqs[0])
+        opacity = np.column_stack([flicker_opacity(f, framerate, n_frames) for f in part_freqs])
+        previous = np.vstack((np.ones((1, len(parts))), opacity[:-1]))
+        switch = opacity != previous
+
+        if n_cols == 2:
+            lut = np.empty((2, 2, 3))
+            for (on1, on2), color in REPORT_PIX_VALS.items():
+                lut[int(on1), int(on2)] = color
+            pix_color = lut[(opacity[:, 0] > 0).astype(int), (opacity[:, 1] > 0).astype(int)]
+        else:
+            pix_color = np.ones((n_frames, 3))
+
+        trigger = np.zeros(n_frames, dtype=int)
+        if freqs is not None:
+            values = [
+                word_trigger(
+                    schedule.conditions[entry],
+                    schedule.freqs[entry, 0],
+                    freqs[0],
+                    n_cols,
+                    miniblock_start=False,
+                )
+                for entry in range(start, stop)
+            ]
+            trigger[text_change] = np.asarray(values)[word_idx[text_change]]
+            trigger[0] = word_trigger(
+                schedule.conditions[start], schedule.freqs[start, 0], freqs[0], n_cols, True
+            )
+        return cls(
+            parts=parts,
+            opacity=opacity,
+            switch=switch,
+            word_idx=word_idx,
+            word_change=word_change,
+            text_change=text_change,
+            trigger=trigger,
+            pix_color=pix_color,
+            framerate=framerate,
+        )
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.word_idx)
+
+    def spectrum(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Amplitude spectrum of the opacity of each part, without its mean.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The frequencies, and the amplitudes of shape (n_freqs, n_parts)
+        """
+        amps = np.abs(np.fft.rfft(self.opacity - self.opacity.mean(axis=0), axis=0))
+        return np.fft.rfftfreq(self.n_frames, 1 / self.framerate), amps / self.n_frames
+
+    def peak_frequencies(self) -> dict[str, float]:
+        """Frequency of the largest component of each part's flicker, 0 for parts that don't."""
+        freqs, amps = self.spectrum()
+        return {part: float(freqs[np.argmax(amps[:, i])]) for i, part in enumerate(self.parts)}
@@ -0,0 +1,198 @@
+"""
+Cache of the per-subject geometry used in source space: the assembled inverse kernel
+(`analysis.InverseKernel`) and the sparse morph matrix to fsaverage.
+
+Entries are keyed by a hash of the parameters used and of the files passed to `cache_key`, e.g.
+the inverse or forward solution an entry is computed from. Files are identified by their name,
+size and modification time rather than their contents, so an entry is recomputed when one of its
+key files is rewritten, but not when a file left out of its key changes. Each entry is a
+directory under the cache root, named by its key, holding only `.npy`/`.npz` files and a JSON
+description.
+"""
+
+import hashlib
+import json
+import os
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import mne
+import numpy as np
+import scipy.sparse
+
+from intermodulation.analysis import InverseKernel
+
+META = "meta.json"
+
+
+def file_fingerprint(path: Path) -> str:
+    """
+    Name, size and modification time of a file, which change whenever it is rewritten, without
+    reading its (possibly large) contents. A missing file has a fingerprint of its own.
+    """
+    if not path.exists():
+        return f"{path.name}:missing"
+    stat = path.stat()
+    return f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cache_key(*parts) -> str:
+    """
+    Key of a cache entry computed from `parts`. Paths contribute their `file_fingerprint`, so that
+    entries are invalidated when an input file changes, and all other parts their `repr`.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        part = file_fingerprint(part) if isinstance(part, Path) else repr(part)
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:24]
+
+
+@dataclass
+class MorphMatrix:
+    """
+    The sparse matrix of a surface `mne.SourceMorph`, without the source spaces needed to build it.
+    `apply` gives the same result as `SourceMorph.apply` for surface source estimates.
+    """
+
+    morph_mat: scipy.sparse.csr_array
+    vertices_from: list
+    vertices_to: list
+    subject_from: str | None
+    subject_to: str
+
+    @classmethod
+    def from_morph(cls, morph: mne.SourceMorph):
+        if morph.kind != "surface":
+            raise ValueError(f"Only surface morphs can be cached, not {morph.kind} morphs.")
+        return cls(
+            morph_mat=scipy.sparse.csr_array(morph.morph_mat),
+            vertices_from=list(morph.src_data["vertices_from"]),
+            vertices_to=list(morph.vertices_to),
+            subject_from=morph.subject_from,
+            subject_to=morph.subject_to,
+        )
+
+    def _check_vertices(self, vertices: list):
+        if len(vertices) != len(self.vertices_from) or not all(
+            np.array_equal(v1, v2) for v1, v2 in zip(self.vertices_from, vertices)
+        ):
+            raise ValueError("Vertices of the source estimate do not match the morph.")
+
+    def apply(self, stc: mne.SourceEstimate) -> mne.SourceEstimate:
+        self._check_vertices(stc.vertices)
+        return mne.SourceEstimate(
+            self.morph_mat @ stc.data, self.vertices_to, stc.tmin, stc.tstep, self.subject_to
+        )
+
+    def apply_batch(self, arrays: list[np.ndarray], vertices: list[list]) -> list[np.ndarray]:
+        """
+        Morph several (n_sources, n_i) arrays at once, e.g. the PSDs and SNRs of every condition,
+        whose rows are the sources of `vertices` (one list of vertices per array), checked against
+        those of the morph as by `apply`.
+
+        The arrays are stacked along their second axis and multiplied by the morph matrix in a
+        single sparse product, then split back into arrays of the original widths (as views into
+        one result array).
+        """
+        for verts in vertices:
+            self._check_vertices(verts)
+        widths = [arr.shape[1] for arr in arrays]
+        morphed = self.morph_mat @ np.concatenate(arrays, axis=1)
+        return np.split(morphed, np.cumsum(widths)[:-1], axis=1)
+
+
+@dataclass
+class SourceCache:
+    """Cache of inverse kernels and morph matrices under the directory `root`."""
+
+    root: Path
+
+    def __post_init__(self):
+        self.root = Path(self.root)
+
+    def inverse_kernel(self, key: str, compute: Callable[[], InverseKernel]) -> InverseKernel:
+        """The kernel cached under `key`, or the result of `compute()`, which is then cached."""
+        path = self.root / key
+        if (path / META).exists():
+            with open(path / META) as f:
+                meta = json.load(f)
+            arrays = np.load(path / "kernel.npz")
+            return InverseKernel(
+                kernel=arrays["kernel"],
+                ch_names=meta["ch_names"],
+                vertices=[arrays[f"vertno{i}"] for i in range(meta["n_vertno"])],
+                n_orient=meta["n_orient"],
+                noise_norm=arrays["noise_norm"] if "noise_norm" in arrays else None,
+                nave=meta["nave"],
+                subject=meta["subject"],
+            )
+
+        kernel = compute()
+        arrays = {"kernel": kernel.kernel}
+        arrays.update({f"vertno{i}": vertno for i, vertno in enumerate(kernel.vertices)})
+        if kernel.noise_norm is not None:
+            arrays["noise_norm"] = kernel.noise_norm
+        meta = dict(
+            kind="inverse_kernel",
+            ch_names=kernel.ch_names,
+            n_vertno=len(kernel.vertices),
+            n_orient=kernel.n_orient,
+            nave=kernel.nave,
+            subject=kernel.subject,
+        )
+        self._write(path, meta, lambda tmp: np.savez(tmp / "kernel.npz", **arrays))
+        return kernel
+
+    def morph_matrix(
+        self, key: str, compute: Callable[[], mne.SourceMorph | MorphMatrix]
+    ) -> MorphMatrix:
+        """The morph cached under `key`, or the morph matrix of `compute()`, then cached."""
+        path = self.root / key
+        if (path / META).exists():
+            with open(path / META) as f:
+                meta = json.load(f)
+            vertices = np.load(path / "vertices.npz")
+            return MorphMatrix(
+                morph_mat=scipy.sparse.csr_array(scipy.sparse.load_npz(path / "morph_mat.npz")),
+                vertices_from=[vertices[f"from{i}"] for i in range(meta["n_vertno"])],
+                vertices_to=[vertices[f"to{i}"] for i in range(meta["n_vertno"])],
+                subject_from=meta["subject_from"],
+                subject_to=meta["subject_to"],
+            )
+
+        morph = compute()
+        if not isinstance(morph, MorphMatrix):
+            morph = MorphMatrix.from_morph(morph)
+        vertices = {f"from{i}": vertno for i, vertno in enumerate(morph.vertices_from)}
+        vertices.update({f"to{i}": vertno for i, vertno in enumerate(morph.vertices_to)})
+        meta = dict(
+            kind="morph_matrix",
+            n_vertno=len(morph.vertices_from),
+            subject_from=morph.subject_from,
+            subject_to=morph.subject_to,
+        )
+
+        def write(tmp):
+            scipy.sparse.save_npz(tmp / "morph_mat.npz", morph.morph_mat)
+            np.savez(tmp / "vertices.npz", **vertices)
+
+        self._write(path, meta, write)
+        return morph
+
+    def _write(self, path: Path, meta: dict, write_arrays: Callable[[Path], None]):
+        # Written to a temporary directory then renamed, so interrupted or concurrent runs never
+        # leave a partial entry behind
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        write_arrays(tmp)
+        with open(tmp / META, "w") as f:
+            json.dump(meta, f, indent=2)
+        try:
+            tmp.rename(path)
+        except OSError:  # Another run cached the same entry first
+            for fname in tmp.iterdir():
+                fname.unlink()
+            tmp.rmdir()
@@ -0,0 +1,243 @@
+"""
+On-disk storage of per-subject spectra (PSD, SNR, ITC, ...) as one `.npy` file per condition key
+and field, with a JSON manifest describing the contents.
+
+A store is a directory, e.g. `sub-01_ses-01_task-syntaxIM_proc-clean_desc-oneword_allcondSNR/`,
+holding:
+  - `manifest.json`: the keys, their fields, and the file, shape and dtype of each array
+  - `<key>_<field>.npy`: one array per key and field, with "/" in keys replaced by "-"
+  - `info.fif`: the measurement info of the channels along the channel axis, if any
+
+Arrays are memory-mapped when read, so a single condition, channel subset or frequency range can
+be pulled out of a store without reading the rest of it.
+"""
+
+import json
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import mne
+import numpy as np
+
+MANIFEST = "manifest.json"
+INFO = "info.fif"
+STORE_VERSION = 1
+
+
+def _fname(key: str, fieldname: str) -> str:
+    return f"{key.replace('/', '-')}_{fieldname}.npy"
+
+
+def save_spectral_store(
+    path: str | Path,
+    spectra: dict,
+    info: mne.Info | None = None,
+    ch_names: list[str] | None = None,
+    overwrite: bool = False,
+) -> Path:
+    """
+    Write a dictionary of per-condition spectra to a spectral store directory.
+
+    Parameters
+    ----------
+    path : str | Path
+        Directory of the store. Will be created if it does not exist.
+    spectra : dict
+        Mapping of condition key (e.g. "F1" or "ONEWORD/WORD/F1") to a dictionary of fields. Array
+        fields (e.g. `psds`, `snrs`, `freqs`) are saved as `.npy` files. `mne.SourceEstimate`
+        fields are saved as their vertices and time axis, to be rebuilt with new data by
+        `SpectralStore.source_estimate`. Other values raise a `TypeError`.
+    info : mne.Info | None, optional
+        Measurement info for the channels of the spectra, by default None
+    ch_names : list[str] | None, optional
+        Names of the channels along the channel axis (second to last) of the spectra. If given with
+        `info`, the saved info is restricted to these channels, by default None
+    overwrite : bool, optional
+        Whether to overwrite an existing store at `path`, by default False
+
+    Returns
+    -------
+    Path
+        The store directory
+    """
+    path = Path(path)
+    if (path / MANIFEST).exists() and not overwrite:
+        raise FileExistsError(f"Spectral store already exists at {path}!")
+    path.mkdir(parents=True, exist_ok=True)
+
+    manifest = {"version": STORE_VERSION, "ch_names": ch_names, "info": None, "keys": {}}
+    for key, fields in spectra.items():
+        entry = manifest["keys"][key] = {"arrays": {}, "stc": {}}
+        for fieldname, value in fields.items():
+            if isinstance(value, mne.SourceEstimate):
+                vertfiles = []
+                for i, vertno in enumerate(value.vertices):
+                    vertfiles.append(_fname(key, f"{fieldname}_vertno{i}"))
+                    np.save(path / vertfiles[-1], vertno)
+                entry["stc"][fieldname] = dict(
+                    vertices=vertfiles,
+                    tmin=float(value.tmin),
+                    tstep=float(value.tstep),
+                    subject=value.subject,
+                )
+            elif isinstance(value, np.ndarray):
+                fname = _fname(key, fieldname)
+                np.save(path / fname, value)
+                entry["arrays"][fieldname] = dict(
+                    file=fname, shape=list(value.shape), dtype=value.dtype.str
+                )
+            else:
+                raise TypeError(f"Cannot store {key}/{fieldname} of type {type(value)}")
+
+    if info is not None:
+        if ch_names is not None:
+            info = mne.pick_info(info, [info.ch_names.index(ch) for ch in ch_names])
+        mne.io.write_info(path / INFO, info, overwrite=True)
+        manifest["info"] = INFO
+
+    with open(path / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+@dataclass
+class SpectralStore:
+    """
+    Read access to a spectral store written by `save_spectral_store`.
+
+    Indexing the store by a condition key gives a dictionary of its array fields, memory-mapped
+    unless `mmap_mode` is None. `get` slices a single field by channels and frequency range.
+    """
+
+    path: Path
+    mmap_mode: str | None = "r"
+    manifest: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        with open(self.path / MANIFEST) as f:
+            self.manifest = json.load(f)
+
+    def keys(self) -> list[str]:
+        return list(self.manifest["keys"])
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.manifest["keys"]
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def __getitem__(self, key: str) -> dict[str, np.ndarray]:
+        arrays = self.manifest["keys"][key]["arrays"]
+        return {name: self._load(arr["file"]) for name, arr in arrays.items()}
+
+    def _load(self, fname: str) -> np.ndarray:
+        return np.load(self.path / fname, mmap_mode=self.mmap_mode)
+
+    @property
+    def ch_names(self) -> list[str] | None:
+        return self.manifest["ch_names"]
+
+    @property
+    def info(self) -> mne.Info | None:
+        if self.manifest["info"] is None:
+            return None
+        return mne.io.read_info(self.path / self.manifest["info"], verbose=False)
+
+    def get(
+        self,
+        key: str,
+        fieldname: str,
+        picks: list[str] | None = None,
+        fmin: float | None = None,
+        fmax: float | None = None,
+    ) -> np.ndarray:
+        """
+        Read one field of a condition, optionally restricted to some channels and frequencies.
+
+        Parameters
+        ----------
+        key : str
+            Condition key
+        fieldname : str
+            Name of the array, e.g. "psds" or "snrs"
+        picks : list[str] | None, optional
+            Channel names to read along the channel (second to last) axis, by default all
+        fmin, fmax : float | None, optional
+            Frequency range to read along the last axis, using the `freqs` field of the key, by
+            default the whole spectrum
+
+        Returns
+        -------
+        np.ndarray
+            The requested slice, read into memory
+        """
+        data = self[key][fieldname]
+        if fmin is not None or fmax is not None:
+            freqs = self._load(self.manifest["keys"][key]["arrays"]["freqs"]["file"])
+            fmask = np.ones(len(freqs), dtype=bool)
+            if fmin is not None:
+                fmask &= freqs >= fmin
+            if fmax is not None:
+                fmask &= freqs <= fmax
+            fidx = np.flatnonzero(fmask)
+            data = data[..., fidx[0] : fidx[-1] + 1]
+        if picks is not None:
+            if self.ch_names is None:
+                raise ValueError("Store has no channel names to pick from.")
+            chidx = [self.ch_names.index(ch) for ch in picks]
+            data = data[..., chidx, :]
+        return np.asarray(data)
+
+    def source_estimate(self, key: str, data: np.ndarray, fieldname: str = "stc"):
+        """Rebuild the source estimate stored under `key`/`fieldname` with new `data`."""
+        meta = self.manifest["keys"][key]["stc"][fieldname]
+        vertices = [np.load(self.path / fname) for fname in meta["vertices"]]
+        return mne.SourceEstimate(
+            data=data,
+            vertices=vertices,
+            tmin=meta["tmin"],
+            tstep=meta["tstep"],
+            subject=meta["subject"],
+        )
+
+
+def convert_pickle(pkl_path: str | Path, path: str | Path | None = None, overwrite=False) -> Path:
+    """
+    Convert a pickled dictionary of spectra (e.g. `*_allcondSNR.pkl`) to a spectral store.
+
+    A `samp_epoch` entry, as saved by older versions of `02_subject_sensor_snr.py`, is stored as
+    the info of the good data channels, which are the channels the spectra were computed on.
+
+    Parameters
+    ----------
+    pkl_path : str | Path
+        Pickle file to convert
+    path : str | Path | None, optional
+        Store directory to write, by default the pickle path without its suffix
+    overwrite : bool, optional
+        Whether to overwrite an existing store, by default False
+
+    Returns
+    -------
+    Path
+        The store directory
+    """
+    pkl_path = Path(pkl_path)
+    if path is None:
+        path = pkl_path.with_suffix("")
+    with open(pkl_path, "rb") as f:
+        spectra = pickle.load(f)
+    info, ch_names = None, None
+    if "samp_epoch" in spectra:
+        samp = spectra.pop("samp_epoch")
+        info = samp.info
+        ch_names = samp.copy().pick("data", exclude="bads").ch_names
+    return save_spectral_store(path, spectra, info=info, ch_names=ch_names, overwrite=overwrite)
+
+
+def find_stores(root: str | Path, pattern: str) -> list[Path]:
+    """Spectral store directories under `root` whose names match the glob `pattern`."""
+    return sorted(p.parent for p in Path(root).rglob(f"{pattern}/{MANIFEST}"))
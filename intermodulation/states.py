@@ -9,6 +9,8 @@ import psystate.states as ps
 from byte_triggers._base import BaseTrigger
 
 import intermodulation.stimuli as ims
+from intermodulation.frame_timing import FrameTimer
+from intermodulation.schedule import REPORT_PIX_VALS, FrameSchedule, WordSchedule
 
 DOT_DEFAULT = {
     "size": (0.05, 0.05),
@@ -19,12 +21,6 @@ DOT_DEFAULT = {
     "fillColor": "white",
     "interpolate": True,
 }
-REPORT_PIX_VALS = {
-    (False, False): (-1, -1, -1),
-    (True, False): (-(1 / 3), -(1 / 3), -(1 / 3)),
-    (False, True): (1 / 3, 1 / 3, 1 / 3),
-    (True, True): (1, 1, 1),
-}
 
 
 @dataclass
@@ -59,6 +55,104 @@ class StartStopTriggerLogMixin:
         self.loggables = mergelog
 
 
+@dataclass
+class FrameTimingMixin:
+    frame_timing: bool = field(kw_only=True, default=True)
+    timing_capacity: int = field(kw_only=True, default=2**14)
+
+    def attach_frame_timer(self):
+        """
+        Record the flip times of each run of the state into `frame_timer`, and append a summary of
+        them to `timing_summaries` when the state ends. Must be called once the end calls of the
+        state are set up, as the summary has to be made before the miniblock is incremented.
+
+        Flips are timed by the window's own timestamp of the flip, taken before any of the flip
+        callbacks (e.g. triggers) run. Each late flip is logged under `late_flip` with its time
+        on the update it belongs to, as the state runs.
+        """
+        self.timing_summaries = []
+        if not self.frame_timing:
+            self.frame_timer = None
+            return
+        self.frame_timer = FrameTimer(self.framerate, capacity=self.timing_capacity)
+        self._flip_time = None
+        self.start_calls.extend([self.frame_timer.reset, self._time_next_flip])
+        self.update_calls.append(self._time_next_flip)
+        self.end_calls.insert(0, self._summarize_timing)
+        self.loggables.add(
+            "update",
+            pe.AttributeLogItem(
+                "late_flip", False, self, "_flip_time", cond=lambda: self.frame_timer.late
+            ),
+        )
+
+    def _time_next_flip(self):
+        # Registered in this order, so the flip time is assigned before it is recorded
+        self.window.timeOnFlip(self, "_flip_time")
+        self.window.callOnFlip(self._record_flip)
+
+    def _record_flip(self):
+        self.frame_timer.record(self._flip_time)
+
+    def _summarize_timing(self):
+        summary = {"run": len(self.timing_summaries), "miniblock": self.miniblock_idx}
+        summary.update(self.frame_timer.summary())
+        for key in ("word1", "word2"):
+            if key in self.frequencies:
+                freq = self.frequencies[key]
+                summary[f"{key}_freq"] = freq
+                summary[f"{key}_freq_effective"] = freq * summary["framerate_ratio"]
+        self.timing_summaries.append(summary)
+
+
+@dataclass
+class FrameScheduleMixin:
+    """
+    Flicker and word changes of a miniblock state from the `FrameSchedule` of each miniblock of
+    its `schedule`, compiled once by `_compile_frames`. Must come before
+    `ps.FrameFlickerStimState` in the bases, so that its `_update_stim` is used.
+    """
+
+    @property
+    def frames(self) -> FrameSchedule:
+        return self.frame_schedules[self.miniblock_idx]
+
+    def _compile_frames(self) -> list[FrameSchedule]:
+        if callable(self.dur):
+            raise ValueError(
+                f"{type(self).__name__} needs a fixed duration to compile its frames, not a "
+                "callable one."
+            )
+        n_frames = int(np.ceil(self.dur * self.framerate))
+        return [
+            FrameSchedule.compile(
+                self.schedule,
+                i,
+                self.framerate,
+                self.stim_dur,
+                n_frames,
+                reporting_pix=self.stim.reporting_pix,
+            )
+            for i in range(self.schedule.n_miniblocks)
+        ]
+
+    def _update_stim(self):
+        # Flicker from the compiled frames, falling back on the flicker targets of
+        # FrameFlickerStimState if the state runs past them
+        if self.frame_num >= self.frames.n_frames:
+            return super()._update_stim()
+        opacity = self.frames.opacity[self.frame_num]
+        switch = self.frames.switch[self.frame_num]
+        newstates = {
+            part: {"opacity": opacity[i]} for i, part in enumerate(self.frames.parts) if switch[i]
+        }
+        changed = self.stim.update_stim(newstates)
+        if changed is not None:
+            changed = [(*v, self.frame_num) for v in changed]
+            self._update_log.extend(changed)
+        self.frame_num += 1
+
+
 @dataclass
 class TwoWordState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
     stim: ims.TwoWordStim = field(kw_only=True)
@@ -101,7 +195,9 @@ class TwoWordState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
 
 
 @dataclass
-class TwoWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
+class TwoWordMiniblockState(
+    FrameScheduleMixin, ps.FrameFlickerStimState, StartStopTriggerLogMixin, FrameTimingMixin
+):
     stim: ims.TwoWordStim = field(kw_only=True)
     stim_dur: float = field(kw_only=True)
     word_list: pd.DataFrame = field(kw_only=True)
@@ -114,18 +210,19 @@ class TwoWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
         self.wordframes = int(np.round(self.stim_dur / (1 / self.framerate)))
 
         # Ignore the initial passed words and use the list
-        self.wordset = self.word_list.query("miniblock == 0")
+        self.schedule = WordSchedule.from_word_list(self.word_list, ("w1", "w2"))
+        self.frame_schedules = self._compile_frames()
         self._init_miniblock()
         self.update_calls.insert(1, self.check_word_update)
         self.end_calls.append(self._inc_miniblock)
         if self.stim.reporting_pix:
             self.update_calls.append(self._set_pixreport)
+        self.attach_frame_timer()
 
     def check_word_update(self):
-        if self.frame_num % self.wordframes == 0 and self.frame_num > 0:
+        if self.frame_num < self.frames.n_frames and self.frames.word_change[self.frame_num]:
             self._inc_wordidx()
-            self.word1 = self.wordset.iloc[self.wordset_idx]["w1"]
-            self.word2 = self.wordset.iloc[self.wordset_idx]["w2"]
+            self.word1, self.word2 = self.schedule.words[self._word_entry]
             changed = self.stim.update_stim({})
             if changed is not None:
                 changed = [(*v, self.frame_num) for v in changed]
@@ -147,30 +244,34 @@ class TwoWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
     def word2(self, value):
         self.stim.word2 = value
 
+    @property
+    def wordset(self) -> pd.DataFrame:
+        return self.schedule.wordset(self.word_list, self.miniblock_idx)
+
+    @property
+    def _word_entry(self) -> int:
+        return self.schedule.index(self.miniblock_idx, self.wordset_idx)
+
     def _inc_wordidx(self):
-        if self.wordset_idx == (len(self.wordset) - 1):
-            pass
-        else:
-            self.wordset_idx += 1
-        self.condition = self.wordset.iloc[self.wordset_idx]["condition"]
+        self.wordset_idx = self.schedule.next_word_idx(self.miniblock_idx, self.wordset_idx)
+        self.condition = self.schedule.conditions[self._word_entry]
 
     def _inc_miniblock(self):
         self.wordset_idx = 0
-        self.miniblock_idx += 1
-        if self.miniblock_idx == len(self.word_list["miniblock"].unique()):
-            self.miniblock_idx = 0
-        self.wordset = self.word_list.query(f"miniblock == {self.miniblock_idx}")
+        self.miniblock_idx = self.schedule.next_miniblock(self.miniblock_idx)
         self._init_miniblock()
 
     def _init_miniblock(self):
-        initial = self.wordset.iloc[0]
-        self.word1 = initial["w1"]
-        self.word2 = initial["w2"]
-        self.frequencies["word1"] = initial["w1_freq"]
-        self.frequencies["word2"] = initial["w2_freq"]
-        self.condition = initial["condition"]
+        entry = self.schedule.index(self.miniblock_idx, 0)
+        self.word1, self.word2 = self.schedule.words[entry]
+        self.frequencies["word1"], self.frequencies["word2"] = self.schedule.freqs[entry]
+        self.condition = self.schedule.conditions[entry]
 
     def _set_pixreport(self, *args, **kwargs):
+        # Called after _update_stim has moved on to the next frame
+        if self.frame_num <= self.frames.n_frames:
+            self.stim.stim["reporting_pix"].fillColor = self.frames.pix_color[self.frame_num - 1]
+            return
         word_states = (
             bool(self.stim.stim["word1"].opacity),
             bool(self.stim.stim["word2"].opacity),
@@ -218,7 +319,9 @@ class OneWordState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
 
 
 @dataclass
-class OneWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
+class OneWordMiniblockState(
+    FrameScheduleMixin, ps.FrameFlickerStimState, StartStopTriggerLogMixin, FrameTimingMixin
+):
     stim: ims.OneWordStim = field(kw_only=True)
     stim_dur: float = field(kw_only=True)
     word_list: pd.DataFrame = field(kw_only=True)
@@ -231,7 +334,8 @@ class OneWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
         self.wordframes = int(np.round(self.stim_dur / (1 / self.framerate)))
 
         # Ignore the initial passed words and use the list
-        self.wordset = self.word_list.query("miniblock == 0")
+        self.schedule = WordSchedule.from_word_list(self.word_list, ("w1",))
+        self.frame_schedules = self._compile_frames()
         self._init_miniblock()
         self.update_calls.insert(
             1, self.check_word_update
@@ -239,11 +343,12 @@ class OneWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
         self.end_calls.append(self._inc_miniblock)
         if self.stim.reporting_pix:
             self.update_calls.append(self._set_pixreport)
+        self.attach_frame_timer()
 
     def check_word_update(self):
-        if self.frame_num % self.wordframes == 0 and self.frame_num > 0:
+        if self.frame_num < self.frames.n_frames and self.frames.word_change[self.frame_num]:
             self._inc_wordidx()
-            self.word1 = self.wordset.iloc[self.wordset_idx]["w1"]
+            (self.word1,) = self.schedule.words[self._word_entry]
             changed = self.stim.update_stim({})
             if changed is not None:
                 changed = [(*v, self.frame_num) for v in changed]
@@ -257,28 +362,30 @@ class OneWordMiniblockState(ps.FrameFlickerStimState, StartStopTriggerLogMixin):
     def word1(self, value):
         self.stim.word1 = value
 
+    @property
+    def wordset(self) -> pd.DataFrame:
+        return self.schedule.wordset(self.word_list, self.miniblock_idx)
+
+    @property
+    def _word_entry(self) -> int:
+        return self.schedule.index(self.miniblock_idx, self.wordset_idx)
+
     def _inc_wordidx(self):
-        if self.wordset_idx == (len(self.wordset) - 1):
-            pass
-        else:
-            self.wordset_idx += 1
-        self.condition = self.wordset.iloc[self.wordset_idx]["condition"]
+        self.wordset_idx = self.schedule.next_word_idx(self.miniblock_idx, self.wordset_idx)
+        self.condition = self.schedule.conditions[self._word_entry]
 
     def _inc_miniblock(self):
         self.wordset_idx = 0
-        self.miniblock_idx += 1
-        if self.miniblock_idx == len(self.word_list["miniblock"].unique()):
-            self.miniblock_idx = 0
-        self.wordset = self.word_list.query(f"miniblock == {self.miniblock_idx}")
+        self.miniblock_idx = self.schedule.next_miniblock(self.miniblock_idx)
         self._init_miniblock()
 
     def _init_miniblock(self):
-        initial = self.wordset.iloc[0]
-        self.word1 = initial["w1"]
-        self.frequencies["word1"] = initial["w1_freq"]
+        entry = self.schedule.index(self.miniblock_idx, 0)
+        (self.word1,) = self.schedule.words[entry]
+        (self.frequencies["word1"],) = self.schedule.freqs[entry]
         if self.stim.reporting_pix:
-            self.frequencies["reporting_pix"] = initial["w1_freq"]
-        self.condition = initial["condition"]
+            self.frequencies["reporting_pix"] = self.frequencies["word1"]
+        self.condition = self.schedule.conditions[entry]
 
     def _set_pixreport(self):
         pass
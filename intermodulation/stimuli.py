@@ -1,4 +1,4 @@
-from collections.abc import Mapping
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass, field
 
 import numpy as np
@@ -6,9 +6,127 @@ import psychopy.tools.monitorunittools as mut
 import psychopy.visual.rect
 import psychopy.visual.shape
 import psystate.stimuli as pst
+from psychopy.visual.bufferimage import BufferImageStim
 
 from intermodulation.freqtag_spec import DOT_CONFIG, TEXT_CONFIG
 
+
+@dataclass
+class WordTextureCache:
+    """
+    Words pre-rendered to textures for the text parts of a stimulus, so that changing the word
+    shown swaps which texture is drawn instead of laying out and uploading the text again.
+
+    Each word is drawn once with the `TextStim` arguments of its part and captured from the back
+    buffer as a `BufferImageStim` covering its bounding box. The capture includes the window
+    background behind the text, so the window color must not change during the run.
+    """
+
+    textures: dict[tuple[str, str], BufferImageStim]
+    nbytes: int
+    shown: dict[str, str] = field(default_factory=dict, init=False)
+
+    @classmethod
+    def build(
+        cls, stim: pst.StatefulStim, words: Mapping[str, Iterable[str]], padding: int = 4
+    ) -> "WordTextureCache":
+        """
+        Render `words[part]` with the arguments of each text `part` of `stim`.
+
+        Parameters
+        ----------
+        stim : pst.StatefulStim
+            Stimulus whose parts are rendered, e.g. a `TwoWordStim`
+        words : Mapping[str, Iterable[str]]
+            Words to render for each part, e.g. `{"word1": twowords["w1"], "word2":
+            twowords["w2"]}` from `utils.load_prep_words`
+        padding : int, optional
+            Pixels captured around the bounding box of each word, by default 4
+
+        Returns
+        -------
+        WordTextureCache
+            Textures of every (part, word) pair
+        """
+        win = stim.win
+        halfsize = np.asarray(win.size) / 2
+        textures = {}
+        nbytes = 0
+        for part, partwords in words.items():
+            kwargs = {k: v for k, v in stim.stim_kwargs[part].items() if k != "text"}
+            for word in dict.fromkeys(partwords):
+                text = psychopy.visual.TextStim(win=win, text=word, **kwargs)
+                text.draw()  # Lays out the text, which gives the bounding box
+                left, bottom, right, top = _text_rect_pix(text, padding)
+                texture = BufferImageStim(
+                    win,
+                    rect=(
+                        left / halfsize[0],
+                        top / halfsize[1],
+                        right / halfsize[0],
+                        bottom / halfsize[1],
+                    ),
+                    stim=[text],
+                    interpolate=False,
+                )
+                texture.pos = ((left + right) / 2, (bottom + top) / 2)
+                textures[(part, word)] = texture
+                nbytes += int(np.prod(texture.size)) * 4  # RGBA, one byte per channel
+        return cls(textures=textures, nbytes=nbytes)
+
+    @property
+    def n_textures(self) -> int:
+        return len(self.textures)
+
+    @property
+    def parts(self) -> set[str]:
+        return {part for part, _ in self.textures}
+
+    def swap(self, stim: pst.StatefulStim, part: str, word: str):
+        """Draw the texture of `word` in place of what `part` of the started `stim` shows."""
+        old = stim.stim[part]
+        try:
+            new = self.textures[(part, word)]
+        except KeyError:
+            raise KeyError(f"No pre-rendered texture of {word!r} for {part}.") from None
+        self.shown[part] = word
+        if new is old:
+            return
+        new.opacity = old.opacity
+        old.setAutoDraw(False)
+        new.setAutoDraw(True)
+        stim.stim[part] = new
+
+    def update_text(self, stim: pst.StatefulStim, kwargs: dict) -> list:
+        """
+        Swap textures for the text changes in the `update_stim` arguments `kwargs`, which are
+        removed from them. Returns the changes in the format of `StatefulStim.update_stim`.
+        """
+        changed = []
+        for part in self.parts:
+            if "text" in kwargs.get(part, {}):
+                word = kwargs[part].pop("text")
+                self.swap(stim, part, word)
+                changed.append((part, "text", word))
+        return changed
+
+
+def _shown_text(stim: pst.StatefulStim, part: str) -> str:
+    # Text shown by a part of a started stimulus, drawn either as a TextStim or from the cache
+    if stim.texture_cache is None:
+        return stim.stim[part].text
+    return stim.texture_cache.shown[part]
+
+
+def _text_rect_pix(text: psychopy.visual.TextStim, padding: int) -> tuple[float, ...]:
+    # Edges (left, bottom, right, top) in pixels from the center of the window of a laid out text
+    width, height = text.boundingBox
+    x, y = text.posPix
+    left = {"left": x, "right": x - width}.get(text.anchorHoriz, x - width / 2)
+    bottom = {"bottom": y, "top": y - height}.get(text.anchorVert, y - height / 2)
+    return (left - padding, bottom - padding, left + width + padding, bottom + height + padding)
+
+
 @dataclass
 class TwoWordStim(pst.StatefulStim):
     win: psychopy.visual.Window
@@ -20,6 +138,7 @@ class TwoWordStim(pst.StatefulStim):
     reporting_pix_size: int = 4
     text_config: Mapping = field(default_factory=TEXT_CONFIG.copy)
     dot_config: Mapping = field(default_factory=DOT_CONFIG.copy)
+    texture_cache: WordTextureCache | None = None
 
     def __post_init__(self):
         # Set up the stimulus constructors and arguments
@@ -75,6 +194,9 @@ class TwoWordStim(pst.StatefulStim):
         self.stim_kwargs["word1"]["text"] = self.word1
         self.stim_kwargs["word2"]["text"] = self.word2
         super().start_stim()
+        if self.texture_cache is not None:
+            self.texture_cache.swap(self, "word1", self.word1)
+            self.texture_cache.swap(self, "word2", self.word2)
 
     def update_stim(self, kwargs):
         match len(self.stim), kwargs:
@@ -87,11 +209,14 @@ class TwoWordStim(pst.StatefulStim):
                     kwargs["word1"] = {}
                 if "word2" not in kwargs:
                     kwargs["word2"] = {}
-                if self.stim["word1"].text != self.word1:
+                if _shown_text(self, "word1") != self.word1:
                     kwargs["word1"]["text"] = self.word1
-                if self.stim["word2"].text != self.word2:
+                if _shown_text(self, "word2") != self.word2:
                     kwargs["word2"]["text"] = self.word2
-        return super().update_stim(kwargs)
+        if self.texture_cache is None:
+            return super().update_stim(kwargs)
+        changed = self.texture_cache.update_text(self, kwargs)
+        return changed + super().update_stim(kwargs)
 
 
 @dataclass
@@ -101,6 +226,7 @@ class OneWordStim(pst.StatefulStim):
     reporting_pix: bool = False
     reporting_pix_size: int = 4
     text_config: Mapping = field(default_factory=TEXT_CONFIG.copy)
+    texture_cache: WordTextureCache | None = None
 
     def __post_init__(self):
         # Set up the stimulus constructors and arguments
@@ -140,6 +266,8 @@ class OneWordStim(pst.StatefulStim):
     def start_stim(self):
         self.stim_kwargs["word1"]["text"] = self.word1
         super().start_stim()
+        if self.texture_cache is not None:
+            self.texture_cache.swap(self, "word1", self.word1)
 
     def update_stim(self, kwargs):
         match len(self.stim), kwargs:
@@ -150,9 +278,12 @@ class OneWordStim(pst.StatefulStim):
             case _, {}:
                 if "word1" not in kwargs:
                     kwargs["word1"] = {}
-                if self.stim["word1"].text != self.word1:
+                if _shown_text(self, "word1") != self.word1:
                     kwargs["word1"]["text"] = self.word1
-        return super().update_stim(kwargs)
+        if self.texture_cache is None:
+            return super().update_stim(kwargs)
+        changed = self.texture_cache.update_text(self, kwargs)
+        return changed + super().update_stim(kwargs)
 
 
 class FixationStim(pst.StatefulStim):
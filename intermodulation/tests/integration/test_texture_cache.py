@@ -0,0 +1,28 @@
+import intermodulation.freqtag_spec as spec
+import intermodulation.stimuli as imst
+from intermodulation.tests.fixtures import window  # noqa: F401
+
+
+def test_texture_cache_swaps_words(window):  # noqa: F811
+    stim = imst.TwoWordStim(
+        win=window,
+        word1="first",
+        word2="second",
+        separation=3.0,
+        text_config=spec.TEXT_CONFIG.copy(),
+    )
+    words = {"word1": ["first", "other", "first"], "word2": ["second", "words"]}
+    cache = imst.WordTextureCache.build(stim, words)
+    stim.texture_cache = cache
+    assert cache.n_textures == 4
+    assert cache.nbytes > 0
+
+    stim.start_stim()
+    assert stim.stim["word1"] is cache.textures[("word1", "first")]
+    stim.word1 = "other"
+    changed = stim.update_stim({})
+    assert changed == [("word1", "text", "other")]
+    assert stim.stim["word1"] is cache.textures[("word1", "other")]
+    assert not cache.textures[("word1", "first")].autoDraw
+    assert stim.update_stim({"word2": {"opacity": 0.0}}) == [("word2", "opacity", 0.0)]
+    stim.stop_stim()
@@ -0,0 +1,277 @@
+import mne
+import numpy as np
+import pytest
+
+import intermodulation.analysis as ima
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+K = 13
+J = 1
+
+
+def convolve_snr(psd, n_neighbor, n_skip):
+    # Reference implementation, as in the MNE SSVEP tutorial
+    kernel = np.concatenate((np.ones(n_neighbor), np.zeros(2 * n_skip + 1), np.ones(n_neighbor)))
+    kernel /= kernel.sum()
+    mean_noise = np.apply_along_axis(
+        lambda psd_: np.convolve(psd_, kernel, mode="valid"), axis=-1, arr=psd
+    )
+    edge = n_neighbor + n_skip
+    pad = [(0, 0)] * (mean_noise.ndim - 1) + [(edge, edge)]
+    return psd / np.pad(mean_noise, pad, constant_values=np.nan)
+
+
+@pytest.fixture
+def psd(rng):  # noqa: F811
+    freqs = np.linspace(0.1, 140, 1200)
+    return 1e-24 / freqs**1.5 * rng.chisquare(2, size=(4, 6, freqs.size))
+
+
+@pytest.mark.parametrize("n_neighbor,n_skip", [(1, 1), (K, J), (3, 0)])
+def test_snr_spectrum_matches_convolution(psd, n_neighbor, n_skip):
+    expected = convolve_snr(psd, n_neighbor, n_skip)
+    snrs = ima.snr_spectrum(psd, n_neighbor, n_skip)
+    assert snrs.shape == psd.shape
+    np.testing.assert_array_equal(np.isnan(snrs), np.isnan(expected))
+    np.testing.assert_allclose(snrs, expected, rtol=1e-8)
+
+
+def test_snr_spectrum_1d(psd):
+    np.testing.assert_allclose(ima.snr_spectrum(psd[0, 0], K, J), convolve_snr(psd[0, 0], K, J))
+
+
+def test_snr_spectrum_float32(psd):
+    snrs = ima.snr_spectrum(psd.astype(np.float32), K, J)
+    assert snrs.dtype == np.float32
+    np.testing.assert_allclose(snrs, convolve_snr(psd, K, J), rtol=1e-5)
+
+
+def test_snr_spectrum_nan_propagation(psd):
+    psd = psd.copy()
+    psd[0, 0, 500] = np.nan
+    expected = convolve_snr(psd, K, J)
+    snrs = ima.snr_spectrum(psd, K, J)
+    np.testing.assert_array_equal(np.isnan(snrs), np.isnan(expected))
+    np.testing.assert_allclose(snrs, expected, rtol=1e-8)
+
+
+def test_snr_at_matches_snr_spectrum(psd):
+    freqs = np.linspace(0.1, 140, psd.shape[-1])
+    targets = [0.15, 6.0, 7.05882353, 13.05882353, 139.9]
+    snrs, bins = ima.snr_at(psd, freqs, targets, K, J)
+    assert snrs.shape == (*psd.shape[:-1], len(targets))
+    np.testing.assert_array_equal(bins, [np.abs(freqs - f).argmin() for f in targets])
+    np.testing.assert_allclose(snrs, ima.snr_spectrum(psd, K, J)[..., bins], rtol=1e-8)
+    assert np.isnan(snrs[..., [0, -1]]).all()
+
+
+@pytest.fixture
+def epochs(rng):  # noqa: F811
+    sfreq, n_times = 200.0, 1000
+    info = mne.create_info(
+        ["MEG0111", "MEG0112", "MEG0113", "STI101"], sfreq, ["mag"] * 3 + ["stim"]
+    )
+    info["bads"] = ["MEG0113"]
+    times = np.arange(n_times) / sfreq - 0.2
+    data = rng.normal(size=(6, 4, n_times)) + np.sin(2 * np.pi * 6.0 * times)
+    events = np.column_stack([np.arange(6) * n_times, np.zeros(6, int), [1, 2, 3, 1, 2, 3]])
+    event_id = {
+        "MINIBLOCK/ONEWORD/WORD/F1": 1,
+        "MINIBLOCK/ONEWORD/NONWORD/F1": 2,
+        "MINIBLOCK/ONEWORD/WORD/F2": 3,
+    }
+    return mne.EpochsArray(data, info, events=events, event_id=event_id, tmin=-0.2, verbose=False)
+
+
+@pytest.mark.parametrize("key", ["MINIBLOCK/ONEWORD/F1", "ONEWORD/WORD/F2", "WORD"])
+@pytest.mark.parametrize("average", [False, True])
+def test_epoch_spectra_matches_compute_psd(epochs, key, average):
+    tmin, tmax = 0.0, 4.0
+    n_fft = int(epochs.info["sfreq"] * (tmax - tmin))
+    psd_kwargs = dict(
+        method="welch", fmin=0.1, fmax=40.0, n_fft=n_fft, n_overlap=0, window="boxcar"
+    )
+    spectra = ima.EpochSpectra.from_epochs(epochs, 0.1, 40.0, tmin, tmax, n_fft=n_fft, n_jobs=1)
+    subset = epochs[key].average() if average else epochs[key]
+    expected, freqs = subset.compute_psd(
+        tmin=tmin, tmax=tmax, exclude="bads", verbose="error", **psd_kwargs
+    ).get_data(return_freqs=True)
+    assert spectra.ch_names == ["MEG0111", "MEG0112"]
+    np.testing.assert_allclose(spectra.freqs, freqs)
+    np.testing.assert_allclose(spectra.psd(key, average=average), expected, rtol=1e-10)
+    np.testing.assert_allclose(spectra[key].psd(average=average), expected, rtol=1e-10)
+
+
+def test_epoch_spectra_itc(epochs):
+    spectra = ima.EpochSpectra.from_epochs(epochs, 0.1, 40.0, 0.0, 4.0, n_jobs=1)
+    itc = spectra.itc("F1")
+    assert itc.shape == (2, len(spectra.freqs))
+    assert itc[:, np.abs(spectra.freqs - 6.0).argmin()].min() > 0.9
+    with pytest.raises(KeyError):
+        spectra.select("TWOWORD")
+
+
+def test_pick_ch_names(epochs):
+    assert ima.pick_ch_names(epochs.info) == ["MEG0111", "MEG0112"]
+    assert ima.pick_ch_names(epochs.info, "data", exclude=()) == ["MEG0111", "MEG0112", "MEG0113"]
+    assert ima.pick_ch_names(epochs.info, ["MEG0113", "STI101"]) == ["MEG0113", "STI101"]
+    assert ima.pick_ch_names(epochs.info, "eeg", allow_empty=True) == []
+    with pytest.raises(ValueError):
+        ima.pick_ch_names(epochs.info, "eeg")
+
+
+def compute_psd_itc(epochs, fmin, fmax, tmin, tmax, n_ministim):
+    # The complex Welch spectra previously used by `analysis.itc_epochs`
+    psd = epochs.compute_psd(
+        picks="meg",
+        method="welch",
+        n_fft=int(epochs.info["sfreq"] * (tmax - tmin)),
+        n_overlap=0,
+        n_per_seg=int(epochs.info["sfreq"] * (tmax - tmin) / n_ministim),
+        tmin=tmin,
+        tmax=tmax,
+        fmin=fmin,
+        fmax=fmax,
+        window="boxcar",
+        output="complex",
+        n_jobs=1,
+        verbose="error",
+    )
+    psds, freqs = psd.get_data(return_freqs=True)
+    return np.abs(np.mean(np.exp(1j * np.angle(psds)), axis=0)), freqs
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 16])
+def test_itc_epochs_matches_compute_psd(epochs, chunk_size):
+    expected, freqs = compute_psd_itc(epochs, 0.1, 40.0, 0.0, 4.0, 10)
+    itc, n_epochs = ima.itc_epochs(epochs, 0.1, 40.0, 0.0, 4.0, n_jobs=1, chunk_size=chunk_size)
+    assert n_epochs == len(epochs)
+    assert itc.index.tolist() == ["MEG0111", "MEG0112"]
+    np.testing.assert_allclose(itc.columns, freqs)
+    np.testing.assert_allclose(itc.to_numpy(), expected, rtol=1e-8)
+
+
+def test_running_itc_matches_batch(rng):  # noqa: F811
+    coefs = rng.normal(size=(10, 3, 5)) + 1j * rng.normal(size=(10, 3, 5))
+    coefs[0, 0, 0] = 0
+    with np.errstate(invalid="ignore"):
+        phasors = np.where(coefs == 0, 0, coefs / np.abs(coefs))
+    running = ima.RunningITC()
+    for chunk in np.array_split(coefs.copy(), 3):
+        running.update(chunk)
+    assert running.count == 10
+    np.testing.assert_allclose(running.itc, np.abs(phasors.sum(axis=0)) / 10)
+
+
+def test_running_mean_matches_batch(psd):
+    running = ima.RunningMean()
+    for subpsd in psd:
+        running.update(subpsd)
+    assert running.count == len(psd)
+    np.testing.assert_allclose(running.mean, psd.mean(axis=0))
+    np.testing.assert_allclose(running.var, psd.var(axis=0, ddof=1))
+    np.testing.assert_allclose(running.sem, np.sqrt(running.var / len(psd)))
+    single = ima.RunningMean()
+    single.update(psd[0])
+    assert np.isnan(single.sem).all()
+
+
+@pytest.fixture(scope="module")
+def eeg_inverse():
+    gen = np.random.default_rng(42)
+    montage = mne.channels.make_standard_montage("standard_1020")
+    info = mne.create_info(montage.ch_names[:32], 200.0, "eeg")
+    info.set_montage(montage)
+    sphere = mne.make_sphere_model((0.0, 0.0, 0.04), 0.09, info, verbose=False)
+    pos = dict(
+        rr=gen.uniform(-0.04, 0.04, (20, 3)) + [0, 0, 0.04], nn=np.tile([0, 0, 1.0], (20, 1))
+    )
+    src = mne.setup_volume_source_space(pos=pos, sphere=sphere, verbose=False)
+    fwd = mne.make_forward_solution(info, None, src, sphere, verbose=False)
+    epochs = mne.EpochsArray(gen.normal(size=(5, 32, 400)) * 1e-6, info, tmin=-0.2, verbose=False)
+    epochs.set_eeg_reference(projection=True, verbose=False)
+    cov = mne.make_ad_hoc_cov(info, verbose=False)
+    inv = mne.minimum_norm.make_inverse_operator(epochs.info, fwd, cov, loose=1.0, verbose=False)
+    return epochs, inv
+
+
+@pytest.mark.parametrize("method", ["MNE", "dSPM", "sLORETA"])
+def test_inverse_kernel_matches_apply_inverse(eeg_inverse, method):
+    epochs, inv = eeg_inverse
+    spectra = ima.EpochSpectra.from_epochs(epochs, fmin=1.0, fmax=90.0, n_fft=300)
+    kernel = ima.InverseKernel.from_inverse(inv, lambda2=1 / 9.0, method=method)
+    # Free orientations: the kernel gives the summed power of the vector source estimate
+    for evoked, psd in (
+        (epochs.average(), kernel.psd(spectra)),
+        (epochs[2].average(), kernel.psd(spectra, average=False)[2]),
+    ):
+        stc = mne.minimum_norm.apply_inverse(
+            evoked, inv, 1 / 9.0, method, pick_ori="vector", verbose=False
+        )
+        expected, freqs = mne.time_frequency.psd_array_welch(
+            stc.data, 200.0, fmin=1.0, fmax=90.0, n_fft=300, window="boxcar", verbose=False
+        )
+        np.testing.assert_allclose(spectra.freqs, freqs)
+        np.testing.assert_allclose(psd, expected.sum(axis=1), rtol=1e-10)
+
+
+def loop_miniblock_events(raw, offset=0):
+    # The loop previously in `analysis.miniblock_events`
+    oldannot = raw.annotations.copy()
+    events = list(mne.events_from_annotations(raw, verbose=False))
+    events[1] = {k.replace("_", "/"): v for k, v in events[1].items()}
+    newev = []
+    for k in list(events[1].keys()):
+        if k in ima.MINIBLOCK_CONDS:
+            events[1]["MINIBLOCK/" + k] = events[1][k] + 100
+    revlut = {v: k for k, v in events[1].items()}
+    for i in range(len(events[0])):
+        currev = events[0][i]
+        if revlut[currev[2]] not in ima.MINIBLOCK_CONDS:
+            newev.append(currev.reshape(-1, 1))
+            continue
+        if not events[0][i - 1, 2] == currev[2]:
+            miniblock = currev.copy()
+            miniblock[-1] += 100
+            miniblock[0] += offset - 1
+            newev.append(miniblock.reshape(-1, 1))
+        currev[0] += offset
+        newev.append(currev.reshape(-1, 1))
+    newev = np.concat(newev, axis=-1).T
+    annot = mne.annotations_from_events(
+        events=newev, event_desc=revlut, sfreq=raw.info["sfreq"], first_samp=raw.first_samp
+    )
+    for i in oldannot:
+        if i["description"].find("BAD") != -1:
+            annot.append(
+                onset=i["onset"] - raw.first_samp / raw.info["sfreq"],
+                duration=i["duration"],
+                description=i["description"],
+            )
+    raw.set_annotations(annot)
+    return newev
+
+
+@pytest.mark.parametrize("offset", [0, 25])
+def test_miniblock_events_matches_loop(rng, offset):  # noqa: F811
+    sfreq = 500.0
+    info = mne.create_info(["MEG0111", "STI101"], sfreq, ["mag", "stim"])
+    raw = mne.io.RawArray(np.zeros((2, 200_000)), info, first_samp=1234, verbose=False)
+    descs = []
+    for _ in range(30):
+        descs += ["FIXATION"] + [rng.choice(ima.MINIBLOCK_CONDS).replace("/", "_")] * 8 + ["ITI"]
+    onsets = raw.first_samp / sfreq + np.arange(len(descs)) * 1.2
+    annot = mne.Annotations(onsets, 0.0, descs)
+    annot.append(onsets[::40] + 0.3, 2.0, ["BAD_muscle"] * len(onsets[::40]))
+    raw.set_annotations(annot)
+    expected_raw = raw.copy()
+    expected = loop_miniblock_events(expected_raw, offset)
+
+    newev, event_id = ima.miniblock_events(raw, offset)
+    np.testing.assert_array_equal(newev, expected)
+    assert sum(k.startswith("MINIBLOCK") for k in event_id) == len(set(descs)) - 2
+    assert set(event_id.values()) == set(np.unique(newev[:, 2]))
+    for field in ("onset", "duration", "description"):
+        np.testing.assert_array_equal(
+            getattr(raw.annotations, field), getattr(expected_raw.annotations, field)
+        )
@@ -0,0 +1,178 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from intermodulation.design import (
+    assign_miniblock_freqs,
+    constrained_order,
+    count_orderings,
+    design_arrays,
+    load_design,
+    prep_words,
+    save_designs,
+    split_blocks,
+    stimulus_paths,
+    validate_design,
+)
+from intermodulation.freqtag_spec import STIMPATH
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+
+def max_run_length(seq):
+    return max(len(list(run)) for _, run in itertools.groupby(seq))
+
+
+def valid_sequences(labels, max_run):
+    # All distinct label sequences with no run longer than `max_run`, by brute force
+    return {seq for seq in itertools.permutations(labels) if max_run_length(seq) <= max_run}
+
+
+@pytest.mark.parametrize("counts", [(2, 2, 1), (3, 2), (4, 4), (3, 1, 1, 2)])
+def test_count_orderings(counts):
+    labels = np.repeat(np.arange(len(counts)), counts)
+    ways = count_orderings(np.array(counts), max_run=2)
+    assert ways[(*counts, len(counts), 0)] == len(valid_sequences(labels, 2))
+
+
+def test_constrained_order_is_uniform(rng):  # noqa: F811
+    labels = np.array(["a", "a", "a", "b", "b", "c"])
+    valid = sorted(valid_sequences(labels, 2))
+    n_draws = 6000
+    draws = [tuple(labels[constrained_order(labels, rng)]) for _ in range(n_draws)]
+    assert set(draws) == set(valid)
+    freqs = np.array([draws.count(seq) for seq in valid]) / n_draws
+    np.testing.assert_allclose(freqs, 1 / len(valid), atol=0.025)
+
+
+def test_constrained_order_infeasible(rng):  # noqa: F811
+    with pytest.raises(ValueError, match="at most 2 times in a row"):
+        constrained_order(np.array([0, 0, 0, 0, 0, 1]), rng)
+    # The tightest feasible case: a a b a a b a a
+    order = constrained_order(np.array([0] * 6 + [1] * 2), rng)
+    assert np.sort(order).tolist() == list(range(8))
+    assert max_run_length(np.array([0] * 6 + [1] * 2)[order]) == 2
+
+
+def test_split_blocks(rng):  # noqa: F811
+    # The two-word design: condition x invertible groups, 5 words per miniblock, 3 blocks
+    conditions = np.repeat(["non-phrase", "non-phrase", "non-word", "phrase"], [90, 90, 180, 180])
+    groups = np.repeat(np.arange(4), [90, 90, 180, 180])
+    rows = split_blocks(groups, conditions, 5, 3, rng)
+    assert len(rows) == 540 and len(np.unique(rows)) == 540
+
+    miniblocks = rows.reshape(-1, 5)
+    assert all(len(np.unique(groups[mini])) == 1 for mini in miniblocks)
+    for block in np.split(miniblocks, 3):
+        conds = conditions[block[:, 0]]
+        assert max_run_length(conds) <= 2
+        assert np.unique(conds, return_counts=True)[1].tolist() == [12, 12, 12]
+
+    again = split_blocks(groups, conditions, 5, 3, np.random.default_rng(0))
+    np.testing.assert_array_equal(
+        again, split_blocks(groups, conditions, 5, 3, np.random.default_rng(0))
+    )
+
+
+@pytest.fixture
+def stimuli():
+    path_1w, path_2w = stimulus_paths(STIMPATH, "even")
+    return pd.read_csv(path_1w, index_col=0), pd.read_csv(path_2w, index_col=0)
+
+
+def test_design_file_round_trip(tmp_path, stimuli):
+    onewords, twowords = stimuli
+    designs = {}
+    for seed in (3, 11):
+        arrays, problems = design_arrays(onewords, twowords, np.random.default_rng(seed), 10, 3)
+        assert problems == []
+        designs[(seed, "even")] = arrays
+    save_designs(tmp_path / "designs.npz", designs, miniblock_len=10, N_blocks=3, stimpath=STIMPATH)
+
+    freqs = (6.0, 7.5)
+    loaded = load_design(tmp_path / "designs.npz", 11, "even", STIMPATH, 10, 3, freqs)
+    prepared = prep_words(onewords, twowords, np.random.default_rng(11), 10, 3, freqs)
+    # The same words, miniblocks and tags, without the index columns added while preparing
+    for load_df, prep_df in zip(loaded, prepared):
+        columns = prep_df.columns.intersection(load_df.columns)
+        pd.testing.assert_frame_equal(
+            load_df[columns].reset_index(drop=True), prep_df[columns].reset_index(drop=True)
+        )
+    assert validate_design(*loaded, 10, 3, freqs) == []
+
+    with pytest.raises(KeyError, match="No design for seed 4"):
+        load_design(tmp_path / "designs.npz", 4, "even", STIMPATH, 10, 3, freqs)
+    with pytest.raises(ValueError, match="miniblocks of 10 words"):
+        load_design(tmp_path / "designs.npz", 11, "even", STIMPATH, 12, 3, freqs)
+
+    # Designs index rows of the stimulus lists, so an edited list is refused
+    stimpath = tmp_path / "stimuli"
+    stimpath.mkdir()
+    for stimfile, df in zip(stimulus_paths(stimpath, "even"), (onewords, twowords.iloc[::-1])):
+        df.to_csv(stimfile)
+    with pytest.raises(ValueError, match="new_even_two_word_stimuli.csv differs"):
+        load_design(tmp_path / "designs.npz", 11, "even", stimpath, 10, 3, freqs)
+
+
+def test_validate_design(stimuli):
+    freqs = (6.0, 7.5)
+    onewords, twowords, allwords = prep_words(*stimuli, np.random.default_rng(5), 10, 3, freqs)
+    twowords = twowords.reset_index(drop=True)
+    assert validate_design(onewords, twowords, allwords, 10, 3, freqs) == []
+
+    def problems(**changes):
+        broken = twowords.copy()
+        for col, (mask, value) in changes.items():
+            broken.loc[mask(broken), col] = value
+        return validate_design(onewords, broken, allwords, 10, 3, freqs)
+
+    first = lambda df: df.index < 3  # noqa: E731
+    assert "twoword: miniblocks mix conditions or tag frequencies" in problems(
+        condition=(first, "other")
+    )
+    assert "twoword: words tagged at the same frequency" in problems(
+        w2_freq=(lambda df: df["miniblock"] == 0, freqs[0]), w1_freq=(first, freqs[0])
+    )
+    phrase = lambda df: df["condition"] == "phrase"  # noqa: E731
+    assert "twoword: F1/F2 tags unbalanced within a condition" in problems(
+        w1_freq=(phrase, freqs[0]), w2_freq=(phrase, freqs[1])
+    )
+    assert "twoword: block 0 repeats a condition 18 times" in problems(
+        condition=(lambda df: df.index >= 0, "phrase")
+    )
+    words_only = allwords[allwords["cond"] == "word"]
+    assert "twoword: no query candidates after miniblock" in " ".join(
+        validate_design(onewords, twowords, words_only, 10, 3, freqs)
+    )
+
+
+def test_assign_miniblock_freqs(rng):  # noqa: F811
+    # Miniblocks of 3 rows with their rows interleaved, 5 phrase and 4 non-word miniblocks
+    mini_conds = np.array(["phrase"] * 5 + ["non-word"] * 4)
+    miniblock = rng.permutation(np.repeat(np.arange(9), 3))
+    df = pd.DataFrame({
+        "miniblock": miniblock,
+        "condition": mini_conds[miniblock],
+        "w1": "a",
+        "w2": "b",
+    })
+    freqs = (6.0, 7.5)
+    out = assign_miniblock_freqs(df, freqs, np.random.default_rng(1))
+    assert out.groupby("miniblock")["w1_freq"].nunique().eq(1).all()
+    assert (out["w1_freq"] != out["w2_freq"]).all()
+    mini_freqs = out.groupby("miniblock")["w1_freq"].first()
+    assert (mini_freqs[:5] == freqs[1]).sum() == 3  # The extra miniblock gets F2
+    assert (mini_freqs[5:] == freqs[1]).sum() == 2
+
+    # The i-th tag of each condition's permutation, drawn in sorted condition order, tags the
+    # condition's i-th miniblock
+    check_rng = np.random.default_rng(1)
+    nonword_tags = check_rng.permutation([0.0, 0.0, 1.0, 1.0])
+    phrase_tags = check_rng.permutation([0.0, 0.0, 1.0, 1.0, 1.0])
+    expected = np.array(freqs)[np.concatenate([phrase_tags, nonword_tags]).astype(int)]
+    np.testing.assert_array_equal(mini_freqs.to_numpy(), expected)
+
+    df.loc[df["miniblock"] == 0, "condition"] = ["phrase", "non-word", "phrase"]
+    with pytest.raises(ValueError, match="single condition"):
+        assign_miniblock_freqs(df, freqs, rng)
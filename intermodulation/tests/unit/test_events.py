@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intermodulation.events import stepfix_events, trigger_event_table
+from intermodulation.freqtag_spec import LUT_TRIGGERS, TRIGGERS
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+SFREQ = 2000.0
+FIRST_SAMP = 12345
+LAST_TIME = 4000.0
+CONDITIONS = ("ONEWORD", "TWOWORD")
+
+
+def loop_event_table(evdf, lut_triggers, miniblock_events, ev_offset=0):
+    # The loop previously in scripts/analysis/01_miniblock_events.py
+    evdf["label1"] = evdf["v1"].map(lut_triggers)
+    evdf["label2"] = evdf["v2"].map(lut_triggers)
+    evdf["last"] = np.roll(evdf["label2"].values, 1)
+
+    records = []
+    offset = FIRST_SAMP / SFREQ
+    newevs = []
+    miniblock_onset = None
+    miniblock_sample = None
+    for row in evdf.itertuples():
+        if row.label2 in ("STATEEND", "TRIALEND", "BLOCKEND"):
+            continue
+        try:
+            end = evdf.at[row.Index + 1, "sample"] / SFREQ + offset
+        except KeyError:
+            end = LAST_TIME
+        onset = row.sample / SFREQ + offset
+        if miniblock_events and row.label2.split("/")[0] in CONDITIONS:
+            if row.last == "FIXATION":
+                miniblock_onset = onset
+                miniblock_sample = row.sample
+            elif row.last == row.label2 and evdf.at[row.Index + 1, "label2"] != row.label2:
+                if miniblock_sample is None:
+                    raise ValueError("MINIBLOCK start not found!")
+                records.append({
+                    "onset": miniblock_onset,
+                    "duration": onset - miniblock_onset,
+                    "trial_type": "MINIBLOCK/" + row.label2,
+                    "value": 100 + row.v2,
+                    "sample": miniblock_sample,
+                    "channel": "STI102",
+                })
+                newevs.append(
+                    np.array([miniblock_sample + ev_offset, 0, 100 + row.v2]).reshape(1, 3)
+                )
+                miniblock_onset = None
+                miniblock_sample = None
+
+        records.append({
+            "onset": onset,
+            "duration": end - onset,
+            "trial_type": row.label2,
+            "value": row.v2,
+            "sample": row.sample,
+            "channel": "STI102",
+        })
+        newevs.append(np.array([row.sample + ev_offset, 0, row.v2]).reshape(1, 3))
+    return pd.DataFrame.from_records(records), np.concatenate(newevs, axis=0)
+
+
+def loop_stepfix(evdf):
+    for i in evdf.index:
+        if evdf.at[i, "v1"] != 0:
+            evdf.at[i - 1, "v2"] = evdf.at[i, "v2"]
+    return evdf[evdf["v1"] == 0].copy().reset_index()
+
+
+@pytest.fixture
+def events(rng):  # noqa: F811
+    # Blocks of miniblock trials as sent by the experiment: fixation, repeated word triggers for
+    # one condition, then the ITI, with STATEEND/TRIALEND/BLOCKEND pulses in between
+    words = [TRIGGERS.ONEWORD.WORD.F1, TRIGGERS.ONEWORD.NONWORD.F2]
+    words += [TRIGGERS.TWOWORD.PHRASE.F1LEFT, TRIGGERS.TWOWORD.NONWORD.F1RIGHT]
+    values = []
+    for _ in range(3):
+        for _ in range(8):
+            values += [TRIGGERS.FIXATION]
+            values += [rng.choice(words)] * rng.integers(2, 20)
+            values += [TRIGGERS.STATEEND, TRIGGERS.ITI, TRIGGERS.STATEEND, TRIGGERS.TRIALEND]
+        values += [TRIGGERS.BLOCKEND, TRIGGERS.BREAK]
+    samples = np.cumsum(rng.integers(50, 2000, size=len(values)))
+    return np.column_stack((samples, np.zeros(len(values), int), values))
+
+
+@pytest.fixture
+def lut_triggers():
+    lut = {k: "/".join(v) for k, v in LUT_TRIGGERS.items()}
+    for k, v in list(lut.items()):
+        if v.split("/")[0] in CONDITIONS:
+            lut[k + 100] = "MINIBLOCK/" + v
+    return lut
+
+
+@pytest.mark.parametrize("miniblock_events", [False, True])
+def test_event_table_matches_loop(events, lut_triggers, miniblock_events):
+    expected, expected_evs = loop_event_table(
+        pd.DataFrame(events, columns=["sample", "v1", "v2"]), lut_triggers, miniblock_events, 3
+    )
+    table, newevs = trigger_event_table(
+        events,
+        lut_triggers,
+        SFREQ,
+        FIRST_SAMP,
+        LAST_TIME,
+        "STI102",
+        CONDITIONS if miniblock_events else None,
+        ev_offset=3,
+    )
+    assert (table["trial_type"].str.startswith("MINIBLOCK")).sum() == (
+        24 if miniblock_events else 0
+    )
+    pd.testing.assert_frame_equal(table, expected, check_dtype=False)
+    np.testing.assert_array_equal(newevs, expected_evs)
+
+
+def test_event_table_missing_start(events, lut_triggers):
+    events = events[events[:, 2] != TRIGGERS.FIXATION]
+    with pytest.raises(ValueError, match="MINIBLOCK start"):
+        trigger_event_table(
+            events, lut_triggers, SFREQ, FIRST_SAMP, LAST_TIME, "STI102", CONDITIONS
+        )
+
+
+def test_stepfix_matches_loop(events, rng):  # noqa: F811
+    events = events.copy()
+    steps = rng.choice(np.arange(1, len(events)), size=20, replace=False)
+    events[steps, 1] = events[steps - 1, 2]
+    expected = loop_stepfix(pd.DataFrame(events, columns=["sample", "v1", "v2"]))
+    np.testing.assert_array_equal(
+        stepfix_events(events), expected[["sample", "v1", "v2"]].to_numpy()
+    )
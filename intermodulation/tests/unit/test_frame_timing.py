@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intermodulation.frame_timing import FrameTimer, save_timing_summaries
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+FRAMERATE = 240.0
+
+
+@pytest.fixture
+def flips(rng):  # noqa: F811
+    # Flip times with jitter, and a late flip missing one frame and one missing three frames
+    frames = np.arange(1000.0)
+    frames[400:] += 1
+    frames[700:] += 3
+    return 10.0 + frames / FRAMERATE + rng.normal(scale=1e-5, size=len(frames))
+
+
+def test_frame_timer_counts(flips):
+    timer = FrameTimer(FRAMERATE)
+    late = []
+    for t in flips:
+        timer.record(t)
+        late.append(timer.late)
+    assert np.flatnonzero(late).tolist() == [400, 700]
+    assert (timer.n_flips, timer.n_late, timer.n_dropped) == (1000, 2, 4)
+
+    summary = timer.summary()
+    assert summary["t_first"] == flips[0]
+    assert summary["max_interval"] == pytest.approx(4 / FRAMERATE, abs=1e-4)
+    assert summary["effective_framerate"] == pytest.approx(999 / 1003 * FRAMERATE, rel=1e-4)
+    assert summary["framerate_ratio"] == pytest.approx(999 / 1003, rel=1e-4)
+
+    timer.reset()
+    timer.record(flips[0])
+    assert (timer.n_flips, timer.n_late, timer.n_dropped) == (1, 0, 0)
+
+
+def test_frame_timer_ring_buffer(flips):
+    timer = FrameTimer(FRAMERATE, capacity=512)
+    for t in flips:
+        timer.record(t)
+    np.testing.assert_array_equal(timer.flip_times(), flips[-512:])
+    assert timer.late_flips.sum() == 1  # The flip at 700, the one at 400 was overwritten
+    summary = timer.summary()
+    assert summary["n_late"] == 2
+    assert summary["mean_interval"] == pytest.approx(np.diff(flips[-512:]).mean())
+
+
+def test_save_timing_summaries(tmp_path, flips):
+    timer = FrameTimer(FRAMERATE)
+    summaries = []
+    for run, chunk in enumerate(np.split(flips, [400, 700])):
+        timer.reset()
+        for t in chunk:
+            timer.record(t)
+        summaries.append({"run": run, **timer.summary()})
+    save_timing_summaries(summaries, tmp_path / "timing.csv")
+    saved = pd.read_csv(tmp_path / "timing.csv")
+    assert saved["n_flips"].tolist() == [400, 300, 300]
+    assert saved["n_late"].sum() == 0
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+import intermodulation.imfreqs as imf
+
+
+def test_im_combinations_second_order():
+    f1, f2 = 6.0, 7.05882353
+    terms = list(imf.im_combinations((f1, f2), max_order=2))
+    assert [(n, m) for n, m, _ in terms] == [(1, 0), (0, 1), (-1, 1), (2, 0), (1, 1), (0, 2)]
+    np.testing.assert_allclose(
+        [f for *_, f in terms], [f1, f2, f2 - f1, 2 * f1, f1 + f2, 2 * f2]
+    )
+
+
+def test_im_frequencies_bounds():
+    freqs = imf.im_frequencies((6.0, 7.05882353), max_order=5, fmin=1.0, fmax=20.0)
+    assert freqs.min() >= 1.0 and freqs.max() <= 20.0
+    assert len(np.unique(np.round(freqs, 8))) == len(freqs)
+
+
+def test_im_catalogue_bins():
+    sfreq = 500.0
+    n_fft = int(sfreq * 28.333333333333333)
+    spectrum = np.fft.rfftfreq(n_fft, 1 / sfreq)
+    mask = (spectrum >= 0.1) & (spectrum <= 140.0)
+    cat = imf.im_catalogue(sfreq, n_fft, fmin=0.1, fmax=140.0)
+    assert list(cat.index) == ["f1", "f2", "f2-f1", "2f1", "f1+f2", "2f2"]
+    expected = [np.abs(spectrum[mask] - f).argmin() for f in cat["freq"]]
+    np.testing.assert_array_equal(cat["idx"], expected)
+    np.testing.assert_allclose(cat["bin_freq"], spectrum[mask][cat["idx"]])
+    assert (cat["bin_frac"].abs() <= 0.5).all()
+    pd.testing.assert_frame_equal(cat, imf.im_catalogue_from_freqs(spectrum[mask]))
+
+
+def test_im_catalogue_offset():
+    freqs = np.arange(3, 3964) / 28.333333333333333
+    cat = imf.im_catalogue_from_freqs(freqs)
+    shifted = imf.im_catalogue_from_freqs(freqs, bin_offset=-1)
+    np.testing.assert_array_equal(shifted["idx"], cat["idx"] - 1)
+    corrected = imf.im_catalogue_from_freqs(freqs, samprate_correction=1000 / 1000.49)
+    assert (corrected["bin"] <= cat["bin"]).all()
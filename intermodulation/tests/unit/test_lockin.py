@@ -0,0 +1,151 @@
+import mne
+import numpy as np
+import pytest
+
+import intermodulation.analysis as ima
+from intermodulation.imfreqs import im_frequencies
+from intermodulation.lockin import LockIn, sliding_snr_itc, sliding_tfr
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+SFREQ = 200.0
+FREQS = (6.0, 7.5)
+K, J = 3, 1
+
+
+@pytest.fixture
+def epochs(rng):  # noqa: F811
+    info = mne.create_info(
+        ["MEG0111", "MEG0112", "MEG0113", "STI101"], SFREQ, ["mag"] * 3 + ["stim"]
+    )
+    info["bads"] = ["MEG0113"]
+    times = np.arange(1000) / SFREQ - 0.2
+    data = rng.normal(size=(6, 4, len(times)))
+    data += np.sin(2 * np.pi * FREQS[0] * times) + 0.5 * np.sin(2 * np.pi * FREQS[1] * times)
+    events = np.column_stack([np.arange(6) * 1000, np.zeros(6, int), [1, 2, 1, 2, 1, 2]])
+    event_id = {"MINIBLOCK/ONEWORD/WORD/F1": 1, "MINIBLOCK/ONEWORD/NONWORD/F1": 2}
+    return mne.EpochsArray(data, info, events=events, event_id=event_id, tmin=-0.2, verbose=False)
+
+
+@pytest.mark.parametrize("n_fft", [800, 700])
+def test_lockin_matches_full_spectrum(epochs, n_fft):
+    fmin, fmax = 0.5, 40.0
+    targets = np.concatenate(([0.6], im_frequencies(FREQS, max_order=3, fmax=fmax)))
+    spectra = ima.EpochSpectra.from_epochs(epochs, fmin, fmax, 0.0, 4.0, n_fft=n_fft, n_jobs=1)
+    lockin = LockIn.design(SFREQ, n_fft, targets, K, J, fmin=fmin, fmax=fmax)
+    binned = lockin.epoch_spectra(epochs, 0.0, 4.0, chunk_size=4)
+    assert binned.ch_names == spectra.ch_names
+    assert len(lockin.bins) <= len(targets) * (2 * K + 1)
+
+    cols = np.searchsorted(spectra.freqs, lockin.freqs)
+    np.testing.assert_allclose(spectra.freqs[cols], lockin.freqs)
+    np.testing.assert_allclose(binned.coefs, spectra.coefs[..., cols], rtol=1e-8, atol=1e-12)
+
+    for key, average in (("F1", False), ("WORD", True)):
+        expected, bins = ima.snr_at(spectra.psd(key, average), spectra.freqs, targets, K, J)
+        np.testing.assert_array_equal(spectra.freqs[bins], lockin.target_freqs)
+        snrs = lockin.snr(binned.psd(key, average))
+        np.testing.assert_array_equal(np.isnan(snrs), np.isnan(expected))
+        np.testing.assert_allclose(snrs, expected, rtol=1e-8)
+    assert np.isnan(snrs[..., 0]).all()  # Noise neighbours of 0.6 Hz fall below fmin
+    np.testing.assert_allclose(lockin.itc(binned.coefs), spectra.itc()[:, bins], rtol=1e-8)
+
+
+def test_lockin_arrays_and_stcs(epochs):
+    data = epochs.get_data(picks="mag", tmin=0.0, tmax=4.0)
+    lockin = LockIn.design(SFREQ, 800, FREQS, K, J)
+    coefs = lockin.transform(data)
+    assert coefs.shape == (6, 2, len(lockin.bins))
+    snrs = lockin.snr(lockin.psd(coefs, average=True))
+    assert (snrs > 10).all()  # Both tags are exactly on-bin and phase locked
+
+    vertices = [np.arange(2), np.array([], int)]
+    stcs = [mne.SourceEstimate(epoch, vertices, 0.0, 1 / SFREQ) for epoch in data]
+    np.testing.assert_allclose(lockin.transform_stc(stcs), coefs)
+    np.testing.assert_allclose(lockin.transform_stc(stcs[0]), coefs[0])
+
+
+@pytest.mark.parametrize("average", [False, True])
+def test_sliding_snr_itc_matches_cropped_epochs(epochs, average):
+    fmin, fmax = 0.5, 40.0
+    targets = im_frequencies(FREQS, max_order=2, fmax=fmax)
+    out = sliding_snr_itc(
+        epochs,
+        targets,
+        2.0,
+        0.35,
+        0.0,
+        4.5,
+        K,
+        J,
+        fmin,
+        fmax,
+        average,
+        chunk_size=4,
+        chunk_elems=5000,
+        n_jobs=1,
+    )
+    n_windows = len(out["times"])
+    assert out["snrs"].shape == out["itcs"].shape == (2, len(targets), n_windows)
+    assert int(out["nave"]) == 6 and list(out["ch_names"]) == ["MEG0111", "MEG0112"]
+
+    data = epochs.get_data(picks="mag")
+    for i, centre in enumerate(out["times"]):
+        # Each window cut by sample, as an epochs array of its own
+        start = int(round((centre - 399 / (2 * SFREQ) - epochs.tmin) * SFREQ))
+        window = mne.EpochsArray(
+            data[..., start : start + 400], mne.pick_info(epochs.info, [0, 1]), verbose=False
+        )
+        spectra = ima.EpochSpectra.from_epochs(window, fmin, fmax, n_jobs=1)
+        psd = spectra.psd(None, average) if average else spectra.psd().mean(axis=0)
+        expected, bins = ima.snr_at(psd, spectra.freqs, targets, K, J)
+        np.testing.assert_allclose(spectra.freqs[bins], out["freqs"])
+        np.testing.assert_allclose(out["snrs"][..., i], expected, rtol=1e-8)
+        np.testing.assert_allclose(out["itcs"][..., i], spectra.itc()[:, bins], rtol=1e-8)
+        np.testing.assert_allclose(out["psds"][..., i], psd[:, bins], rtol=1e-8)
+
+    tfr = sliding_tfr(epochs.info, out, "snrs")
+    assert tfr.ch_names == ["MEG0111", "MEG0112"]
+    np.testing.assert_array_equal(tfr.data, out["snrs"])
+    with pytest.raises(ValueError, match="No window"):
+        sliding_snr_itc(epochs, targets, 5.0, 0.5, 0.0, 4.5)
+
+
+def test_sliding_snr_itc_last_window(epochs):
+    # get_data excludes tmax, so the 800 samples read hold 601 windows at a one-sample step
+    out = sliding_snr_itc(epochs, FREQS, 1.0, 0.005, 0.0, 4.0, n_jobs=1)
+    assert len(out["times"]) == 601
+    np.testing.assert_allclose(
+        out["times"][[0, -1]], [199 / (2 * SFREQ), 3.995 - 199 / (2 * SFREQ)]
+    )
+    assert np.isfinite(out["snrs"]).all()
+
+
+def test_word_spectra(epochs):
+    # Miniblock triggers are those of their words plus 100
+    epochs = epochs.copy()
+    epochs.event_id = {k: v + 100 for k, v in epochs.event_id.items()}
+    epochs.events[:, 2] += 100
+    word_dur, n_words = 0.8333, 5
+    lockin = LockIn.design(SFREQ, int(word_dur * SFREQ), FREQS, K, J)
+    spectra = lockin.word_spectra(epochs, word_dur, n_words, chunk_size=4)
+    assert spectra.coefs.shape == (6 * n_words, 2, len(lockin.bins))
+    assert spectra.event_id == {"ONEWORD/WORD/F1": 1, "ONEWORD/NONWORD/F1": 2}
+    assert len(spectra["NONWORD"]) == 3 * n_words
+
+    # Words start on the sample nearest to each multiple of the word duration from time 0
+    data = epochs.get_data(picks="mag")
+    for w, start in enumerate((40, 207, 373, 540, 707)):
+        expected = lockin.transform(data[..., start : start + lockin.n_fft])
+        np.testing.assert_allclose(spectra.coefs[w::n_words], expected)
+
+    out = lockin.word_snr_itc(spectra, n_words, "WORD")
+    coefs = spectra["WORD"].coefs.reshape(3, n_words, 2, -1)
+    np.testing.assert_allclose(out["snrs"], lockin.snr(lockin.psd(coefs).mean(axis=0)))
+    np.testing.assert_allclose(out["itcs"], lockin.itc(coefs))
+    assert out["snrs"].shape == out["psds"].shape == (n_words, 2, len(FREQS))
+    evoked = lockin.word_snr_itc(spectra, n_words, "NONWORD", average=True)
+    coefs = spectra["NONWORD"].coefs.reshape(3, n_words, 2, -1)
+    np.testing.assert_allclose(evoked["snrs"], lockin.snr(lockin.psd(coefs, average=True)))
+
+    with pytest.raises(ValueError, match="do not fit"):
+        lockin.word_spectra(epochs, word_dur, 6)
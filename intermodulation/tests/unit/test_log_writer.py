@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+import pandas as pd
+import pytest
+
+from intermodulation.log_writer import AsyncLogWriter, drain_log, read_states_log
+
+
+@pytest.fixture
+def logs():
+    # The dicts of an ExperimentLog after five states, with updates logged in the word states
+    states = defaultdict(dict)
+    continuous = defaultdict(lambda: defaultdict(list))
+    for sn in range(5):
+        states[sn].update(state_number=sn, state="words" if sn % 2 else "iti", state_start=sn * 2.5)
+        if sn % 2:
+            for frame in range(3):
+                continuous[sn]["state_update"].append([("word1", "opacity", frame % 2, frame)])
+                continuous[sn]["state_update_tag"].append(None)
+    return states, continuous
+
+
+def test_drain_log(logs):
+    states, continuous = logs
+    state_rows, cont_rows = drain_log(states, continuous, before=3)
+    assert sorted(states) == [3, 4]
+    assert sorted(continuous) == [3]
+    assert state_rows[:3] == [(0, "state", "iti"), (0, "state_start", 0.0), (1, "state", "words")]
+    assert len(state_rows) == 6
+    assert [row[:3] for row in cont_rows] == [(1, "state_update", i) for i in range(3)]
+    assert cont_rows[1][3:] == ([("word1", "opacity", 1, 1)], None)
+
+
+def test_writer_appends_batches(tmp_path, logs):
+    states, continuous = logs
+    paths = tmp_path / "states.csv", tmp_path / "continuous.csv"
+    with AsyncLogWriter(*paths, maxsize=1) as writer:
+        # Flushed during each ITI: everything before the current state
+        writer.flush_log(SimpleLog(states, continuous), before=2)
+        writer.flush_log(SimpleLog(states, continuous), before=4)
+        writer.flush_log(SimpleLog(states, continuous))
+    assert not states and not continuous
+
+    statesdf = read_states_log(paths[0])
+    assert statesdf.index.tolist() == list(range(5))
+    assert statesdf["state"].tolist() == ["iti", "words", "iti", "words", "iti"]
+    contdf = pd.read_csv(paths[1])
+    assert contdf["state_number"].tolist() == [1, 1, 1, 3, 3, 3]
+    assert contdf["key_number"].tolist() == [0, 1, 2] * 2
+
+
+def test_writer_raises_errors(tmp_path):
+    writer = AsyncLogWriter(tmp_path / "missing" / "states.csv", tmp_path / "continuous.csv")
+    writer.submit("states", [(0, "state", "iti")])
+    with pytest.raises(RuntimeError, match="Writing the experiment log failed"):
+        writer.close()
+    with pytest.raises(ValueError, match="Unknown log kind"):
+        writer.submit("updates", [])
+
+
+class SimpleLog:
+    # The two dicts of a psystate ExperimentLog that the writer drains
+    def __init__(self, states, continuous):
+        self.states = states
+        self.continuous = continuous
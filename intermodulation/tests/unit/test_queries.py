@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intermodulation.queries import QueryIndex
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+CATEGORIES = [("word", "seen"), ("word", "unseen"), ("nonword", "seen"), ("nonword", "unseen")]
+
+
+@pytest.fixture
+def words(rng):  # noqa: F811
+    # A two-word list of 8 miniblocks over a small vocabulary, so words repeat across miniblocks
+    vocab = np.array([f"w{i}" for i in range(40)] + [f"nw{i}" for i in range(20)])
+    n = 8 * 4
+    word_list = pd.DataFrame({
+        "miniblock": rng.permutation(np.repeat(np.arange(8), 4)),
+        "w1": rng.choice(vocab, size=n),
+        "w2": rng.choice(vocab, size=n),
+        "condition": rng.choice(["phrase", "non-phrase", "non-word"], size=n),
+    })
+    allwords = pd.DataFrame({
+        "word": vocab,
+        "cond": np.where(np.char.startswith(vocab, "nw"), "non-word", "word"),
+    })
+    # A word listed under two categories
+    allwords = pd.concat([allwords, pd.DataFrame({"word": ["w0"], "cond": ["adj"]})])
+    return word_list, allwords.reset_index(drop=True)
+
+
+def pandas_candidates(word_list, allwords, miniblock, cat):
+    # The filtering previously done by QueryTracker._set_candidates
+    last_words = word_list.query(f"miniblock == {miniblock}")
+    if cat[0] == "word":
+        wordmask = allwords["cond"] == cat[0]
+    else:
+        wordmask = allwords["cond"] != "word"
+    seenmask = allwords["word"].isin(last_words[["w1", "w2"]].values.flat)
+    if cat[1] == "unseen":
+        seenmask = ~seenmask
+    return np.flatnonzero(wordmask & seenmask)
+
+
+def test_candidates_match_pandas(words):
+    word_list, allwords = words
+    index = QueryIndex.build(word_list, allwords)
+    assert index.n_miniblocks == 8
+    for miniblock in range(8):
+        candidates = index.candidate_sets(miniblock, CATEGORIES + CATEGORIES[:1])
+        assert list(candidates) == CATEGORIES
+        for cat, entries in candidates.items():
+            expected = pandas_candidates(word_list, allwords, miniblock, cat)
+            np.testing.assert_array_equal(entries, expected)
+        has_nonword = (
+            word_list.query(f"miniblock == {miniblock}")["condition"] == "non-word"
+        ).any()
+        assert index.has_nonword[miniblock] == has_nonword
+
+
+def test_one_word_list(words):
+    word_list, allwords = words
+    index = QueryIndex.build(word_list.drop(columns="w2"), allwords)
+    shown = set(word_list.loc[word_list["miniblock"] == 3, "w1"])
+    assert set(index.words[index.seen[3]]) == shown
@@ -0,0 +1,93 @@
+import mne
+import numpy as np
+import pytest
+
+import intermodulation.analysis as ima
+from intermodulation.raw_epochs import RawEpochs, miniblock_epochs
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+SFREQ = 400.0
+EVENT_ID = {"MINIBLOCK/ONEWORD/WORD/F1": 140, "MINIBLOCK/ONEWORD/NONWORD/F1": 142}
+
+
+@pytest.fixture
+def raw(rng):  # noqa: F811
+    info = mne.create_info(["MEG0111", "MEG0112", "STI101"], SFREQ, ["mag", "mag", "stim"])
+    info["bads"] = ["MEG0112"]
+    with info._unlock():
+        info["lowpass"] = 30.0  # Low enough to decimate by 4 without aliasing
+    raw = mne.io.RawArray(rng.normal(size=(3, 20000)), info, first_samp=123, verbose=False)
+    # The last miniblock runs past the end of the recording and the fifth overlaps a bad segment
+    onsets = np.arange(11) * 1800 + 400
+    annot = mne.Annotations(
+        onset=np.append(onsets / SFREQ, 20.3),
+        duration=0.0,
+        description=[*(list(EVENT_ID) * 6)[:11], "BAD_muscle"],
+        orig_time=None,
+    )
+    return raw.set_annotations(annot)
+
+
+@pytest.mark.parametrize("decim", [1, 3, 4])
+def test_raw_epochs_match_preloaded(raw, decim):
+    events, event_id = mne.events_from_annotations(raw, verbose=False)
+    event_id = {k: v for k, v in event_id.items() if k.startswith("MINIBLOCK")}
+    epochs = mne.Epochs(
+        raw, events, event_id, -0.2, 4.0, picks="all", decim=decim, preload=True, verbose=False
+    )
+    streamed = miniblock_epochs(raw, -0.2, 4.0, picks="all", decim=decim)
+    assert len(streamed) == len(epochs) and streamed.ch_names == epochs.ch_names
+    np.testing.assert_array_equal(streamed.events, epochs.events)
+    np.testing.assert_allclose(streamed.times, epochs.times)
+    assert streamed.info["sfreq"] == epochs.info["sfreq"]
+    np.testing.assert_allclose(streamed.get_data(), epochs.get_data(), atol=1e-12)
+
+    key = "NONWORD"
+    np.testing.assert_allclose(
+        streamed[key].get_data(picks="mag", tmin=0.0, tmax=2.0, item=[0, 2]),
+        epochs[key].get_data(picks="mag", tmin=0.0, tmax=2.0, item=[0, 2]),
+        atol=1e-12,
+    )
+    np.testing.assert_allclose(streamed[key].average().data, epochs[key].average().data)
+
+
+def test_raw_epochs_feed_spectra(raw):
+    events, event_id = mne.events_from_annotations(raw, verbose=False)
+    epochs = mne.Epochs(raw, events, event_id, -0.2, 4.0, preload=True, verbose=False)
+    streamed = RawEpochs.from_raw(raw, events, event_id, -0.2, 4.0)
+    assert len(streamed) == 9 and streamed.ch_names == ["MEG0111", "MEG0112"]
+
+    expected = ima.EpochSpectra.from_epochs(epochs, 1.0, 40.0, 0.0, 4.0, n_jobs=1)
+    spectra = ima.EpochSpectra.from_epochs(streamed, 1.0, 40.0, 0.0, 4.0, n_jobs=1)
+    np.testing.assert_allclose(spectra.coefs, expected.coefs)
+    assert spectra.event_id == expected.event_id
+    with pytest.raises(KeyError, match="No events match"):
+        streamed["TWOWORD"]
+
+
+def test_raw_epochs_apply_projectors(raw):
+    raw.info["bads"] = []
+    proj = mne.Projection(
+        data=dict(
+            col_names=["MEG0111", "MEG0112"],
+            row_names=None,
+            data=np.array([[0.6, 0.8]]),
+            nrow=1,
+            ncol=2,
+        ),
+        desc="test",
+        kind=1,
+        active=False,
+    )
+    raw.add_proj(proj)
+    events, event_id = mne.events_from_annotations(raw, verbose=False)
+    event_id = {k: v for k, v in event_id.items() if k.startswith("MINIBLOCK")}
+    epochs = mne.Epochs(raw, events, event_id, -0.2, 2.0, picks="all", preload=True, verbose=False)
+    streamed = miniblock_epochs(raw, -0.2, 2.0, picks="all")
+    assert all(p["active"] for p in streamed.info["projs"])
+    np.testing.assert_allclose(streamed.get_data(), epochs.get_data(), atol=1e-12)
+    np.testing.assert_allclose(
+        streamed.get_data(picks=["MEG0112"], item=[1]),
+        epochs.get_data(picks=["MEG0112"], item=[1]),
+        atol=1e-12,
+    )
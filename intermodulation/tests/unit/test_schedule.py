@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intermodulation.freqtag_spec import TRIGGERS
+from intermodulation.schedule import REPORT_PIX_VALS, FrameSchedule, WordSchedule
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+N_MINIBLOCKS = 6
+MINIBLOCK_LEN = 5
+FRAMERATE = 240
+FREQS = (6.0, 7.5)
+WORD_DUR = 4 / 3  # A whole number of cycles of both tags
+
+
+@pytest.fixture
+def word_list(rng):  # noqa: F811
+    # Rows of the miniblocks interleaved, as the schedule must not rely on them being contiguous
+    n = N_MINIBLOCKS * MINIBLOCK_LEN
+    miniblock = rng.permutation(np.repeat(np.arange(N_MINIBLOCKS), MINIBLOCK_LEN))
+    return pd.DataFrame({
+        "miniblock": miniblock,
+        "w1": [f"first{i}" for i in range(n)],
+        "w2": [f"second{i}" for i in range(n)],
+        "w1_freq": rng.permutation(np.resize(FREQS, N_MINIBLOCKS))[miniblock],
+        "w2_freq": 0.0,
+        "condition": rng.choice(["phrase", "non-phrase", "non-word"], size=n),
+    })
+
+
+def query_sequence(word_list, n_miniblocks, n_words):
+    # The lookups previously made by the miniblock states: each miniblock's rows from
+    # `word_list.query`, advancing with `.iloc` and staying on the last word
+    seq = []
+    miniblock_idx = 0
+    for _ in range(n_miniblocks):
+        wordset = word_list.query(f"miniblock == {miniblock_idx}")
+        wordset_idx = 0
+        for _ in range(n_words):
+            row = wordset.iloc[wordset_idx]
+            seq.append((row["w1"], row["w2"], row["w1_freq"], row["w2_freq"], row["condition"]))
+            if wordset_idx != len(wordset) - 1:
+                wordset_idx += 1
+        miniblock_idx += 1
+        if miniblock_idx == len(word_list["miniblock"].unique()):
+            miniblock_idx = 0
+    return seq
+
+
+def schedule_sequence(schedule, n_miniblocks, n_words):
+    seq = []
+    miniblock_idx = 0
+    for _ in range(n_miniblocks):
+        wordset_idx = 0
+        for _ in range(n_words):
+            entry = schedule.index(miniblock_idx, wordset_idx)
+            seq.append((
+                *schedule.words[entry],
+                *schedule.freqs[entry],
+                schedule.conditions[entry],
+            ))
+            wordset_idx = schedule.next_word_idx(miniblock_idx, wordset_idx)
+        miniblock_idx = schedule.next_miniblock(miniblock_idx)
+    return seq
+
+
+@pytest.mark.parametrize("n_words", [MINIBLOCK_LEN, MINIBLOCK_LEN + 3])
+def test_schedule_matches_query(word_list, n_words):
+    schedule = WordSchedule.from_word_list(word_list, ("w1", "w2"))
+    assert schedule.n_miniblocks == N_MINIBLOCKS
+    # Run past the last miniblock to check the wraparound
+    n_miniblocks = N_MINIBLOCKS + 2
+    assert schedule_sequence(schedule, n_miniblocks, n_words) == query_sequence(
+        word_list, n_miniblocks, n_words
+    )
+    for i in range(N_MINIBLOCKS):
+        pd.testing.assert_frame_equal(
+            schedule.wordset(word_list, i), word_list.query(f"miniblock == {i}")
+        )
+
+
+def test_schedule_one_word(word_list):
+    schedule = WordSchedule.from_word_list(word_list, ("w1",))
+    assert schedule.words.shape == (len(word_list), 1)
+    entry = schedule.index(2, 1)
+    (word,) = schedule.words[entry]
+    assert word == word_list.query("miniblock == 2")["w1"].iloc[1]
+
+
+def test_schedule_miniblock_gap(word_list):
+    word_list.loc[word_list["miniblock"] == 3, "miniblock"] = N_MINIBLOCKS
+    with pytest.raises(ValueError, match="without gaps"):
+        WordSchedule.from_word_list(word_list)
+
+
+def flicker_frames(word_list, miniblock, n_frames):
+    # Per-frame loop of the miniblock states and FrameFlickerStimState: words change every
+    # `wordframes` frames, and each part switches opacity at the end of each half cycle
+    wordset = word_list.query(f"miniblock == {miniblock}")
+    wordframes = int(np.round(WORD_DUR * FRAMERATE))
+    freqs = wordset.iloc[0][["w1_freq", "w2_freq"]].to_list()
+    targets = [np.arange(h - 1, n_frames, h) for h in (int(FRAMERATE / (2 * f)) for f in freqs)]
+    opacity = [1.0, 1.0]
+    wordset_idx = 0
+    words, opacities = [], []
+    for frame_num in range(n_frames):
+        if frame_num % wordframes == 0 and frame_num > 0:
+            if wordset_idx != len(wordset) - 1:
+                wordset_idx += 1
+        for i, keytargets in enumerate(targets):
+            if frame_num in keytargets:
+                idx = np.flatnonzero(keytargets == frame_num)[0]
+                opacity[i] = 1.0 if idx % 2 else 0.0
+        words.append(tuple(wordset.iloc[wordset_idx][["w1", "w2"]]))
+        opacities.append(tuple(opacity))
+    return words, np.array(opacities)
+
+
+@pytest.fixture
+def two_tags(word_list):
+    word_list["w2_freq"] = np.where(word_list["w1_freq"] == FREQS[0], FREQS[1], FREQS[0])
+    return word_list
+
+
+@pytest.mark.parametrize("miniblock", [0, 3])
+def test_frames_match_frame_loop(two_tags, miniblock):
+    # Longer than the miniblock's words, as in the experiment
+    n_frames = round((MINIBLOCK_LEN + 0.75) * WORD_DUR * FRAMERATE)
+    schedule = WordSchedule.from_word_list(two_tags)
+    frames = FrameSchedule.compile(
+        schedule, miniblock, FRAMERATE, WORD_DUR, n_frames, freqs=FREQS, reporting_pix=True
+    )
+    words, opacity = flicker_frames(two_tags, miniblock, n_frames)
+    assert frames.parts == ("word1", "word2")
+    assert [
+        tuple(w) for w in schedule.words[schedule.index(miniblock, 0) + frames.word_idx]
+    ] == words
+    np.testing.assert_array_equal(frames.opacity, opacity)
+    np.testing.assert_array_equal(frames.switch, opacity != np.vstack(([1.0, 1.0], opacity[:-1])))
+    changes = np.flatnonzero(frames.text_change)
+    np.testing.assert_array_equal(
+        changes, np.arange(1, MINIBLOCK_LEN) * round(WORD_DUR * FRAMERATE)
+    )
+    np.testing.assert_array_equal(frames.word_change, frames.text_change)
+    np.testing.assert_array_equal(
+        frames.pix_color, [REPORT_PIX_VALS[bool(o1), bool(o2)] for o1, o2 in opacity]
+    )
+
+    # Triggers at the start and at each word change
+    wordset = two_tags.query(f"miniblock == {miniblock}")
+    side = "F1LEFT" if wordset["w1_freq"].iloc[0] == FREQS[0] else "F1RIGHT"
+    conds = {"phrase": "PHRASE", "non-phrase": "NONPHRASE", "non-word": "NONWORD"}
+    expected = [TRIGGERS.MINIBLOCK.TWOWORD[conds[wordset["condition"].iloc[0]]][side]]
+    expected += [TRIGGERS.TWOWORD[conds[c]][side] for c in wordset["condition"].iloc[1:]]
+    np.testing.assert_array_equal(frames.trigger[frames.trigger != 0], expected)
+    np.testing.assert_array_equal(np.flatnonzero(frames.trigger)[1:], changes)
+
+
+def test_frames_frequency_content(two_tags):
+    schedule = WordSchedule.from_word_list(two_tags)
+    n_frames = round(MINIBLOCK_LEN * WORD_DUR * FRAMERATE)
+    for i in range(schedule.n_miniblocks):
+        frames = FrameSchedule.compile(schedule, i, FRAMERATE, WORD_DUR, n_frames)
+        w1_freq, w2_freq = schedule.freqs[schedule.index(i, 0)]
+        assert frames.peak_frequencies() == {"word1": w1_freq, "word2": w2_freq}
+        assert not frames.trigger.any()
+
+
+def test_frames_one_word(word_list):
+    word_list["condition"] = np.where(word_list.index % 2, "word", "non-word")
+    schedule = WordSchedule.from_word_list(word_list, ("w1",))
+    n_frames = round(MINIBLOCK_LEN * WORD_DUR * FRAMERATE)
+    frames = FrameSchedule.compile(
+        schedule, 1, FRAMERATE, WORD_DUR, n_frames, freqs=FREQS, reporting_pix=True
+    )
+    assert frames.parts == ("word1", "reporting_pix")
+    np.testing.assert_array_equal(frames.opacity[:, 0], frames.opacity[:, 1])
+    (w1_freq,) = schedule.freqs[schedule.index(1, 0)]
+    assert frames.peak_frequencies()["reporting_pix"] == w1_freq
+    cond = "WORD" if schedule.conditions[schedule.index(1, 0)] == "word" else "NONWORD"
+    tag = "F1" if w1_freq == FREQS[0] else "F2"
+    assert frames.trigger[0] == TRIGGERS.MINIBLOCK.ONEWORD[cond][tag]
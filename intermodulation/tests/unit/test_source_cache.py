@@ -0,0 +1,102 @@
+import os
+
+import mne
+import numpy as np
+import pytest
+import scipy.sparse
+
+from intermodulation.analysis import InverseKernel
+from intermodulation.source_cache import MorphMatrix, SourceCache, cache_key
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+
+@pytest.fixture
+def kernel(rng):  # noqa: F811
+    return InverseKernel(
+        kernel=rng.normal(size=(3 * 10, 4)),
+        ch_names=["EEG001", "EEG002", "EEG003", "EEG004"],
+        vertices=[np.arange(6), np.arange(4)],
+        n_orient=3,
+        noise_norm=rng.random(10),
+        nave=1,
+        subject="sub-01_ses-01",
+    )
+
+
+@pytest.fixture
+def morph(rng):  # noqa: F811
+    morph_mat = scipy.sparse.random_array((12, 10), density=0.3, rng=rng, format="csr")
+    return MorphMatrix(
+        morph_mat=morph_mat,
+        vertices_from=[np.arange(6), np.arange(4)],
+        vertices_to=[np.arange(7), np.arange(5)],
+        subject_from="sub-01_ses-01",
+        subject_to="fsaverage",
+    )
+
+
+def test_cache_key_tracks_file_contents(tmp_path):
+    src = tmp_path / "sub-01-oct6-src.fif"
+    src.write_bytes(b"source space")
+    key = cache_key("morph", "sub-01", "oct6", src)
+    assert key == cache_key("morph", "sub-01", "oct6", src)
+    assert key != cache_key("morph", "sub-01", "ico4", src)
+    src.write_bytes(b"another source space")
+    assert key != cache_key("morph", "sub-01", "oct6", src)
+    key = cache_key("morph", "sub-01", "oct6", src)
+    os.utime(src, ns=(0, 0))  # Rewritten with the same size
+    assert key != cache_key("morph", "sub-01", "oct6", src)
+
+    cov = tmp_path / "sub-01-cov.fif"
+    assert cache_key(cov) == cache_key(cov) != cache_key(src)
+
+
+def test_inverse_kernel_cached(tmp_path, kernel):
+    cache = SourceCache(tmp_path)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return kernel
+
+    assert cache.inverse_kernel("abc", compute) is kernel
+    cached = cache.inverse_kernel("abc", compute)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(cached.kernel, kernel.kernel)
+    np.testing.assert_array_equal(cached.noise_norm, kernel.noise_norm)
+    for v1, v2 in zip(cached.vertices, kernel.vertices):
+        np.testing.assert_array_equal(v1, v2)
+    assert cached.ch_names == kernel.ch_names
+    assert (cached.n_orient, cached.nave, cached.subject) == (3, 1, "sub-01_ses-01")
+    assert [p.name for p in tmp_path.iterdir()] == ["abc"]
+
+
+def test_morph_matrix_cached(tmp_path, morph, rng):  # noqa: F811
+    cache = SourceCache(tmp_path)
+    assert cache.morph_matrix("abc", lambda: morph) is morph
+    cached = SourceCache(tmp_path).morph_matrix(
+        "abc", lambda: pytest.fail("Morph should not be recomputed")
+    )
+    assert (cached.morph_mat != morph.morph_mat).nnz == 0
+    stc = mne.SourceEstimate(
+        rng.random((10, 5)), morph.vertices_from, tmin=0.1, tstep=0.1, subject="sub-01_ses-01"
+    )
+    morphed = cached.apply(stc)
+    np.testing.assert_allclose(morphed.data, morph.morph_mat @ stc.data)
+    assert morphed.subject == "fsaverage"
+    np.testing.assert_array_equal(morphed.vertices[1], morph.vertices_to[1])
+    np.testing.assert_allclose(morphed.times, stc.times)
+
+
+def test_morph_apply_batch(morph, rng):  # noqa: F811
+    arrays = [rng.random((10, n)) for n in (5, 3, 5, 1)]
+    morphed = morph.apply_batch(arrays, [morph.vertices_from] * len(arrays))
+    assert [arr.shape for arr in morphed] == [(12, n) for n in (5, 3, 5, 1)]
+    for arr, out in zip(arrays, morphed):
+        np.testing.assert_allclose(out, morph.morph_mat @ arr)
+
+    # Arrays of another source space, e.g. from a stale cached morph, are refused
+    with pytest.raises(ValueError, match="do not match"):
+        morph.apply_batch(arrays, [morph.vertices_from] * 3 + [[np.arange(1, 7), np.arange(4)]])
+    with pytest.raises(ValueError, match="do not match"):
+        morph.apply_batch(arrays[:1], [[np.arange(6)]])
@@ -0,0 +1,72 @@
+import pickle
+
+import mne
+import numpy as np
+import pytest
+
+from intermodulation.spectral_store import (
+    SpectralStore,
+    convert_pickle,
+    find_stores,
+    save_spectral_store,
+)
+from intermodulation.tests.fixtures import rng  # noqa: F401
+
+
+@pytest.fixture
+def spectra(rng):  # noqa: F811
+    freqs = np.linspace(0.1, 10, 100)
+    return {
+        key: dict(
+            psds=rng.random((5, 3, freqs.size)),
+            snrs=rng.random((5, 3, freqs.size)).astype(np.float32),
+            freqs=freqs,
+        )
+        for key in ("F1", "ONEWORD/WORD/F1")
+    }
+
+
+@pytest.fixture
+def info():
+    info = mne.create_info(["MEG0111", "MEG0112", "MEG0113", "MEG0121"], 1000.0, "mag")
+    info["bads"] = ["MEG0121"]
+    return info
+
+
+def test_roundtrip(tmp_path, spectra, info):
+    ch_names = info.ch_names[:3]
+    path = save_spectral_store(tmp_path / "sub-01_allcondSNR", spectra, info, ch_names)
+    store = SpectralStore(path)
+    assert store.keys() == list(spectra)
+    assert store.ch_names == ch_names
+    assert store.info.ch_names == ch_names
+    for key, fields in spectra.items():
+        for name, arr in store[key].items():
+            assert isinstance(arr, np.memmap)
+            assert arr.dtype == fields[name].dtype
+            np.testing.assert_array_equal(arr, fields[name])
+    with pytest.raises(FileExistsError):
+        save_spectral_store(path, spectra)
+    assert find_stores(tmp_path, "sub-*_allcondSNR") == [path]
+
+
+def test_get_slices(tmp_path, spectra, info):
+    store = SpectralStore(save_spectral_store(tmp_path / "store", spectra, info, info.ch_names[:3]))
+    freqs = spectra["F1"]["freqs"]
+    fmask = (freqs >= 2.0) & (freqs <= 5.0)
+    data = store.get("F1", "psds", picks=["MEG0113", "MEG0111"], fmin=2.0, fmax=5.0)
+    np.testing.assert_array_equal(data, spectra["F1"]["psds"][:, [2, 0]][..., fmask])
+
+
+def test_convert_pickle(tmp_path, spectra, info):
+    rawinfo = info.copy()
+    samp_epoch = mne.EpochsArray(np.zeros((1, 4, 10)), rawinfo, verbose=False)
+    pkl_path = tmp_path / "sub-01_allcondSNR.pkl"
+    with open(pkl_path, "wb") as f:
+        pickle.dump({**spectra, "samp_epoch": samp_epoch}, f)
+    store = SpectralStore(convert_pickle(pkl_path))
+    assert store.path == tmp_path / "sub-01_allcondSNR"
+    assert store.ch_names == ["MEG0111", "MEG0112", "MEG0113"]
+    np.testing.assert_array_equal(
+        store["ONEWORD/WORD/F1"]["snrs"], spectra["ONEWORD/WORD/F1"]["snrs"]
+    )
@@ -2,9 +2,9 @@ from argparse import ArgumentParser
 
 import mne
 import mne_bids
-import numpy as np
 import pandas as pd
 
+from intermodulation.events import stepfix_events, trigger_event_table
 from intermodulation.freqtag_spec import LUT_TRIGGERS
 
 if __name__ == "__main__":
@@ -50,67 +50,24 @@ if __name__ == "__main__":
         consecutive="increasing",
         shortest_event=1,
     )
-    evdf = pd.DataFrame(events, columns=["sample", "v1", "v2"])
     if args.stepfix:
-        for i in evdf.index:
-            if evdf.at[i, "v1"] != 0:
-                evdf.at[i - 1, "v2"] = evdf.at[i, "v2"]
-        evdf = evdf[evdf["v1"] == 0].copy().reset_index()
+        events = stepfix_events(events)
     lut_triggers = {k: "/".join(v) for k, v in LUT_TRIGGERS.items()}
     if args.miniblock_events:
         for k, v in lut_triggers.items():
             if v.split("/")[0] in ("ONEWORD", "TWOWORD"):
                 lut_triggers[k + 100] = "MINIBLOCK/" + v
 
-    evdf["label1"] = evdf["v1"].map(lut_triggers)
-    evdf["label2"] = evdf["v2"].map(lut_triggers)
-    evdf["last"] = np.roll(evdf["label2"].values, 1)
-
-    records = []
-    offset = raw.first_samp / raw.info["sfreq"]
-    newevs = []
-    miniblock_onset = None
-    miniblock_sample = None
-    for row in evdf.itertuples():
-        if row.label2 in ("STATEEND", "TRIALEND", "BLOCKEND"):
-            continue
-        try:
-            end = evdf.at[row.Index + 1, "sample"] / raw.info["sfreq"] + offset
-        except KeyError:
-            end = raw.times[-1]
-        onset = row.sample / raw.info["sfreq"] + offset
-        if args.miniblock_events and row.label2.split("/")[0] in ("ONEWORD", "TWOWORD"):
-            if row.last == "FIXATION":
-                miniblock_onset = onset
-                miniblock_sample = row.sample
-            elif row.last == row.label2 and evdf.at[row.Index + 1, "label2"] != row.label2:
-                if miniblock_sample is None:
-                    raise ValueError("MINIBLOCK start not found!")
-                records.append({
-                    "onset": miniblock_onset,
-                    "duration": onset - miniblock_onset,
-                    "trial_type": "MINIBLOCK/" + row.label2,
-                    "value": 100 + row.v2,
-                    "sample": miniblock_sample,
-                    "channel": args.stim_channel,
-                })
-                newevs.append(
-                    np.array([miniblock_sample + args.ev_offset, 0, 100 + row.v2]).reshape(1, 3)
-                )
-                miniblock_onset = None
-                miniblock_sample = None
-
-        records.append({
-            "onset": onset,
-            "duration": end - onset,
-            "trial_type": row.label2,
-            "value": row.v2,
-            "sample": row.sample,
-            "channel": args.stim_channel,
-        })
-        newevs.append(np.array([row.sample + args.ev_offset, 0, row.v2]).reshape(1, 3))
-    newevs = np.concatenate(newevs, axis=0)
-    bidsevs = pd.DataFrame.from_records(records)
+    bidsevs, newevs = trigger_event_table(
+        events,
+        lut_triggers,
+        sfreq=raw.info["sfreq"],
+        first_samp=raw.first_samp,
+        last_time=raw.times[-1],
+        stim_channel=args.stim_channel,
+        miniblock_conditions=("ONEWORD", "TWOWORD") if args.miniblock_events else None,
+        ev_offset=args.ev_offset,
+    )
     bidevpath = bids_path.copy().update(suffix="events", extension=".tsv")
 
     if args.interactive:
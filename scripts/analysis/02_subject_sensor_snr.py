@@ -1,11 +1,13 @@
-import pickle
-
 import mne
 import mne_bids as mnb
 from tqdm import tqdm
 
 import intermodulation.analysis as ima
 from intermodulation import analysis_spec, freqtag_spec
+from intermodulation.imfreqs import im_frequencies
+from intermodulation.lockin import LockIn, sliding_snr_itc
+from intermodulation.raw_epochs import miniblock_epochs
+from intermodulation.spectral_store import save_spectral_store
 
 if __name__ == "__main__":
     parser = analysis_spec.make_parser()
@@ -20,6 +22,32 @@ if __name__ == "__main__":
         "and SNR for a given condition. Will produce an additional description string in the "
         "saved files CONDMEAN.",
     )
+    parser.add_argument(
+        "--decim",
+        type=int,
+        default=1,
+        help="Decimation factor of the miniblock epochs, e.g. 4 for 500Hz from 2000Hz. The raw "
+        "data is not filtered first, so it must already be low-passed below the new Nyquist.",
+    )
+    parser.add_argument(
+        "--sliding-window",
+        type=float,
+        default=None,
+        help="Length in seconds of sliding windows over the miniblock, for time-resolved SNR and "
+        "ITC at the tag and IM frequencies. Saved to additional slidingSNR files when given.",
+    )
+    parser.add_argument(
+        "--sliding-step",
+        type=float,
+        default=0.5,
+        help="Step in seconds between the sliding windows",
+    )
+    parser.add_argument(
+        "--per-word",
+        action="store_true",
+        help="Whether to also compute SNR and ITC at the tag and IM frequencies for each word "
+        "position of the miniblocks, saved to additional perwordSNR files.",
+    )
 
     args = parser.parse_args()
 
@@ -59,18 +87,11 @@ if __name__ == "__main__":
         except FileNotFoundError:
             raise FileNotFoundError(f"Could not find the file {raw_bidspath.fpath}! Please check.")
 
-    events, evdict = mne.events_from_annotations(raw)
-    keepev = {k: v for k, v in evdict.items() if k.split("/")[0] == "MINIBLOCK"}
     print("Raw sampled at ", raw.info["sfreq"])
-    # if raw.info["sfreq"] == 2000:
-    #     decim = 4
-    #     print("Decimating to 500Hz from 2000Hz")
-    # else:
-    #     decim = 1
-
-    epochs = mne.Epochs(raw, event_id=keepev, tmin=-0.2, tmax=minidur, picks="all", verbose=False)
-    epochs.load_data()
-    del raw
+    if args.decim > 1:
+        print(f"Decimating to {raw.info['sfreq'] / args.decim}Hz")
+    # Each miniblock is read from the raw file only when the spectra reach it
+    epochs = miniblock_epochs(raw, tmin=-0.2, tmax=minidur, decim=args.decim)
 
     # Global parameters for different FFTs, using the common set from analysis spec
     tmin = 0.0
@@ -78,13 +99,26 @@ if __name__ == "__main__":
     snr_skip_neighbor_J = analysis_spec.noise_skip_neighbor_freqs
     snr_neighbor_K = analysis_spec.noise_n_neighbor_freqs
 
-    psd_kwargs = analysis_spec.sensor_fft_pars.copy()
-    psd_kwargs.update(
-        n_fft=int(epochs.info["sfreq"] * (tmax - tmin)),
+    # Fourier transform every epoch once, then take all condition subsets from the same spectra
+    print("Computing epoch spectra...")
+    spectra = ima.EpochSpectra.from_epochs(
+        epochs,
+        fmin=analysis_spec.sensor_fft_pars["fmin"],
+        fmax=analysis_spec.sensor_fft_pars["fmax"],
         tmin=tmin,
         tmax=tmax,
+        n_fft=int(epochs.info["sfreq"] * (tmax - tmin)),
     )
 
+    def condition_spectra(key):
+        psds = spectra.psd(key, average=args.cond_mean)
+        snrs = ima.snr_spectrum(
+            psds,
+            noise_n_neighbor_freqs=snr_neighbor_K,
+            noise_skip_neighbor_freqs=snr_skip_neighbor_J,
+        )
+        return dict(psds=psds, freqs=spectra.freqs, snrs=snrs, itcs=spectra.itc(key))
+
     print("Computing SNR for oneword+twoword, per condition and all conditions...")
     if args.cond_mean:
         meanstr = "CONDMEAN"
@@ -92,89 +126,106 @@ if __name__ == "__main__":
         meanstr = ""
     owbase = f"sub-{args.subject}_ses-{args.session}_task-{args.task}_proc-{args.proc}_desc-{meanstr}oneword"
     twbase = f"sub-{args.subject}_ses-{args.session}_task-{args.task}_proc-{args.proc}_desc-{meanstr}twoword"
-    allcond_spectra_ow = {"samp_epoch": epochs[0]}
-    allcond_spectra_tw = {"samp_epoch": epochs[0]}
-    percond_spectra_ow = {"samp_epoch": epochs[0]}
-    percond_spectra_tw = {"samp_epoch": epochs[0]}
+    allcond_spectra_ow = {}
+    allcond_spectra_tw = {}
+    percond_spectra_ow = {}
+    percond_spectra_tw = {}
     for tag in tqdm(["F1", "F2"], desc="Processing tag sets"):
         twtag = "F1LEFT" if tag == "F1" else "F1RIGHT"
-        if args.cond_mean:
-            ow_ep = epochs[f"MINIBLOCK/ONEWORD/{tag}"].average()
-            tw_ep = epochs[f"MINIBLOCK/TWOWORD/{twtag}"].average()
-            meanstr = "CONDMEAN"
-        else:
-            ow_ep = epochs[f"MINIBLOCK/ONEWORD/{tag}"]
-            tw_ep = epochs[f"MINIBLOCK/TWOWORD/{twtag}"]
-
-        spectrum = ow_ep.compute_psd(exclude="bads", n_jobs=-1, verbose="error", **psd_kwargs)
-        twspectrum = tw_ep.compute_psd(exclude="bads", n_jobs=-1, verbose="error", **psd_kwargs)
-        psds, freqs = spectrum.get_data(return_freqs=True)
-        twpsds, twfreqs = twspectrum.get_data(return_freqs=True)
-        snrs = ima.snr_spectrum(
-            psds,
-            noise_n_neighbor_freqs=snr_neighbor_K,
-            noise_skip_neighbor_freqs=snr_skip_neighbor_J,
-        )
-        twsnrs = ima.snr_spectrum(
-            twpsds,
-            noise_n_neighbor_freqs=snr_neighbor_K,
-            noise_skip_neighbor_freqs=snr_skip_neighbor_J,
-        )
-        allcond_spectra_ow[tag] = dict(psds=psds, freqs=freqs, snrs=snrs)
-        allcond_spectra_tw[twtag] = dict(psds=twpsds, freqs=twfreqs, snrs=twsnrs)
+        allcond_spectra_ow[tag] = condition_spectra(f"MINIBLOCK/ONEWORD/{tag}")
+        allcond_spectra_tw[twtag] = condition_spectra(f"MINIBLOCK/TWOWORD/{twtag}")
         for cond in tqdm(["WORD", "NONWORD"], desc=f"Processing OW {tag} conditions", leave=False):
             fulltag = f"ONEWORD/{cond}/{tag}"
-            ow_ep = (
-                epochs["MINIBLOCK/" + fulltag].average()
-                if args.cond_mean
-                else epochs["MINIBLOCK/" + fulltag]
-            )
-            spectrum = ow_ep.compute_psd(exclude="bads", n_jobs=-1, verbose="error", **psd_kwargs)
-            psds, freqs = spectrum.get_data(return_freqs=True)
-            snrs = ima.snr_spectrum(
-                psds,
-                noise_n_neighbor_freqs=snr_neighbor_K,
-                noise_skip_neighbor_freqs=snr_skip_neighbor_J,
-            )
-            percond_spectra_ow[fulltag] = dict(psds=psds, freqs=freqs, snrs=snrs)
+            percond_spectra_ow[fulltag] = condition_spectra("MINIBLOCK/" + fulltag)
         for cond in tqdm(
             ["PHRASE", "NONPHRASE", "NONWORD"], desc="Processing TW conditions", leave=False
         ):
             fulltag = f"TWOWORD/{cond}/{twtag}"
-            tw_ep = (
-                epochs["MINIBLOCK/" + fulltag].average()
-                if args.cond_mean
-                else epochs["MINIBLOCK/" + fulltag]
-            )
-            spectrum = tw_ep.compute_psd(exclude="bads", n_jobs=-1, verbose="error", **psd_kwargs)
-            psds, freqs = spectrum.get_data(return_freqs=True)
-            snrs = ima.snr_spectrum(
-                psds,
+            percond_spectra_tw[fulltag] = condition_spectra("MINIBLOCK/" + fulltag)
+    print("Done.")
+    print(f"Saving data to {procpath} ...")
+    for fname, spectra_dict in (
+        (f"{owbase}_allcondSNR", allcond_spectra_ow),
+        (f"{twbase}_allcondSNR", allcond_spectra_tw),
+        (f"{owbase}_percondSNR", percond_spectra_ow),
+        (f"{twbase}_percondSNR", percond_spectra_tw),
+    ):
+        save_spectral_store(
+            procpath / fname,
+            spectra_dict,
+            info=epochs.info,
+            ch_names=spectra.ch_names,
+            overwrite=True,
+        )
+
+    # Tag frequencies, their harmonics and the f2-f1, f1+f2 IMs, as plotted
+    targets = im_frequencies(freqtag_spec.FREQUENCIES, max_order=2)
+    if args.sliding_window is not None:
+        print(f"Computing SNR and ITC in sliding windows of {args.sliding_window} s...")
+
+        def sliding_spectra(key):
+            return sliding_snr_itc(
+                epochs[key],
+                targets,
+                args.sliding_window,
+                args.sliding_step,
+                tmin=tmin,
+                tmax=tmax,
                 noise_n_neighbor_freqs=snr_neighbor_K,
                 noise_skip_neighbor_freqs=snr_skip_neighbor_J,
+                fmin=analysis_spec.sensor_fft_pars["fmin"],
+                fmax=analysis_spec.sensor_fft_pars["fmax"],
+                average=args.cond_mean,
+            )
+
+        for base, task, allcond, percond in (
+            (owbase, "ONEWORD", allcond_spectra_ow, percond_spectra_ow),
+            (twbase, "TWOWORD", allcond_spectra_tw, percond_spectra_tw),
+        ):
+            keys = [f"{task}/{tag}" for tag in allcond] + list(percond)
+            sliding = {
+                key: sliding_spectra("MINIBLOCK/" + key)
+                for key in tqdm(keys, desc=f"Processing {task} sliding windows")
+            }
+            save_spectral_store(
+                procpath / f"{base}_slidingSNR",
+                sliding,
+                info=epochs.info,
+                ch_names=spectra.ch_names,
+                overwrite=True,
+            )
+
+    if args.per_word:
+        print("Computing SNR and ITC per word position...")
+        word_lockin = LockIn.design(
+            epochs.info["sfreq"],
+            int(epochs.info["sfreq"] * freqtag_spec.WORD_DUR),
+            targets,
+            snr_neighbor_K,
+            snr_skip_neighbor_J,
+            fmin=analysis_spec.sensor_fft_pars["fmin"],
+            fmax=analysis_spec.sensor_fft_pars["fmax"],
+        )
+        word_spectra = word_lockin.word_spectra(
+            epochs, freqtag_spec.WORD_DUR, freqtag_spec.MINIBLOCK_LEN, tmin=tmin
+        )
+        for base, task, allcond, percond in (
+            (owbase, "ONEWORD", allcond_spectra_ow, percond_spectra_ow),
+            (twbase, "TWOWORD", allcond_spectra_tw, percond_spectra_tw),
+        ):
+            keys = [f"{task}/{tag}" for tag in allcond] + list(percond)
+            perword = {
+                key: word_lockin.word_snr_itc(
+                    word_spectra, freqtag_spec.MINIBLOCK_LEN, key, average=args.cond_mean
+                )
+                for key in keys
+            }
+            save_spectral_store(
+                procpath / f"{base}_perwordSNR",
+                perword,
+                info=epochs.info,
+                ch_names=word_spectra.ch_names,
+                overwrite=True,
             )
-            percond_spectra_tw[fulltag] = dict(psds=psds, freqs=freqs, snrs=snrs)
-    print("Done.")
-    print(f"Saving data to {procpath} ...")
-    with open(
-        procpath / f"{owbase}_allcondSNR.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(allcond_spectra_ow, f)
-    with open(
-        procpath / f"{twbase}_allcondSNR.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(allcond_spectra_tw, f)
-    with open(
-        procpath / f"{owbase}_percondSNR.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(percond_spectra_ow, f)
-    with open(
-        procpath / f"{twbase}_percondSNR.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(percond_spectra_tw, f)
 
     print("Done.\n")
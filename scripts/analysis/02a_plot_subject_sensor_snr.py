@@ -1,9 +1,10 @@
 import matplotlib.pyplot as plt
 import mne_bids as mnb
-import pandas as pd
 
+import intermodulation.imfreqs as imf
 import intermodulation.plot as imp
-from intermodulation import analysis_spec
+from intermodulation import analysis_spec, freqtag_spec
+from intermodulation.spectral_store import SpectralStore
 
 if __name__ == "__main__":
     parser = analysis_spec.make_parser(plots=True)
@@ -60,11 +61,17 @@ if __name__ == "__main__":
     print("Plotting SNR and SNR topos for oneword+twoword, all conditions combined...")
     plot_freqs = (1, 15)
     topofig_kw = dict(figsize=(8, 8), dpi=200)
+    # Tag frequencies, their harmonics and the f2-f1, f1+f2 IMs
+    tw_tagfreqs = imf.im_frequencies(freqtag_spec.FREQUENCIES, max_order=2)
+    ow_tagfreqs = dict(zip(("F1", "F2"), freqtag_spec.FREQUENCIES))
 
-    allcond_spectra_ow = pd.read_pickle(ow_base_path.update(suffix="allcondSNR").fpath)
-    allcond_spectra_tw = pd.read_pickle(tw_base_path.update(suffix="allcondSNR").fpath)
-    epochs = allcond_spectra_ow.pop("samp_epoch")
-    _ = allcond_spectra_tw.pop("samp_epoch")
+    allcond_spectra_ow = SpectralStore(
+        ow_base_path.update(suffix="allcondSNR").fpath.with_suffix("")
+    )
+    allcond_spectra_tw = SpectralStore(
+        tw_base_path.update(suffix="allcondSNR").fpath.with_suffix("")
+    )
+    info = allcond_spectra_ow.info
 
     for name, spectra in {"oneword": allcond_spectra_ow, "twoword": allcond_spectra_tw}.items():
         fig, axes = plt.subplots(2, 2, figsize=(15, 11), sharex=True, sharey="row")
@@ -72,17 +79,10 @@ if __name__ == "__main__":
             ax = axes[:, i]
             if name == "twoword":
                 # Vertical lines at tag frequencies and f2-f1, f1+f2 IMs
-                tagfreq = [
-                    7.05882353 - 6.0,
-                    6.0,
-                    7.05882353,
-                    2 * 6,
-                    6 + 7.05882353,
-                    2 * 7.05882353,
-                ]
+                tagfreq = tw_tagfreqs
                 titlestr = f"{tag} Two-Word SNR"
             else:
-                tagfreq = {"F1": 6.0, "F2": 7.05882353}[tag]
+                tagfreq = ow_tagfreqs[tag]
                 titlestr = f"{tag} One-Word SNR"
             imp.plot_snr(
                 data["psds"],
@@ -99,7 +99,7 @@ if __name__ == "__main__":
             # Topomap plots
             topofig = imp.snr_topo(
                 data["snrs"].mean(axis=0) if not args.cond_mean else data["snrs"],
-                epochs.pick("data", exclude="bads"),
+                info,
                 data["freqs"],
                 fmin=plot_freqs[0],
                 fmax=plot_freqs[1],
@@ -123,10 +123,12 @@ if __name__ == "__main__":
     print("Done.")
     del allcond_spectra_ow, allcond_spectra_tw
 
-    percond_spectra_ow = pd.read_pickle(ow_base_path.update(suffix="percondSNR").fpath)
-    percond_spectra_tw = pd.read_pickle(tw_base_path.update(suffix="percondSNR").fpath)
-    _ = percond_spectra_ow.pop("samp_epoch")
-    _ = percond_spectra_tw.pop("samp_epoch")
+    percond_spectra_ow = SpectralStore(
+        ow_base_path.update(suffix="percondSNR").fpath.with_suffix("")
+    )
+    percond_spectra_tw = SpectralStore(
+        tw_base_path.update(suffix="percondSNR").fpath.with_suffix("")
+    )
 
     print("Plotting SNR and SNR topos for oneword+twoword, per condition...")
     for name, spectra in {"oneword": percond_spectra_ow, "twoword": percond_spectra_tw}.items():
@@ -137,17 +139,10 @@ if __name__ == "__main__":
             freq = tag.split("/")[-1]
             if name == "twoword":
                 # Vertical lines at tag frequencies and f2-f1, f1+f2 IMs
-                tagfreq = [
-                    7.05882353 - 6.0,
-                    6.0,
-                    7.05882353,
-                    2 * 6,
-                    6 + 7.05882353,
-                    2 * 7.05882353,
-                ]
+                tagfreq = tw_tagfreqs
                 titlestr = f"{cond} SNR"
             else:
-                tagfreq = {"F1": 6.0, "F2": 7.05882353}[freq]
+                tagfreq = ow_tagfreqs[freq]
                 titlestr = f"{cond} SNR"
             ax = axes[:, i]
             imp.plot_snr(
@@ -164,7 +159,7 @@ if __name__ == "__main__":
             )
             topofig = imp.snr_topo(
                 data["snrs"].mean(axis=0) if not args.cond_mean else data["snrs"],
-                epochs.pick("data", exclude="bads"),
+                info,
                 data["freqs"],
                 fmin=plot_freqs[0],
                 fmax=plot_freqs[1],
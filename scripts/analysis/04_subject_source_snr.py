@@ -1,5 +1,6 @@
-import pickle
 from copy import deepcopy
+from functools import cache
+from pathlib import Path
 
 import mne
 import mne_bids as mnb
@@ -7,6 +8,9 @@ import mne_bids as mnb
 import intermodulation.analysis as ima
 import intermodulation.freqtag_spec as spec
 from intermodulation import analysis_spec
+from intermodulation.raw_epochs import miniblock_epochs
+from intermodulation.source_cache import MorphMatrix, SourceCache, cache_key
+from intermodulation.spectral_store import save_spectral_store
 
 
 def source_psd_epochs_avg(epochs, psd_kwargs: dict, subject: str, session: str):
@@ -19,27 +23,42 @@ def source_psd_epochs_avg(epochs, psd_kwargs: dict, subject: str, session: str):
         method=kwargs.pop("method"),
     )
     psdavg, freqs = mne.time_frequency.psd_array_welch(stc.data, **kwargs)
+    return psdavg, freqs, psd_stc(psdavg, freqs, stc.vertices, subject, session)
+
+
+def source_psd_freq_domain(
+    spectra: ima.EpochSpectra, key: str, kernel: ima.InverseKernel, subject: str, session: str
+):
+    # Same as `source_psd_epochs_avg`, projecting the evoked sensor spectrum through the kernel
+    psdavg = kernel.psd(spectra, key, average=True)
+    return psdavg, spectra.freqs, psd_stc(psdavg, spectra.freqs, kernel.vertices, subject, session)
+
+
+def psd_stc(psdavg, freqs, vertices, subject: str, session: str):
     fs_sub = f"sub-{subject}_ses-{session}" if subject != "fsaverage" else subject
-    plotstc = mne.SourceEstimate(
+    return mne.SourceEstimate(
         data=psdavg,
-        vertices=stc.vertices,
+        vertices=vertices,
         tmin=freqs.min(),
         tstep=freqs[1] - freqs[0],
         subject=fs_sub,
     )
-    return psdavg, freqs, plotstc
 
 
-def morph_psd_and_snr(plotstc: mne.SourceEstimate, psdavg, snrs):
-    orig_stc = plotstc.copy()
-    orig_stc.data = snrs
-    plotstc = morph.apply(orig_stc)  # Apply the morph to the SNRs first
-    snrs = plotstc.data
-
-    orig_stc.data = psdavg  # Then apply to the PSD average itself
-    tmp_stc = morph.apply(orig_stc)
-    psdavg = tmp_stc.data
-    return psdavg, snrs, plotstc
+def morph_psds_and_snrs(morph: MorphMatrix, *spectra: dict):
+    # Every PSD and SNR of the subject goes through a single sparse product with the morph matrix
+    entries = [entry for spectra_dict in spectra for entry in spectra_dict.values()]
+    morphed = morph.apply_batch(
+        [arr for entry in entries for arr in (entry["psd"], entry["snrs"])],
+        [entry["stc"].vertices for entry in entries for _ in range(2)],
+    )
+    for entry, psdavg, snrs in zip(entries, morphed[::2], morphed[1::2]):
+        stc = entry["stc"]
+        entry.update(
+            psd=psdavg,
+            snrs=snrs,
+            stc=mne.SourceEstimate(snrs, morph.vertices_to, stc.tmin, stc.tstep, morph.subject_to),
+        )
 
 
 if __name__ == "__main__":
@@ -62,6 +81,27 @@ if __name__ == "__main__":
         "available. If not provided, will use the file present in the freesurfer `bem` directory "
         "for the subject/session, provided only one source space file is present.",
     )
+    parser.add_argument(
+        "--freq-domain-inverse",
+        action="store_true",
+        help="Project the sensor FFT coefficients through the inverse kernel instead of applying "
+        "the inverse to the evoked time course and computing the PSD of every source. Much faster "
+        "and lighter on memory. With a loose orientation inverse the power of the three "
+        "orientations is summed, rather than taking the PSD of their norm.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory in which to cache inverse kernels and fsaverage morph matrices, keyed by "
+        "the forward or inverse solution, subject and spacing. Defaults to "
+        "`derivatives/source_cache`.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Recompute the inverse kernel and morph matrix instead of using the cache.",
+    )
 
     args = parser.parse_args()
 
@@ -129,73 +169,106 @@ if __name__ == "__main__":
     else:
         bem_path = list(bem_path.glob("sub*-bem-sol.fif"))[0]
 
-    src = mne.read_source_spaces(src_path)
-    bem = mne.read_bem_solution(bem_path)
-
-    trans = mne.read_trans(trans_bidspath.fpath)
     fwd_bidspath = trans_bidspath.copy().update(suffix="fwd")
+    inv_bidspath = trans_bidspath.copy().update(suffix="inv")
+    cov_bidspath = raw_bidspath.copy().update(
+        split=None,
+        suffix="cov",
+        task="noise",
+    )
 
     raw = mne.io.read_raw_fif(raw_bidspath.fpath)  # ima.miniblock_events(raw)
-    try:
-        fwd = mne.read_forward_solution(fwd_bidspath.fpath)
-    except FileNotFoundError:
-        print(f"Forward solution not found for subject {args.subject}, session {args.session}!")
-        print("Will attempt to recompute forward solution.")
-
+    raw_info = raw.info
+
+    # The forward and inverse solutions are only read (or computed) when they are needed, which
+    # is never when the inverse kernel and morph are already in the cache
+    @cache
+    def get_forward():
+        try:
+            return mne.read_forward_solution(fwd_bidspath.fpath)
+        except FileNotFoundError:
+            print(f"Forward solution not found for subject {args.subject}, session {args.session}!")
+            print("Will attempt to recompute forward solution.")
+
+        src = mne.read_source_spaces(src_path)
+        bem = mne.read_bem_solution(bem_path)
+        trans = mne.read_trans(trans_bidspath.fpath)
         fwd = mne.make_forward_solution(
-            raw.info,
+            raw_info,
             trans=trans,
             src=src,
             bem=bem,
             mindist=5,
         )
         mne.write_forward_solution(fwd_bidspath.fpath, fwd, overwrite=True)
-
-    cov_bidspath = raw_bidspath.copy().update(
-        split=None,
-        suffix="cov",
-        task="noise",
-    )
-    inv_bidspath = trans_bidspath.copy().update(suffix="inv")
-    cov = mne.read_cov(cov_bidspath)
-    try:
-        inv = mne.minimum_norm.read_inverse_operator(inv_bidspath.fpath)
-    except FileNotFoundError:
-        print(f"Inverse solution no found for subject {args.subject}, session {args.session}!")
-        print("Will attempt to recompute inverse solution")
+        return fwd
+
+    @cache
+    def get_inverse():
+        try:
+            return mne.minimum_norm.read_inverse_operator(inv_bidspath.fpath)
+        except FileNotFoundError:
+            print(f"Inverse solution no found for subject {args.subject}, session {args.session}!")
+            print("Will attempt to recompute inverse solution")
+        cov = mne.read_cov(cov_bidspath)
         inv = mne.minimum_norm.make_inverse_operator(
-            raw.info,
-            fwd,
+            raw_info,
+            get_forward(),
             cov,
             loose="auto",
             rank="info",
         )
         mne.minimum_norm.write_inverse_operator(inv_bidspath.fpath, inv, overwrite=True)
+        return inv
+
+    if args.no_cache:
+        source_cache = None
+    else:
+        cache_dir = args.cache_dir or derivatives_root.parent / "source_cache"
+        source_cache = SourceCache(cache_dir / fs_sub)
+
+    def solution_key(kind: str, fpath: Path, compute, *params) -> str:
+        # Entries are keyed by the forward or inverse solution they are computed from, which
+        # mne-bids-pipeline may regenerate with other parameters (loose, depth, bads, rank,
+        # mindist) from the same geometry. A missing solution is computed and written first, so
+        # the key is that of the file the next run reads.
+        if not fpath.exists():
+            compute()
+        return cache_key(kind, fs_sub, args.src_spacing, *params, fpath)
 
     if args.morph_fsaverage:
-        fsavg_src = mne.read_source_spaces(fs_root / "fsaverage/bem/fsaverage-ico-5-src.fif")
-        morph = mne.compute_source_morph(
-            fwd["src"],
-            subject_from=fs_sub,
-            subject_to="fsaverage",
-            subjects_dir=fs_root,
-            src_to=fsavg_src,
-        )
+        fsavg_src_path = fs_root / "fsaverage/bem/fsaverage-ico-5-src.fif"
+
+        def compute_morph():
+            return mne.compute_source_morph(
+                get_forward()["src"],
+                subject_from=fs_sub,
+                subject_to="fsaverage",
+                subjects_dir=fs_root,
+                src_to=mne.read_source_spaces(fsavg_src_path),
+            )
+
+        if source_cache is None:
+            morph = MorphMatrix.from_morph(compute_morph())
+        else:
+            # The morph is built from the source space of the forward solution, from which
+            # mindist may have dropped vertices
+            morph_key = solution_key("morph", fwd_bidspath.fpath, get_forward, fsavg_src_path)
+            morph = source_cache.morph_matrix(morph_key, compute_morph)
         morphstr = "morphFSAVG"
     else:
         morphstr = ""
 
     minidur = spec.WORD_DUR * spec.MINIBLOCK_LEN
 
-    events, evdict = mne.events_from_annotations(raw)
-    keepev = {k: v for k, v in evdict.items() if k.split("/")[0] == "MINIBLOCK"}
-    epochs = mne.Epochs(raw, event_id=keepev, tmin=-0.2, tmax=minidur, picks="all", preload=True)
-
-    del raw
-    if epochs.info["sfreq"] >= 2000:
-        epochs.decimate(4)
-    elif epochs.info["sfreq"] >= 1000:
-        epochs.decimate(2)
+    if raw.info["sfreq"] >= 2000:
+        decim = 4
+    elif raw.info["sfreq"] >= 1000:
+        decim = 2
+    else:
+        decim = 1
+    # Each miniblock is read from the raw file, and decimated, only when the spectra reach it
+    epochs = miniblock_epochs(raw, tmin=-0.2, tmax=minidur, decim=decim)
     sfreq = epochs.info["sfreq"]
 
     # Compute source space PSD and then SNR
@@ -208,13 +281,41 @@ if __name__ == "__main__":
     psd_kwargs = analysis_spec.source_fft_pars.copy()
     psd_kwargs.update(
         dict(
-            inverse_operator=inv,
             sfreq=sfreq,
             n_fft=int(epochs.info["sfreq"] * (tmax - tmin)),
             n_jobs=-1,
         )
     )
 
+    if args.freq_domain_inverse:
+        lambda2, method = psd_kwargs["lambda2"], psd_kwargs["method"]
+
+        def compute_kernel():
+            return ima.InverseKernel.from_inverse(get_inverse(), lambda2=lambda2, method=method)
+
+        if source_cache is None:
+            kernel = compute_kernel()
+        else:
+            kernel_key = solution_key(
+                "inverse_kernel", inv_bidspath.fpath, get_inverse, lambda2, method
+            )
+            kernel = source_cache.inverse_kernel(kernel_key, compute_kernel)
+        # Same single boxcar segment from the start of each epoch as `psd_array_welch` uses
+        spectra = ima.EpochSpectra.from_epochs(
+            epochs,
+            fmin=psd_kwargs["fmin"],
+            fmax=psd_kwargs["fmax"],
+            n_fft=psd_kwargs["n_fft"],
+            picks=kernel.ch_names,
+        )
+    else:
+        psd_kwargs["inverse_operator"] = get_inverse()
+
+    def source_psd(label):
+        if args.freq_domain_inverse:
+            return source_psd_freq_domain(spectra, label, kernel, args.subject, args.session)
+        return source_psd_epochs_avg(epochs[label], psd_kwargs, args.subject, args.session)
+
     print("Computing SNR for oneword+twoword, per condition and all conditions...")
     owbase = f"sub-{args.subject}_ses-{args.session}_task-{args.task}_desc-{morphstr}oneword"
     twbase = f"sub-{args.subject}_ses-{args.session}_task-{args.task}_desc-{morphstr}twoword"
@@ -231,58 +332,38 @@ if __name__ == "__main__":
             oneword = task == "ONEWORD"
             tasktag = tag if oneword else twtag
             all_label = f"{task}/{tasktag}"
-            psdavg, freqs, plotstc = source_psd_epochs_avg(
-                epochs[f"MINIBLOCK/{all_label}"], psd_kwargs, args.subject, args.session
-            )
+            psdavg, freqs, plotstc = source_psd(f"MINIBLOCK/{all_label}")
             snrs = ima.snr_spectrum(
                 psdavg,
                 noise_n_neighbor_freqs=snr_neighbor_K,
                 noise_skip_neighbor_freqs=snr_skip_neighbor_J,
             )
-            if args.morph_fsaverage:  # If requested, morph both the PSD and SNR into fsavg space
-                psdavg, snrs, plotstc = morph_psd_and_snr(plotstc, psdavg, snrs)
 
             allcond[tasktag] = dict(psd=psdavg, freqs=freqs, snrs=snrs, stc=plotstc)
 
             taskconds = ["WORD", "NONWORD"] if oneword else ["PHRASE", "NONPHRASE", "NONWORD"]
             for cond in taskconds:
                 cond_label = f"MINIBLOCK/{task}/{cond}/{tasktag}"
-                psdavg, freqs, plotstc = source_psd_epochs_avg(
-                    epochs[cond_label], psd_kwargs, args.subject, args.session
-                )
+                psdavg, freqs, plotstc = source_psd(cond_label)
                 print(psdavg.shape, freqs.shape, plotstc.data.shape, plotstc.times.shape)
                 snrs = ima.snr_spectrum(
                     psdavg,
                     noise_n_neighbor_freqs=snr_neighbor_K,
                     noise_skip_neighbor_freqs=snr_skip_neighbor_J,
                 )
-                if args.morph_fsaverage:
-                    psdavg, snrs, plotstc = morph_psd_and_snr(plotstc, psdavg, snrs)
 
-                percond[f"{cond}/{tasktag}"] = dict(
-                    psd=psdavg, freqs=freqs, snrs=snrs, stc=plotstc
-                )
+                percond[f"{cond}/{tasktag}"] = dict(psd=psdavg, freqs=freqs, snrs=snrs, stc=plotstc)
+    if args.morph_fsaverage:  # If requested, morph both the PSDs and SNRs into fsavg space
+        morph_psds_and_snrs(
+            morph, allcond_spectra_ow, allcond_spectra_tw, percond_spectra_ow, percond_spectra_tw
+        )
     print("Done.")
     print(f"Saving data to {procpath} ...")
-    with open(
-        procpath / f"{owbase}_allcondSNRsource.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(allcond_spectra_ow, f)
-    with open(
-        procpath / f"{twbase}_allcondSNRsource.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(allcond_spectra_tw, f)
-    with open(
-        procpath / f"{owbase}_percondSNRsource.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(percond_spectra_ow, f)
-    with open(
-        procpath / f"{twbase}_percondSNRsource.pkl",
-        "wb",
-    ) as f:
-        pickle.dump(percond_spectra_tw, f)
-
+    for fname, spectra_dict in (
+        (f"{owbase}_allcondSNRsource", allcond_spectra_ow),
+        (f"{twbase}_allcondSNRsource", allcond_spectra_tw),
+        (f"{owbase}_percondSNRsource", percond_spectra_ow),
+        (f"{twbase}_percondSNRsource", percond_spectra_tw),
+    ):
+        save_spectral_store(procpath / fname, spectra_dict, overwrite=True)
     print("Done.\n")
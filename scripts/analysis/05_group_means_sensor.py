@@ -1,12 +1,11 @@
-import pickle
 from collections import defaultdict
-from copy import deepcopy
 
 import numpy as np
 from tqdm import tqdm
 
 import intermodulation.analysis as ima
 from intermodulation import analysis_spec
+from intermodulation.spectral_store import SpectralStore, find_stores
 
 if __name__ == "__main__":
     parser = analysis_spec.make_parser(group_level=True, plots=True)
@@ -43,14 +42,17 @@ if __name__ == "__main__":
 
     derivatives_root = bids_root / "derivatives/mne-bids-pipeline"
 
-    # Load in PSD, SNR data from individual subject files
-    subfiles_allcond = {}
-    subfiles_percond = {}
-
-    template_dict = {"ONEWORD": defaultdict(list), "TWOWORD": defaultdict(list)}
-
-    psds_allcond = deepcopy(template_dict)
-    psds_percond = deepcopy(template_dict)
+    def save_grand_means(path, label, psd_mean):
+        # The grand-mean SNR comes from the grand-mean PSD, not from averaging subject SNRs
+        grand_mean_snr = ima.snr_spectrum(
+            psd_mean.mean,
+            noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
+            noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
+        )
+        label = label.replace("/", "-")
+        np.save(path / f"sensor_grand_mean_psd_{label}.npy", psd_mean.mean)
+        np.save(path / f"sensor_grand_sem_psd_{label}.npy", psd_mean.sem)
+        np.save(path / f"sensor_grand_mean_snr_{label}.npy", grand_mean_snr)
 
     owconds = ("WORD", "NONWORD")
     twconds = ("PHRASE", "NONPHRASE", "NONWORD")
@@ -65,80 +67,37 @@ if __name__ == "__main__":
         percond_path_task = percond_path / task.lower()
         percond_path_task.mkdir(parents=True, exist_ok=True)
 
-        subfiles_allcond[task] = list(
-            derivatives_root.rglob(
-                f"sub-*_ses-*_task-{args.task}_proc-{args.proc}_desc-{meanstr + task.lower()}_allcondSNR.pkl"
-            )
+        subfiles_allcond = find_stores(
+            derivatives_root,
+            f"sub-*_ses-*_task-{args.task}_proc-{args.proc}_desc-{meanstr + task.lower()}_allcondSNR",
         )
-        subfiles_percond[task] = list(
-            derivatives_root.rglob(
-                f"sub-*_ses-*_task-{args.task}_proc-{args.proc}_desc-{meanstr + task.lower()}_percondSNR.pkl"
-            )
+        subfiles_percond = find_stores(
+            derivatives_root,
+            f"sub-*_ses-*_task-{args.task}_proc-{args.proc}_desc-{meanstr + task.lower()}_percondSNR",
         )
-        for tasktag in tqdm(tasktags, desc=f"Processing task {task} freq tags", leave=False):
-            all_label = f"{task}/{tasktag}"
-            for i, file in tqdm(
-                enumerate(subfiles_allcond[task]),
-                desc=f"Processing {all_label} files",
-                leave=False,
-            ):
-                with open(file, "rb") as f:
-                    filedata = pickle.load(f)
-                if not args.cond_mean:
-                    subpsd = np.mean(filedata[tasktag]["psds"], axis=0)
-                else:
-                    subpsd = filedata[tasktag]["psds"]
-                psds_allcond[task][tasktag].append(subpsd)
-            grand_mean_psd = np.mean(psds_allcond[task][tasktag], axis=0)
-            psds_allcond[task][tasktag] = []
-            # grand_mean_snr = np.average(snrs_allcond[task][tasktag], axis=0)
-            grand_mean_snr = ima.snr_spectrum(
-                grand_mean_psd,
-                noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
-                noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
-            )
-
-            np.save(
-                allcond_path_task / f"sensor_grand_mean_psd_{tasktag}.npy",
-                grand_mean_psd,
-            )
-            np.save(
-                allcond_path_task / f"sensor_grand_mean_snr_{tasktag}.npy",
-                grand_mean_snr,
-            )
 
-            for file in tqdm(
-                subfiles_percond[task], desc=f"Processing {all_label} conds", leave=False
-            ):
-                with open(file, "rb") as f:
-                    filedata = pickle.load(f)
-
-                for i, cond in enumerate(taskconds):
+        # Each subject store is read once, updating the running mean of every tag and condition
+        psds_allcond = defaultdict(ima.RunningMean)
+        for file in tqdm(subfiles_allcond, desc=f"Processing {task} files", leave=False):
+            filedata = SpectralStore(file)
+            for tasktag in tasktags:
+                subpsd = filedata[tasktag]["psds"]
+                if not args.cond_mean:
+                    subpsd = np.mean(subpsd, axis=0)
+                psds_allcond[tasktag].update(subpsd)
+
+        psds_percond = defaultdict(ima.RunningMean)
+        for file in tqdm(subfiles_percond, desc=f"Processing {task} conds", leave=False):
+            filedata = SpectralStore(file)
+            for tasktag in tasktags:
+                for cond in taskconds:
                     cond_label = f"{cond}/{tasktag}"
+                    subpsd = filedata[f"{task}/{cond_label}"]["psds"]
                     if not args.cond_mean:
-                        subpsd = np.mean(filedata["/".join((task, cond_label))]["psds"], axis=0)
-                    else:
-                        subpsd = filedata["/".join((task, cond_label))]["psds"]
-                    psds_percond[task][cond_label].append(subpsd)
-
-            for cond in taskconds:
-                cond_label = f"{cond}/{tasktag}"
-
-                grand_mean_psd = np.average(psds_percond[task][cond_label], axis=0)
-                psds_percond[task][cond_label] = []
-                # grand_mean_snr = np.average(snrs_percond[task][cond_label], axis=0)
-                grand_mean_snr = ima.snr_spectrum(
-                    grand_mean_psd,
-                    noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
-                    noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
-                )
+                        subpsd = np.mean(subpsd, axis=0)
+                    psds_percond[cond_label].update(subpsd)
 
-                cond_label = cond_label.replace("/", "-")
-                np.save(
-                    percond_path_task / f"sensor_grand_mean_psd_{cond_label}.npy",
-                    grand_mean_psd,
-                )
-                np.save(
-                    percond_path_task / f"sensor_grand_mean_snr_{cond_label}.npy",
-                    grand_mean_snr,
-                )
+        for tasktag, psd_mean in psds_allcond.items():
+            save_grand_means(allcond_path_task, tasktag, psd_mean)
+        for cond_label, psd_mean in psds_percond.items():
+            save_grand_means(percond_path_task, cond_label, psd_mean)
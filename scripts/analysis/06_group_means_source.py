@@ -1,12 +1,11 @@
-import pickle
 from collections import defaultdict
-from copy import deepcopy
 
 import numpy as np
 from tqdm import tqdm
 
 import intermodulation.analysis as ima
 from intermodulation import analysis_spec
+from intermodulation.spectral_store import SpectralStore, find_stores
 
 if __name__ == "__main__":
     parser = analysis_spec.make_parser(group_level=True, plots=True)
@@ -31,17 +30,28 @@ if __name__ == "__main__":
     fs_root = bids_root / "derivatives/freesurfer"
     fs_sub = "fsaverage"
 
-    # Load in PSD, SNR data from individual subject files
-    subfiles_allcond = {}
-    subfiles_percond = {}
-
-    template_dict = {"ONEWORD": defaultdict(list), "TWOWORD": defaultdict(list)}
-
-    psds_allcond = deepcopy(template_dict)
-    snrs_allcond = deepcopy(template_dict)
-
-    psds_percond = deepcopy(template_dict)
-    snrs_percond = deepcopy(template_dict)
+    def save_grand_means(path, label, psd_mean, template_stc, prefix="source_"):
+        # The grand-mean SNR comes from the grand-mean PSD, not from averaging subject SNRs
+        grand_mean_psd = psd_mean.mean
+        grand_mean_snr = ima.snr_spectrum(
+            grand_mean_psd,
+            noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
+            noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
+        )
+        label = label.replace("/", "-")
+        np.save(path / f"source_grand_mean_psd_{label}.npy", grand_mean_psd)
+        np.save(path / f"source_grand_sem_psd_{label}.npy", psd_mean.sem)
+        np.save(path / f"source_grand_mean_snr_{label}.npy", grand_mean_snr)
+
+        for kind, data in (("psd", grand_mean_psd), ("snr", grand_mean_snr)):
+            mean_stc = template_stc.copy()
+            mean_stc.data = np.nan_to_num(data)
+            mean_stc.save(
+                path / f"{prefix}grand_mean_{kind}_{label}",
+                ftype="stc",
+                overwrite=True,
+                verbose="error",
+            )
 
     owconds = ("WORD", "NONWORD")
     twconds = ("PHRASE", "NONPHRASE", "NONWORD")
@@ -56,113 +66,43 @@ if __name__ == "__main__":
         percond_path_task = percond_path / task.lower()
         percond_path_task.mkdir(parents=True, exist_ok=True)
 
-        subfiles_allcond[task] = list(
-            derivatives_root.rglob(
-                f"sub-*_ses-*_task-{args.task}_desc-morphFSAVG{task.lower()}_allcondSNRsource.pkl"
-            )
+        subfiles_allcond = find_stores(
+            derivatives_root,
+            f"sub-*_ses-*_task-{args.task}_desc-morphFSAVG{task.lower()}_allcondSNRsource",
         )
-        subfiles_percond[task] = list(
-            derivatives_root.rglob(
-                f"sub-*_ses-*_task-{args.task}_desc-morphFSAVG{task.lower()}_percondSNRsource.pkl"
-            )
+        subfiles_percond = find_stores(
+            derivatives_root,
+            f"sub-*_ses-*_task-{args.task}_desc-morphFSAVG{task.lower()}_percondSNRsource",
         )
-        for tasktag in tqdm(tasktags, desc=f"Processing task {task} freq tags", leave=False):
-            all_label = f"{task}/{tasktag}"
-            for i, file in tqdm(
-                enumerate(subfiles_allcond[task]),
-                desc=f"Processing {all_label} files",
-                leave=False,
-            ):
-                with open(file, "rb") as f:
-                    filedata = pickle.load(f)
-                psds_allcond[task][tasktag].append(filedata[tasktag]["psd"])
-                snrs_allcond[task][tasktag].append(filedata[tasktag]["snrs"])
-                if i == 0:
-                    template_stc = filedata[tasktag]["stc"]
-            grand_mean_psd = np.average(psds_allcond[task][tasktag], axis=0)
-            psds_allcond[task][tasktag] = []
-            # grand_mean_snr = np.average(snrs_allcond[task][tasktag], axis=0)
-            grand_mean_snr = ima.snr_spectrum(
-                grand_mean_psd,
-                noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
-                noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
-            )
-            snrs_allcond[task][tasktag] = []
-
-            np.save(
-                allcond_path_task / f"source_grand_mean_psd_{tasktag}.npy",
-                grand_mean_psd,
-            )
-            np.save(
-                allcond_path_task / f"source_grand_mean_snr_{tasktag}.npy",
-                grand_mean_snr,
-            )
 
-            mean_psd_stc = template_stc.copy()
-            mean_psd_stc.data = np.nan_to_num(grand_mean_psd)
-            mean_psd_stc.save(
-                allcond_path_task / f"grand_mean_psd_{tasktag}",
-                ftype="stc",
-                overwrite=True,
-                verbose="error",
-            )
-
-            mean_snr_stc = template_stc.copy()
-            mean_snr_stc.data = np.nan_to_num(grand_mean_snr)
-            mean_snr_stc.save(
-                allcond_path_task / f"grand_mean_snr_{tasktag}",
-                ftype="stc",
-                overwrite=True,
-                verbose="error",
-            )
-
-            for file in tqdm(
-                subfiles_percond[task], desc=f"Processing {all_label} conds", leave=False
-            ):
-                with open(file, "rb") as f:
-                    filedata = pickle.load(f)
-
-                for i, cond in enumerate(taskconds):
-                    cond_label = f"{cond}/{tasktag}"
-                    psds_percond[task][cond_label].append(filedata[cond_label]["psd"])
-                    snrs_percond[task][cond_label].append(filedata[cond_label]["snrs"])
-                    if i == 0:
-                        template_stc = filedata[cond_label]["stc"]
-
-                    grand_mean_psd = np.average(psds_percond[task][cond_label], axis=0)
-                    psds_percond[task][cond_label] = []
-                    # grand_mean_snr = np.average(snrs_percond[task][cond_label], axis=0)
-                    grand_mean_snr = ima.snr_spectrum(
-                        grand_mean_psd,
-                        noise_n_neighbor_freqs=analysis_spec.noise_n_neighbor_freqs,
-                        noise_skip_neighbor_freqs=analysis_spec.noise_skip_neighbor_freqs,
+        # Each subject store is read once, updating the running mean of every tag and condition
+        psds_allcond = defaultdict(ima.RunningMean)
+        templates_allcond = {}
+        for file in tqdm(subfiles_allcond, desc=f"Processing {task} files", leave=False):
+            filedata = SpectralStore(file)
+            for tasktag in tasktags:
+                psds_allcond[tasktag].update(filedata[tasktag]["psd"])
+                if tasktag not in templates_allcond:
+                    templates_allcond[tasktag] = filedata.source_estimate(
+                        tasktag, filedata[tasktag]["psd"]
                     )
-                    snrs_percond[task][cond_label] = []
 
-                    cond_label = cond_label.replace("/", "-")
-                    np.save(
-                        percond_path_task / f"source_grand_mean_psd_{cond_label}.npy",
-                        grand_mean_psd,
-                    )
-                    np.save(
-                        percond_path_task / f"source_grand_mean_snr_{cond_label}.npy",
-                        grand_mean_snr,
-                    )
-
-                    mean_psd_stc = template_stc.copy()
-                    mean_psd_stc.data = np.nan_to_num(grand_mean_psd)
-                    mean_psd_stc.save(
-                        percond_path_task / f"source_grand_mean_psd_{cond_label}",
-                        ftype="stc",
-                        overwrite=True,
-                        verbose="error",
-                    )
-
-                    mean_snr_stc = template_stc.copy()
-                    mean_snr_stc.data = np.nan_to_num(grand_mean_snr)
-                    mean_snr_stc.save(
-                        percond_path_task / f"source_grand_mean_snr_{cond_label}",
-                        ftype="stc",
-                        overwrite=True,
-                        verbose="error",
-                    )
+        psds_percond = defaultdict(ima.RunningMean)
+        templates_percond = {}
+        for file in tqdm(subfiles_percond, desc=f"Processing {task} conds", leave=False):
+            filedata = SpectralStore(file)
+            for tasktag in tasktags:
+                for cond in taskconds:
+                    cond_label = f"{cond}/{tasktag}"
+                    psds_percond[cond_label].update(filedata[cond_label]["psd"])
+                    if cond_label not in templates_percond:
+                        templates_percond[cond_label] = filedata.source_estimate(
+                            cond_label, filedata[cond_label]["psd"]
+                        )
+
+        for tasktag, psd_mean in psds_allcond.items():
+            save_grand_means(
+                allcond_path_task, tasktag, psd_mean, templates_allcond[tasktag], prefix=""
+            )
+        for cond_label, psd_mean in psds_percond.items():
+            save_grand_means(percond_path_task, cond_label, psd_mean, templates_percond[cond_label])
@@ -6,8 +6,11 @@ import numpy as np
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 
+import intermodulation.imfreqs as imf
 import intermodulation.plot as imp
 from intermodulation.analysis_spec import make_parser, psd_plot_freqs
+from intermodulation.freqtag_spec import FREQUENCIES
+from intermodulation.spectral_store import SpectralStore
 
 if __name__ == "__main__":
     parser = make_parser(group_level=True, plots=True)
@@ -46,7 +49,7 @@ if __name__ == "__main__":
             check=False,  # Need to disable checking for derivatives
         )
     ).crop(0, 1.0, verbose="error")
-    freqs = np.load(
+    freqs = SpectralStore(
         mnb.BIDSPath(
             subject=sensor_info_sub,
             session="01",
@@ -54,12 +57,10 @@ if __name__ == "__main__":
             processing="clean",
             datatype="meg",
             suffix="allcondSNR",
-            extension=".pkl",
             description="oneword",
             root=args.bids_root / "derivatives/mne-bids-pipeline",
             check=False,  # Need to disable checking for derivatives
-        ),
-        allow_pickle=True,
+        ).fpath
     )["F1"]["freqs"]
 
     allcond_data = args.results_dir / "sub-all/allcond"
@@ -73,7 +74,9 @@ if __name__ == "__main__":
 
     samprate_correction = (2 * 1000) / (args.meg_true_samprate * 2)
 
-    tag_f = (6, 7.05882353)
+    # Tag frequencies, their harmonics and the f2-f1, f1+f2 IMs
+    tw_tagfreqs = imf.im_frequencies(FREQUENCIES, max_order=2)
+    ow_tagfreqs = dict(zip(("F1", "F2"), FREQUENCIES))
 
     tasks = ("ONEWORD", "TWOWORD")
     ow_tags = ("F1", "F2")
@@ -127,16 +130,9 @@ if __name__ == "__main__":
             ax = axes[:, i]
             if not oneword:
                 # Vertical lines at tag frequencies and f2-f1, f1+f2 IMs
-                tagfreq = [
-                    7.05882353 - 6.0,
-                    6.0,
-                    7.05882353,
-                    2 * 6,
-                    6 + 7.05882353,
-                    2 * 7.05882353,
-                ]
+                tagfreq = tw_tagfreqs
             else:
-                tagfreq = {"F1": 6.0, "F2": 7.05882353}[tag]
+                tagfreq = ow_tagfreqs[tag]
             titlestr = title_taskpart[int(not oneword)] + title_tagpart[task][tag] + title_allcond
             imp.plot_snr(
                 mean_psd,
@@ -192,16 +188,9 @@ if __name__ == "__main__":
                     name = "twoword" if oneword else "oneword"
                 if not oneword:
                     # Vertical lines at tag frequencies and f2-f1, f1+f2 IMs
-                    tagfreq = [
-                        7.05882353 - 6.0,
-                        6.0,
-                        7.05882353,
-                        2 * 6,
-                        6 + 7.05882353,
-                        2 * 7.05882353,
-                    ]
+                    tagfreq = tw_tagfreqs
                 else:
-                    tagfreq = {"F1": 6.0, "F2": 7.05882353}[tag]
+                    tagfreq = ow_tagfreqs[tag]
                 titlestr = (
                     title_taskpart[int(not oneword)]
                     + title_condpart[task][cond]
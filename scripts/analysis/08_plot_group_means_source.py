@@ -2,9 +2,10 @@ from pathlib import Path
 
 import mne
 import numpy as np
-import pandas as pd
 
+import intermodulation.imfreqs as imf
 from intermodulation.analysis_spec import make_parser, pick_points
+from intermodulation.spectral_store import SpectralStore
 
 
 def get_clim_pct(
@@ -79,8 +80,6 @@ if __name__ == "__main__":
     (savepath / "allcond").mkdir(parents=True, exist_ok=True)
     (savepath / "percond").mkdir(parents=True, exist_ok=True)
 
-    tag_f = (6, 7.05882353)
-
     tasks = ("ONEWORD", "TWOWORD")
     ow_tags = ("F1", "F2")
     tw_tags = ("F1LEFT", "F1RIGHT")
@@ -131,13 +130,15 @@ if __name__ == "__main__":
         },
     }
 
-    f_offset = (1 / 28.333333) * args.freq_bin_offset
-    f_idx_offset = args.freq_bin_offset
-
-    freqs = pd.read_pickle(
+    freqs = SpectralStore(
         args.bids_root / "derivatives/mne-bids-pipeline/sub-02/ses-01/meg/"
-        "sub-02_ses-01_task-syntaxIM_desc-morphFSAVGtwoword_allcondSNRsource.pkl"
+        "sub-02_ses-01_task-syntaxIM_desc-morphFSAVGtwoword_allcondSNRsource"
     )["F1LEFT"]["freqs"]
+    # Bins of the tags and f2-f1, f1+f2 IMs, shifted by the sample rate correction
+    catalogue = imf.im_catalogue_from_freqs(freqs, bin_offset=args.freq_bin_offset)
+    catalogue = catalogue[
+        (catalogue["order"] == 1) | ((catalogue["n"] != 0) & (catalogue["m"] != 0))
+    ]
 
     for task in tasks:
         oneword = True if task == "ONEWORD" else False
@@ -155,22 +156,21 @@ if __name__ == "__main__":
             data = stc.data.copy()
             # First all-conditions-combined plots
             if oneword:
-                plotfreqs = (tag_f[0],) if tag == "F1" else (tag_f[1],)
+                plotfreqs = catalogue.loc[["f1"] if tag == "F1" else ["f2"]]
             else:
-                plotfreqs = (tag_f[0], tag_f[1], tag_f[1] - tag_f[0], tag_f[1] + tag_f[0])
-            for f in plotfreqs:
+                plotfreqs = catalogue
+            for f, fidx, bin_f in plotfreqs[["freq", "idx", "bin_freq"]].itertuples(index=False):
                 curr_title = (
                     title_taskpart[int(not oneword)] + title_tagpart[task][tag] + title_allcond
                 )
                 stc.data = data
-                fidx = np.abs(freqs - f).argmin() + f_idx_offset
                 if allcond_clim is None:
                     currclim = get_clim_pct(data, fidx, lb, mv, ub)
                 else:
                     currclim = allcond_clim
 
                 brain = stc.plot(
-                    initial_time=f + f_offset,
+                    initial_time=bin_f,
                     clim=currclim,
                     title=curr_title,
                     **brain_kwargs,
@@ -187,22 +187,22 @@ if __name__ == "__main__":
                     stc_root / f"percond/{task.lower()}/grand_mean_snr_{cond}-{tag}-lh.stc"
                 )
                 data = stc.data.copy()
-                for f in plotfreqs:
+                for f, fidx, bin_f in plotfreqs[["freq", "idx", "bin_freq"]].itertuples(
+                    index=False
+                ):
                     curr_title = (
                         title_taskpart[int(not oneword)]
                         + title_tagpart[task][tag]
                         + title_condpart[task][cond]
                     )
                     stc.data = data
-
-                    fidx = np.abs(freqs - f).argmin() + f_idx_offset
                     if allcond_clim is None:
                         currclim = get_clim_pct(data, fidx, lb, mv, ub)
                     else:
                         currclim = percond_clim
 
                     brain = stc.plot(
-                        initial_time=f + f_offset,
+                        initial_time=bin_f,
                         clim=currclim,
                         title=curr_title,
                         **brain_kwargs,
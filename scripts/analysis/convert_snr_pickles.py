@@ -0,0 +1,38 @@
+"""
+Convert the pickled per-subject spectra (`*SNR.pkl`, `*SNRsource.pkl`) written by older versions of
+`02_subject_sensor_snr.py` and `04_subject_source_snr.py` into spectral stores next to them.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+from tqdm import tqdm
+
+from intermodulation.spectral_store import convert_pickle
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "root",
+        type=Path,
+        help="Directory to search for pickles, e.g. the mne-bids-pipeline derivatives root",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        default="sub-*_*SNR*.pkl",
+        help="Glob pattern of the pickle file names to convert",
+    )
+    parser.add_argument("--overwrite", action="store_true", help="Overwrite existing stores")
+    parser.add_argument(
+        "--remove", action="store_true", help="Delete each pickle once it has been converted"
+    )
+    args = parser.parse_args()
+
+    pickles = sorted(args.root.rglob(args.pattern))
+    print(f"Found {len(pickles)} pickles to convert under {args.root}")
+    for pkl_path in tqdm(pickles, desc="Converting"):
+        convert_pickle(pkl_path, overwrite=args.overwrite)
+        if args.remove:
+            pkl_path.unlink()
+    print("Done.")
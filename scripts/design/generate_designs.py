@@ -0,0 +1,68 @@
+"""
+Generate and validate the miniblock task designs of many seeds for both stimulus groups, and write
+them to a design file from which `scripts/experiments/miniblock_task.py` loads the design of a
+session instead of preparing it at the start of the session.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import intermodulation.freqtag_spec as spec
+from intermodulation.design import design_arrays, save_designs, stimulus_paths
+
+
+@lru_cache
+def read_stimuli(stimpath: Path, group: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Read once per worker process and group
+    path_1w, path_2w = stimulus_paths(stimpath, group)
+    return pd.read_csv(path_1w, index_col=0), pd.read_csv(path_2w, index_col=0)
+
+
+def make_design(stimpath: Path, group: str, seed: int, miniblock_len: int, N_blocks: int):
+    # The same random number generator as the experiment script creates for the seed
+    onewords, twowords = read_stimuli(stimpath, group)
+    rng = np.random.default_rng(seed)
+    arrays, problems = design_arrays(onewords, twowords, rng, miniblock_len, N_blocks)
+    return (seed, group), arrays, problems
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("output", type=Path, help="Design file to write, e.g. designs.npz")
+    parser.add_argument("--seeds", type=int, default=256, help="Number of seeds, from 0")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--groups", nargs="+", default=["even", "odd"], choices=["even", "odd"])
+    parser.add_argument("--stimpath", type=Path, default=spec.STIMPATH)
+    parser.add_argument("--miniblock-len", type=int, default=spec.MINIBLOCK_LEN)
+    parser.add_argument("--n-blocks", type=int, default=spec.N_BLOCKS)
+    parser.add_argument("--n-jobs", type=int, default=None, help="Worker processes, default all")
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    jobs = [(group, seed) for group in args.groups for seed in seeds]
+    designs = {}
+    invalid = {}
+    with ProcessPoolExecutor(max_workers=args.n_jobs) as pool:
+        futures = [
+            pool.submit(make_design, args.stimpath, group, seed, args.miniblock_len, args.n_blocks)
+            for group, seed in jobs
+        ]
+        for future in tqdm(futures, desc="Generating designs"):
+            key, arrays, problems = future.result()
+            if problems:
+                invalid[key] = problems
+            else:
+                designs[key] = arrays
+
+    for (seed, group), problems in sorted(invalid.items()):
+        print(f"Seed {seed} of the {group} group is invalid: {'; '.join(problems)}")
+    if not designs:
+        raise RuntimeError("None of the generated designs is valid.")
+    save_designs(args.output, designs, args.miniblock_len, args.n_blocks, args.stimpath)
+    print(f"Wrote {len(designs)} of {len(jobs)} designs to {args.output}")
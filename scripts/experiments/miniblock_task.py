@@ -12,7 +12,10 @@ from byte_triggers import MockTrigger, ParallelPortTrigger
 from mnemonic import Mnemonic
 from psychopy.gui import DlgFromDict
 
+import intermodulation.design as imd
 import intermodulation.freqtag_spec as spec
+import intermodulation.frame_timing as imft
+import intermodulation.log_writer as imlw
 import intermodulation.states as ims
 import intermodulation.stimuli as imst
 import intermodulation.utils as imu
@@ -72,19 +75,36 @@ if subinfo["debug"]:  # Override the experiment parameters with the debug ones i
 ####################################
 
 group = "even" if subinfo["even_group"] == 0 else "odd"
-onewordpath = spec.STIMPATH / f"{group}_one_word_stimuli.csv"
-twowordpath = spec.STIMPATH / f"new_{group}_two_word_stimuli.csv"
+onewordpath, twowordpath = imd.stimulus_paths(spec.STIMPATH, group)
 
 rng = np.random.default_rng(subinfo["seed"])
-# Prepare word stimuli by first shuffling, then assigning frequencies
-onewords, twowords, allwords = imu.load_prep_words(
-    path_1w=onewordpath,
-    path_2w=twowordpath,
-    rng=rng,
-    miniblock_len=spec.MINIBLOCK_LEN,
-    N_blocks=3,
-    freqs=[stimpars["f1"], stimpars["f2"]],
-)
+design = None
+if spec.DESIGN_PATH is not None:
+    # Load the pre-generated and validated design of the seed. This does not draw from `rng`, so
+    # the later random draws differ from those of a session preparing the words of the seed.
+    try:
+        design = imd.load_design(
+            spec.DESIGN_PATH,
+            seed=subinfo["seed"],
+            group=group,
+            stimpath=spec.STIMPATH,
+            miniblock_len=spec.MINIBLOCK_LEN,
+            N_blocks=3,
+            freqs=[stimpars["f1"], stimpars["f2"]],
+        )
+    except KeyError as err:
+        print(f"{err.args[0]} Preparing the words instead.")
+if design is None:
+    # Prepare word stimuli by first shuffling, then assigning frequencies
+    design = imu.load_prep_words(
+        path_1w=onewordpath,
+        path_2w=twowordpath,
+        rng=rng,
+        miniblock_len=spec.MINIBLOCK_LEN,
+        N_blocks=3,
+        freqs=[stimpars["f1"], stimpars["f2"]],
+    )
+onewords, twowords, allwords = design
 twowords.reset_index(drop=True, inplace=True)
 try:
     twowords.drop(columns=["Unnamed: 0", "index"], inplace=True)
@@ -169,6 +189,16 @@ onewordstim = imst.OneWordStim(
     text_config=spec.TEXT_CONFIG,
 )
 fixstim = imst.FixationStim(window)
+if spec.PRERENDER_WORDS:
+    wordstim.texture_cache = imst.WordTextureCache.build(
+        wordstim, {"word1": twowords["w1"], "word2": twowords["w2"]}
+    )
+    onewordstim.texture_cache = imst.WordTextureCache.build(onewordstim, {"word1": onewords["w1"]})
+    for name, stim in (("two-word", wordstim), ("one-word", onewordstim)):
+        print(
+            f"Pre-rendered {stim.texture_cache.n_textures} {name} textures, "
+            f"{stim.texture_cache.nbytes / 1e6:.1f} MB."
+        )
 
 query_cats = [
     ("word", "seen"),
@@ -179,14 +209,14 @@ query_cats = [
 
 query_tracker_2w = imu.QueryTracker(
     miniblock=0,
-    last_words=twowords.query("miniblock == 0"),
+    word_list=twowords,
     allwords=allwords,
     categories=query_cats.copy(),
     rng=rng,
 )
 query_tracker_1w = imu.QueryTracker(
     miniblock=0,
-    last_words=onewords.query("miniblock == 0"),
+    word_list=onewords,
     allwords=allwords,
     categories=query_cats.copy(),
     rng=rng,
@@ -442,7 +472,12 @@ def newblock_trig(trigger, triggers):
 def save_and_quit():
     subj = subinfo["subject"]
     date = subinfo["date"]
-    controller.logger.save(f"interrupted_{subj}_{date}.pkl")
+    log_writer.flush_log(controller.logger)
+    log_writer.close()
+    for name, state in (("twoword", twoword), ("oneword", oneword)):
+        imft.save_timing_summaries(
+            state.timing_summaries, f"interrupted_{subj}_{date}_{name}_frame_timing.csv"
+        )
     controller.quit()
     window.close()
     exit()
@@ -473,6 +508,22 @@ controller_1w = pc.ExperimentController(
 
 controller = controller_2w
 
+
+def open_log_writer(task):
+    # Logs are written out as the experiment runs, to `<task>_<subject>_<date>_<kind>.csv`
+    prefix = f"{task}_{subinfo['subject']}_{subinfo['date']}"
+    return imlw.AsyncLogWriter(f"{prefix}_states.csv", f"{prefix}_continuous.csv")
+
+
+def flush_logs():
+    # Hand the logs of all finished states to the writer thread, outside of the word states
+    log_writer.flush_log(controller.logger, before=controller.state_num)
+
+
+log_writer = open_log_writer("twoword")
+iti.start_calls.append(flush_logs)
+querypause.start_calls.append(flush_logs)
+
 starting = False
 
 
@@ -503,11 +554,12 @@ if not subinfo["debug"] or not stimpars["skip_twoword"]:
     psyev.globalKeys.add(key="q", modifiers=["ctrl"], func=save_and_quit)
 
     controller_2w.run_experiment()
-    if subinfo["debug"]:
-        controller_2w.logger.contdf.to_csv("testcont.csv")
-        controller_2w.logger.statesdf.to_csv("teststates.csv")
-    else:
-        controller_2w.logger.save(f"twoword_{subinfo['subject']}_{subinfo['date']}.pkl")
+    log_writer.flush_log(controller_2w.logger)
+    log_writer.close()
+    imft.save_timing_summaries(
+        twoword.timing_summaries,
+        f"twoword_{subinfo['subject']}_{subinfo['date']}_frame_timing.csv",
+    )
 
 trigger.signal(spec.TRIGGERS.EXPEND)
 
@@ -530,6 +582,7 @@ del pausetxt
 psyev.globalKeys.clear()
 
 controller = controller_1w
+log_writer = open_log_writer("oneword")
 psyev.globalKeys.add(key="p", modifiers=["ctrl"], func=controller_1w.toggle_pause)
 psyev.globalKeys.add(key=spec.PAUSE_KEY, func=controller_2w.toggle_pause)
 psyev.globalKeys.add(key="q", modifiers=["ctrl"], func=save_and_quit)
@@ -537,11 +590,12 @@ psyev.globalKeys.add(key="q", modifiers=["ctrl"], func=save_and_quit)
 
 if not subinfo["debug"] or not stimpars["skip_oneword"]:
     controller_1w.run_experiment()
-    if subinfo["debug"]:
-        controller_2w.logger.contdf.to_csv("testcont_1w.csv")
-        controller_2w.logger.statesdf.to_csv("teststates_1w.csv")
-    else:
-        controller_2w.logger.save(f"oneword_{subinfo['subject']}_{subinfo['date']}.pkl")
+    log_writer.flush_log(controller_1w.logger)
+    log_writer.close()
+    imft.save_timing_summaries(
+        oneword.timing_summaries,
+        f"oneword_{subinfo['subject']}_{subinfo['date']}_frame_timing.csv",
+    )
 trigger.signal(spec.TRIGGERS.EXPEND)
 
 window.close()